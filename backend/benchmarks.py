@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Backend micro-benchmarks.
+
+Runs against the MongoDB configured in backend/.env, using a separate
+database (BENCH_DB_NAME, default "<DB_NAME>_bench") that is dropped afterwards.
+With STORAGE_BACKEND=memory no database is needed: the app runs in-process on
+memory_store collections, which makes runs repeatable regression baselines
+(absolute timings then exclude network and MongoDB).
+
+Usage:
+    python backend/benchmarks.py enrichment [--entries 1000] [--runs 50]
+    python backend/benchmarks.py home [--entries 1000] [--runs 50]
+    python backend/benchmarks.py serialization [--entries 1000] [--runs 50]
+    python backend/benchmarks.py msgpack [--entries 1000] [--runs 50]
+    python backend/benchmarks.py leaderboard [--users 100000] [--runs 50]
+    python backend/benchmarks.py streaks [--users 1000000] [--runs 3]
+    python backend/benchmarks.py sessions [--users 2000] [--sessions-per-user 150] [--runs 50]
+    python backend/benchmarks.py roundtrips [--entries 1000] [--runs 50]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import httpx
+import msgpack
+import numpy as np
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from starlette.requests import Request
+
+import server
+
+
+def setup_bench_db():
+    bench_db_name = os.environ.get('BENCH_DB_NAME', f"{os.environ['DB_NAME']}_bench")
+    server.db = server.client[bench_db_name]
+    return bench_db_name
+
+
+def make_plans(user_id, count):
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "name": f"Bench Plan {i}",
+            "difficulty": "Intermediate",
+            "exercises": [
+                {"name": f"Exercise {j}", "reps": "10 reps", "sets": 3, "rest_seconds": 45, "icon": "activity"}
+                for j in range(5)
+            ],
+            "target_muscles": "Full Body",
+            "xp_reward": 50,
+            "duration_minutes": 25,
+            "created_at": datetime(2025, 1, 1, tzinfo=timezone.utc),
+        }
+        for i in range(count)
+    ]
+
+
+def make_schedule(user_id, plans, entries):
+    start = date(2025, 1, 6)
+    schedule = []
+    for i in range(entries):
+        is_rest_day = i % 4 == 3
+        schedule.append({
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "workout_plan_id": "rest" if is_rest_day else plans[i % len(plans)]['id'],
+            "scheduled_date": (start + timedelta(days=i)).isoformat(),
+            "day_of_week": (start + timedelta(days=i)).strftime("%A"),
+            "is_rest_day": is_rest_day,
+            "is_completed": False,
+            "created_at": datetime(2025, 1, 1, tzinfo=timezone.utc),
+        })
+    return schedule
+
+
+async def seed_user_schedule(args):
+    """Insert a user with progress, AI plans and a schedule; return (user_id, auth headers)"""
+    user_id = str(uuid.uuid4())
+    plans = make_plans(user_id, args.plans)
+    await server.db.users.insert_one({
+        "id": user_id,
+        "email": f"bench-{user_id}@samastu.com",
+        "name": "Bench User",
+        "created_at": datetime(2025, 1, 1, tzinfo=timezone.utc),
+    })
+    await server.db.progress.insert_one({"user_id": user_id, "total_xp": 1200, "level": 3, "streak": 4, "achievements": ["first_5"]})
+    await server.db.ai_workout_plans.insert_many(plans)
+    await server.db.scheduled_workouts.insert_many(make_schedule(user_id, plans, args.entries))
+    await server.ensure_indexes()
+
+    token = server.create_access_token(data={"sub": user_id})
+    return user_id, {"Authorization": f"Bearer {token}"}
+
+
+def make_request(accept="application/json"):
+    """Bare request for calling response helpers outside the app"""
+    return Request({"type": "http", "headers": [(b"accept", accept.encode())]})
+
+
+def api_client():
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    transport = httpx.ASGITransport(app=server.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+
+async def legacy_enrichment(user_id):
+    """Original schedule enrichment: 2-3 sequential queries joined in Python"""
+    db = server.db
+    scheduled = await db.scheduled_workouts.find(
+        {"user_id": user_id},
+        {"_id": 0}
+    ).sort("scheduled_date", 1).to_list(1000)
+
+    workout_ids = [s['workout_plan_id'] for s in scheduled if not s['is_rest_day']]
+    ai_workout_plans = await db.ai_workout_plans.find(
+        {"id": {"$in": workout_ids}},
+        {"_id": 0}
+    ).to_list(1000)
+    if not ai_workout_plans:
+        ai_workout_plans = await db.workout_plans.find(
+            {"id": {"$in": workout_ids}},
+            {"_id": 0}
+        ).to_list(1000)
+
+    plans_dict = {p['id']: p for p in ai_workout_plans}
+    return scheduled, plans_dict
+
+
+async def time_async(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def time_sync(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{label:<32} median {statistics.median(samples):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+async def bench_enrichment(args):
+    user_id, _ = await seed_user_schedule(args)
+
+    print(f"Schedule enrichment: {args.entries} entries, {args.plans} plans, {args.runs} runs")
+    report("legacy (find + $in)", await time_async(lambda: legacy_enrichment(user_id), args.runs))
+
+    async def cold_cache():
+        server.plan_cache.clear()
+        await server.fetch_enriched_schedule(user_id, server.get_plan_resolver())
+
+    async def warm_cache():
+        await server.fetch_enriched_schedule(user_id, server.get_plan_resolver())
+
+    report("resolver (cold cache)", await time_async(cold_cache, args.runs))
+    report("resolver (warm cache)", await time_async(warm_cache, args.runs))
+
+
+async def bench_home(args):
+    _, headers = await seed_user_schedule(args)
+    await server.default_catalog.load()
+
+    async with api_client() as client:
+        async def three_calls():
+            responses = await asyncio.gather(
+                client.get("/api/workouts/journey", headers=headers),
+                client.get("/api/progress", headers=headers),
+                client.get("/api/schedule/calendar", headers=headers),
+            )
+            assert all(r.status_code == 200 for r in responses)
+
+        async def home():
+            response = await client.get("/api/home", headers=headers)
+            assert response.status_code == 200
+
+        print(f"Home dashboard: {args.entries} entries, {args.plans} plans, {args.runs} runs")
+        report("journey + progress + calendar", await time_async(three_calls, args.runs))
+        report("GET /api/home", await time_async(home, args.runs))
+
+
+async def bench_serialization(args):
+    user_id, _ = await seed_user_schedule(args)
+    scheduled, plans_dict = await server.fetch_enriched_schedule(user_id, server.get_plan_resolver())
+    calendar = server.render_calendar(scheduled, plans_dict, False)
+    progress = server.Progress(user_id=user_id, total_xp=1200, level=3, streak=4, achievements=["first_5"])
+    request = make_request()
+
+    def calendar_default():
+        # What FastAPI does for an untyped route returning a list
+        JSONResponse(jsonable_encoder(calendar))
+
+    def calendar_fast():
+        ORJSONResponse(calendar)
+
+    def progress_default():
+        # response_model=Progress: re-validate, encode, then json.dumps
+        JSONResponse(jsonable_encoder(server.Progress.model_validate(progress.model_dump())))
+
+    def progress_fast():
+        server.model_response(request, server.PROGRESS_ADAPTER, progress)
+
+    size = len(ORJSONResponse(calendar).body)
+    print(f"Serialization: {args.entries}-entry calendar ({size / 1024:.0f} KB), {args.runs} runs")
+    report("calendar jsonable_encoder", time_sync(calendar_default, args.runs))
+    report("calendar orjson", time_sync(calendar_fast, args.runs))
+    report("progress response_model", time_sync(progress_default, args.runs))
+    report("progress TypeAdapter", time_sync(progress_fast, args.runs))
+
+
+async def bench_msgpack(args):
+    user_id, _ = await seed_user_schedule(args)
+    scheduled, plans_dict = await server.fetch_enriched_schedule(user_id, server.get_plan_resolver())
+    calendar = server.render_calendar(scheduled, plans_dict, False)
+    json_request = make_request()
+    msgpack_request = make_request(server.MSGPACK_MEDIA_TYPE)
+
+    json_body = server.api_response(json_request, calendar).body
+    msgpack_body = server.api_response(msgpack_request, calendar).body
+
+    print(f"Calendar encoding: {args.entries} entries, {args.runs} runs")
+    for label, body in (("JSON", json_body), ("MessagePack", msgpack_body)):
+        print(f"{label + ' bytes':<32} raw {len(body) / 1024:8.1f} KB   gzip {len(server.compress(body, 'gzip')) / 1024:8.1f} KB")
+    report("encode JSON (orjson)", time_sync(lambda: server.api_response(json_request, calendar), args.runs))
+    report("encode MessagePack", time_sync(lambda: server.api_response(msgpack_request, calendar), args.runs))
+    report("decode JSON (orjson)", time_sync(lambda: orjson.loads(json_body), args.runs))
+    report("decode MessagePack", time_sync(lambda: msgpack.unpackb(msgpack_body), args.runs))
+
+
+async def bench_leaderboard(args):
+    board = server.LocalLeaderboardBackend()
+    user_ids = [str(uuid.uuid4()) for _ in range(args.users)]
+    scores = {user_id: random.randint(1, 100_000) for user_id in user_ids}
+
+    start = time.perf_counter()
+    await board.rebuild("all", scores)
+    print(f"Leaderboard: {args.users} users (rebuild {(time.perf_counter() - start) * 1000:.0f} ms), {args.runs} runs")
+
+    async def sort_progress():
+        # What an ad hoc find().sort("total_xp") costs in Python alone
+        sorted(scores.items(), key=lambda item: -item[1])[:100]
+
+    async def top_100():
+        await board.range("all", 0, 100)
+
+    async def my_rank():
+        await board.rank("all", random.choice(user_ids))
+
+    async def xp_update():
+        await board.incr("all", random.choice(user_ids), 50)
+
+    report("sort all users, top 100", await time_async(sort_progress, args.runs))
+    report("top 100", await time_async(top_100, args.runs))
+    report("my rank", await time_async(my_rank, args.runs))
+    report("XP update", await time_async(xp_update, args.runs))
+
+
+def python_streaks(user_codes, days, today):
+    """Reference streaks: fold each user's sessions in order with advance_streak"""
+    state = {}
+    for code, day in sorted(zip(user_codes.tolist(), days.tolist())):
+        streak, last = state.get(code, (0, None))
+        workout_date = date.fromordinal(day)
+        state[code] = (server.advance_streak(streak, last, workout_date), workout_date)
+    cutoff = date.fromordinal(today - 1)
+    return {code: streak if last >= cutoff else 0 for code, (streak, last) in state.items()}
+
+
+async def bench_streaks(args):
+    rng = np.random.default_rng(0)
+    today = date.today()
+    sessions_per_user = rng.integers(0, 15, args.users)
+    user_codes = np.repeat(np.arange(args.users), sessions_per_user)
+    # Recent, clustered workout days so that plenty of streaks are still running
+    days = today.toordinal() - rng.geometric(0.15, len(user_codes)) + 1
+
+    print(f"Streaks: {args.users} users, {len(user_codes)} sessions, {args.runs} runs")
+    users, streaks = server.compute_streaks(user_codes, days, today.toordinal())
+    reference = python_streaks(user_codes, days, today.toordinal())
+    assert dict(zip(users.tolist(), streaks.tolist())) == reference
+    report("recompute (Python loop)", time_sync(lambda: python_streaks(user_codes, days, today.toordinal()), args.runs))
+    report("recompute (NumPy)", time_sync(lambda: server.compute_streaks(user_codes, days, today.toordinal()), args.runs))
+
+    last_days = rng.integers(0, 30, args.users)
+    for start in range(0, args.users, 10_000):
+        await server.db.progress.insert_many([
+            {
+                "user_id": str(uuid.uuid4()),
+                "streak": int(rng.integers(1, 20)),
+                "last_workout_date": server.day_start(today - timedelta(days=int(last_days[i]))),
+            }
+            for i in range(start, min(start + 10_000, args.users))
+        ])
+    await server.ensure_indexes()
+    start = time.perf_counter()
+    expired = await server.expire_streaks()
+    print(f"{'expire (update_many)':<32} {(time.perf_counter() - start) * 1000:8.0f} ms   {expired} streaks expired")
+
+
+def make_sessions(user_id, count):
+    """`count` sessions spread over the last year"""
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "workout_plan_id": str(uuid.uuid4()),
+            "date": now - timedelta(days=random.randint(0, 364), minutes=random.randint(0, 1439)),
+            "xp_earned": 50,
+            "duration_minutes": random.randint(10, 60),
+            "status": "completed",
+            "schedule_id": None,
+        }
+        for _ in range(count)
+    ]
+
+
+async def bench_sessions(args):
+    layouts = {layout: store() for layout, store in server.SESSION_STORES.items()}
+    for store in layouts.values():
+        await store.ensure_indexes()
+    user_ids = [str(uuid.uuid4()) for _ in range(args.users)]
+    for user_id in user_ids:
+        sessions = make_sessions(user_id, args.sessions_per_user)
+        for store in layouts.values():
+            await store.load([dict(doc) for doc in sessions])
+
+    print(f"Session storage: {args.users} users x {args.sessions_per_user} sessions, {args.runs} runs")
+    for layout, store in layouts.items():
+        stats = await server.db.command({"collStats": store.collection.name})
+        print(
+            f"{layout + ' storage':<32} {stats['count']:>9} docs   data {stats['size'] / 2**20:7.1f} MB   "
+            f"indexes {stats['totalIndexSize'] / 2**20:7.1f} MB"
+        )
+
+    for layout, store in layouts.items():
+        report(f"{layout}: user history", await time_async(lambda: store.list([random.choice(user_ids)]), args.runs))
+        report(f"{layout}: user totals", await time_async(lambda: store.totals([random.choice(user_ids)]), args.runs))
+        report(f"{layout}: user daily totals", await time_async(lambda: store.daily_totals([random.choice(user_ids)]), args.runs))
+        report(f"{layout}: weekly XP, all users", await time_async(lambda: store.xp_since(server.week_start()), args.runs))
+
+
+async def bench_roundtrips(args):
+    user_id, headers = await seed_user_schedule(args)
+    await server.default_catalog.load()
+    plan_id = (await server.ai_plan_repo.ids_for_user(user_id))[0]
+    endpoints = [
+        ("GET /api/home", "GET", "/api/home", None),
+        ("GET /api/progress", "GET", "/api/progress", None),
+        ("GET /api/workouts/journey", "GET", "/api/workouts/journey", None),
+        ("GET /api/schedule/calendar", "GET", "/api/schedule/calendar", None),
+        ("GET /api/achievements", "GET", "/api/achievements", None),
+        ("GET /api/stats/history", "GET", "/api/stats/history", None),
+        ("GET /api/progress/weight", "GET", "/api/progress/weight", None),
+        ("GET /api/sync", "GET", "/api/sync?since=1", None),
+        ("POST /api/workouts/complete", "POST", "/api/workouts/complete", {"workout_plan_id": plan_id, "duration_minutes": 20}),
+    ]
+
+    print(f"Round trips per request (warm caches): {args.entries} entries, {args.runs} runs")
+    async with api_client() as client:
+        for label, method, path, body in endpoints:
+            async def call():
+                response = await client.request(method, path, headers=headers, json=body)
+                assert response.status_code == 200, response.text
+
+            await call()
+            server.round_trips.clear()
+            await call()
+            calls = ", ".join(f"{name} x{count}" for name, count in sorted(server.round_trips.items()))
+            print(f"{label:<32} {sum(server.round_trips.values()):>3} round trips   {calls}")
+            report(label, await time_async(call, args.runs))
+
+
+BENCHMARKS = {
+    "enrichment": bench_enrichment,
+    "home": bench_home,
+    "serialization": bench_serialization,
+    "msgpack": bench_msgpack,
+    "leaderboard": bench_leaderboard,
+    "streaks": bench_streaks,
+    "sessions": bench_sessions,
+    "roundtrips": bench_roundtrips,
+}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Samastu backend benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--plans", type=int, default=8)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--sessions-per-user", type=int, default=150)
+    args = parser.parse_args()
+
+    bench_db_name = setup_bench_db()
+    try:
+        await BENCHMARKS[args.benchmark](args)
+    finally:
+        await server.client.drop_database(bench_db_name)
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands.
+
+Runs against the MongoDB configured in backend/.env.
+
+Usage:
+    python backend/manage.py achievements [--only ID [ID ...]]
+    python backend/manage.py replay [--bootstrap] [--batch-size 200] [--parallel 4]
+    python backend/manage.py rollups [--batch-size 500]
+    python backend/manage.py streaks [--reconcile] [--sample 10000] [--fix] [--batch-size 5000]
+    python backend/manage.py sessions --to buckets|documents [--batch-size 500]
+    python backend/manage.py weights [--batch-size 500]
+    python backend/manage.py dates [--batch-size 1000] [--pause 0.1]
+
+`streaks` is meant to run nightly (shortly after 00:00 UTC) from cron.
+"""
+
+import argparse
+import asyncio
+
+import server
+
+
+async def cmd_achievements(args):
+    """Backfill progress counters, then award achievements users already qualify for"""
+    backfilled = await server.backfill_counters()
+    print(f"Backfilled counters on {backfilled} progress documents")
+
+    rules = server.ACHIEVEMENTS
+    if args.only:
+        rules = [rule for rule in rules if rule['id'] in args.only]
+    updated = await server.reevaluate_achievements(rules)
+    print(f"Awarded {len(rules)} achievement rules to {updated} users")
+
+
+async def cmd_replay(args):
+    """Rebuild every user's progress from their workout event log"""
+    if args.bootstrap:
+        user_ids = await server.session_store.user_ids()
+        logged = sum(await asyncio.gather(*(server.bootstrap_workout_events(user_id) for user_id in user_ids)))
+        print(f"Logged {logged} earlier sessions for {len(user_ids)} users")
+
+    user_ids = await server.db.workout_events.distinct("user_id")
+    batches = [user_ids[i:i + args.batch_size] for i in range(0, len(user_ids), args.batch_size)]
+    semaphore = asyncio.Semaphore(args.parallel)
+
+    async def replay(batch):
+        async with semaphore:
+            return await server.replay_progress(batch)
+
+    replayed = sum(await asyncio.gather(*(replay(batch) for batch in batches)))
+    print(f"Rebuilt progress for {replayed} users in {len(batches)} batches")
+
+
+async def cmd_rollups(args):
+    """Build day and week stats rollups from recorded workout sessions"""
+    user_ids = await server.session_store.user_ids()
+    written = 0
+    for i in range(0, len(user_ids), args.batch_size):
+        written += await server.backfill_rollups(user_ids[i:i + args.batch_size])
+    print(f"Wrote {written} rollups for {len(user_ids)} users")
+
+
+async def cmd_streaks(args):
+    """Expire lapsed streaks, then optionally check streaks against session history"""
+    expired = await server.expire_streaks()
+    print(f"Expired {expired} lapsed streaks")
+    if not args.reconcile:
+        return
+
+    if args.sample:
+        sampled = await server.db.progress.aggregate([
+            {"$sample": {"size": args.sample}},
+            {"$project": {"_id": 0, "user_id": 1}},
+        ]).to_list(None)
+        user_ids = [doc['user_id'] for doc in sampled]
+    else:
+        user_ids = await server.db.progress.distinct("user_id")
+
+    mismatches = []
+    for i in range(0, len(user_ids), args.batch_size):
+        mismatches += await server.reconcile_streaks(user_ids[i:i + args.batch_size], fix=args.fix)
+    for mismatch in mismatches[:20]:
+        print(f"  {mismatch['user_id']}: stored {mismatch['stored']}, expected {mismatch['expected']}")
+    action = "fixed" if args.fix else "found"
+    print(f"Checked {len(user_ids)} users, {action} {len(mismatches)} streak mismatches")
+
+
+async def cmd_sessions(args):
+    """Copy workout sessions into the given storage layout.
+
+    The source layout is left in place. Run with completions paused, then
+    restart with SESSION_STORAGE set to the new layout.
+    """
+    target = server.SESSION_STORES[args.to]()
+    source = next(store() for layout, store in server.SESSION_STORES.items() if layout != args.to)
+    await target.ensure_indexes()
+    user_ids = await source.user_ids()
+    copied = 0
+    for i in range(0, len(user_ids), args.batch_size):
+        copied += await server.migrate_sessions(source, target, user_ids[i:i + args.batch_size])
+
+    source_totals, target_totals = await source.totals(), await target.totals()
+    mismatched = [user_id for user_id in user_ids if source_totals.get(user_id) != target_totals.get(user_id)]
+    print(f"Copied {copied} sessions of {len(user_ids)} users to {args.to}, {len(mismatched)} users with mismatched totals")
+
+
+async def cmd_weights(args):
+    """Move body weight history embedded in progress documents to the body_weight collection"""
+    await server.create_body_weight_collection()
+    users, moved = await server.migrate_embedded_weights(args.batch_size)
+    print(f"Moved {moved} body weight entries from {users} progress documents")
+
+
+async def cmd_dates(args):
+    """Convert ISO-string timestamps to native datetimes; safe to interrupt and re-run"""
+    converted = await server.migrate_dates(args.batch_size, args.pause)
+    for field, count in converted.items():
+        print(f"  {field}: {count}")
+    print(f"Converted {sum(converted.values())} documents; restart the API to drop ISO-string fallbacks")
+
+
+COMMANDS = {
+    "achievements": cmd_achievements,
+    "replay": cmd_replay,
+    "rollups": cmd_rollups,
+    "streaks": cmd_streaks,
+    "sessions": cmd_sessions,
+    "weights": cmd_weights,
+    "dates": cmd_dates,
+}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Samastu maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    achievements = subparsers.add_parser("achievements", help="re-evaluate achievements for all users")
+    achievements.add_argument(
+        "--only", nargs="+", metavar="ID",
+        choices=[rule['id'] for rule in server.ACHIEVEMENTS],
+        help="only evaluate these achievements (e.g. a newly added one)"
+    )
+
+    replay = subparsers.add_parser("replay", help="rebuild progress from the workout event log")
+    replay.add_argument("--bootstrap", action="store_true", help="first log sessions recorded before the event log")
+    replay.add_argument("--batch-size", type=int, default=200)
+    replay.add_argument("--parallel", type=int, default=4, help="batches replayed concurrently")
+
+    rollups = subparsers.add_parser("rollups", help="build stats rollups from workout sessions")
+    rollups.add_argument("--batch-size", type=int, default=500, help="users per aggregation")
+
+    streaks = subparsers.add_parser("streaks", help="expire lapsed streaks and reconcile them with session history")
+    streaks.add_argument("--reconcile", action="store_true", help="recompute streaks from sessions and report mismatches")
+    streaks.add_argument("--sample", type=int, metavar="N", help="only reconcile N random users")
+    streaks.add_argument("--fix", action="store_true", help="write the recomputed streaks back")
+    streaks.add_argument("--batch-size", type=int, default=5000, help="users per reconciliation query")
+
+    sessions = subparsers.add_parser("sessions", help="migrate workout sessions between storage layouts")
+    sessions.add_argument("--to", required=True, choices=sorted(server.SESSION_STORES))
+    sessions.add_argument("--batch-size", type=int, default=500, help="users per copy")
+
+    weights = subparsers.add_parser("weights", help="move embedded body weight history to its own collection")
+    weights.add_argument("--batch-size", type=int, default=500, help="progress documents per batch")
+
+    dates = subparsers.add_parser("dates", help="convert ISO-string timestamps to native datetimes")
+    dates.add_argument("--batch-size", type=int, default=1000)
+    dates.add_argument("--pause", type=float, default=0, help="seconds to sleep between batches")
+
+    args = parser.parse_args()
+    try:
+        await COMMANDS[args.command](args)
+    finally:
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
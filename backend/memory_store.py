@@ -0,0 +1,1278 @@
+"""
+In-memory stand-in for the Motor client, selected with STORAGE_BACKEND=memory.
+
+Implements the part of the MongoDB API the server uses: find/find_one with
+projections, sort, skip and limit; count_documents and distinct; inserts,
+updates ($set, $unset, $inc, $push, $pull, $addToSet, positional `$`,
+pipeline updates), upserts, replaces, deletes and bulk_write; unique and
+partial indexes; capped collections with tailable cursors; and the
+aggregation stages and expressions the server's pipelines use. Everything
+runs synchronously inside the calling coroutine, so results are
+deterministic and each call is atomic.
+
+Nothing is persisted. Meant for running the app in-process under an ASGI
+client in tests and benchmarks, not for production.
+"""
+
+import asyncio
+import functools
+import random
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId, encode
+from bson.errors import InvalidDocument
+from pymongo import CursorType
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+
+MISSING = object()
+
+# BSON comparison order of the types stored here
+_TYPE_ORDER = ((type(None), 1), (bool, 8), (int, 2), (float, 2), (str, 3), (dict, 4), (list, 5), (bytes, 6), (ObjectId, 7), (datetime, 9))
+
+
+# ========== VALUES ==========
+
+def type_order(value) -> int:
+    if value is MISSING:
+        return 0
+    for kind, order in _TYPE_ORDER:
+        if isinstance(value, kind):
+            return order
+    return 10
+
+def compare(a, b) -> int:
+    """Three-way comparison in BSON order"""
+    order_a, order_b = type_order(a), type_order(b)
+    if order_a != order_b:
+        return -1 if order_a < order_b else 1
+    if isinstance(a, dict):
+        return compare(list(a.items()), list(b.items()))
+    if isinstance(a, (list, tuple)):
+        for x, y in zip(a, b):
+            result = compare(x, y)
+            if result:
+                return result
+        return (len(a) > len(b)) - (len(a) < len(b))
+    if a is None or a is MISSING:
+        return 0
+    return (a > b) - (a < b)
+
+def values_equal(a, b) -> bool:
+    if (a is MISSING or a is None) and (b is MISSING or b is None):
+        return True
+    return type_order(a) == type_order(b) and compare(a, b) == 0
+
+def freeze(value):
+    """Hashable key for a stored value"""
+    if isinstance(value, dict):
+        return ("d", tuple((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return ("l", tuple(freeze(v) for v in value))
+    if value is MISSING:
+        return None
+    return value
+
+def copy_value(value):
+    if isinstance(value, dict):
+        return {k: copy_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_value(v) for v in value]
+    return value
+
+def store_value(value, tz_aware: bool):
+    """Copy of `value` as MongoDB would store it: tuples become lists and
+    datetimes UTC with millisecond precision"""
+    if isinstance(value, dict):
+        return {k: store_value(v, tz_aware) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [store_value(v, tz_aware) for v in value]
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        else:
+            value = value.replace(tzinfo=timezone.utc)
+        value = value.replace(microsecond=value.microsecond // 1000 * 1000)
+        return value if tz_aware else value.replace(tzinfo=None)
+    if value is None or isinstance(value, (bool, int, float, str, bytes, ObjectId)):
+        return value
+    raise InvalidDocument(f"cannot encode object: {value!r}, of type: {type(value)}")
+
+def resolve(value, parts: list) -> list:
+    """Values at a dotted path, descending into arrays; [MISSING] if there are none"""
+    if not parts:
+        return [value]
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        return resolve(value[head], rest) if head in value else [MISSING]
+    if isinstance(value, list):
+        if head.isdigit():
+            index = int(head)
+            return resolve(value[index], rest) if index < len(value) else [MISSING]
+        found = [v for element in value if isinstance(element, dict) for v in resolve(element, parts) if v is not MISSING]
+        return found or [MISSING]
+    return [MISSING]
+
+def get_field(doc: dict, path: str):
+    """First value at a dotted path, for sorting and index keys"""
+    return resolve(doc, path.split("."))[0]
+
+def set_path(doc, parts: list, value):
+    for part in parts[:-1]:
+        if isinstance(doc, list):
+            doc = doc[int(part)]
+            continue
+        child = doc.get(part)
+        if not isinstance(child, (dict, list)):
+            child = doc[part] = {}
+        doc = child
+    if isinstance(doc, list):
+        index = int(parts[-1])
+        doc.extend([None] * (index + 1 - len(doc)))
+        doc[index] = value
+    else:
+        doc[parts[-1]] = value
+
+def get_path(doc, parts: list):
+    for part in parts:
+        if isinstance(doc, list) and part.isdigit() and int(part) < len(doc):
+            doc = doc[int(part)]
+        elif isinstance(doc, dict) and part in doc:
+            doc = doc[part]
+        else:
+            return MISSING
+    return doc
+
+def unset_path(doc, parts: list):
+    parent = get_path(doc, parts[:-1])
+    if isinstance(parent, dict):
+        parent.pop(parts[-1], None)
+    elif isinstance(parent, list) and parts[-1].isdigit() and int(parts[-1]) < len(parent):
+        parent[int(parts[-1])] = None
+
+
+# ========== QUERIES ==========
+
+TYPE_NAMES = {
+    "string": (str,),
+    "date": (datetime,),
+    "double": (float,),
+    "int": (int,),
+    "long": (int,),
+    "number": (int, float),
+    "bool": (bool,),
+    "array": (list,),
+    "object": (dict,),
+    "objectId": (ObjectId,),
+    "null": (type(None),),
+}
+
+def is_operator_dict(value) -> bool:
+    return isinstance(value, dict) and bool(value) and all(key.startswith("$") for key in value)
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, sub) for sub in condition):
+                return False
+        elif not match_field(resolve(doc, key.split(".")), condition):
+            return False
+    return True
+
+def match_field(values: list, condition) -> bool:
+    if not is_operator_dict(condition):
+        return any(match_value(value, "$eq", condition) for value in values)
+    return all(match_operator(values, op, arg) for op, arg in condition.items())
+
+def match_operator(values: list, op: str, arg) -> bool:
+    if op == "$ne":
+        return not any(match_value(value, "$eq", arg) for value in values)
+    if op == "$nin":
+        return not any(match_value(value, "$in", arg) for value in values)
+    if op == "$not":
+        return not match_field(values, arg)
+    if op == "$exists":
+        return any(value is not MISSING for value in values) == bool(arg)
+    if op == "$size":
+        return any(isinstance(value, list) and len(value) == arg for value in values)
+    if op == "$elemMatch":
+        return any(isinstance(value, list) and any(match_element(e, arg) for e in value) for value in values)
+    if op == "$all":
+        return all(match_field(values, item) for item in arg)
+    if op == "$type":
+        kinds = tuple(kind for name in (arg if isinstance(arg, list) else [arg]) for kind in TYPE_NAMES[name])
+        return any(
+            isinstance(value, kinds) and not (isinstance(value, bool) and bool not in kinds)
+            for value in values if value is not MISSING
+        )
+    if op in ("$eq", "$in", "$gt", "$gte", "$lt", "$lte"):
+        return any(match_value(value, op, arg) for value in values)
+    raise OperationFailure(f"unknown operator: {op}")
+
+def match_element(element, condition) -> bool:
+    """Whether an array element matches an $elemMatch or $pull condition"""
+    if isinstance(element, dict) and isinstance(condition, dict) and not is_operator_dict(condition):
+        return matches(element, condition)
+    return match_field([element], condition)
+
+def match_value(value, op: str, arg) -> bool:
+    """Apply a comparison to a value, and to its elements if it is an array"""
+    if compare_op(value, op, arg):
+        return True
+    return isinstance(value, list) and any(compare_op(element, op, arg) for element in value)
+
+def compare_op(value, op: str, arg) -> bool:
+    if op == "$eq":
+        return values_equal(value, arg)
+    if op == "$in":
+        return any(values_equal(value, item) for item in arg)
+    if value is MISSING or type_order(value) != type_order(arg):
+        return False
+    result = compare(value, arg)
+    return {"$gt": result > 0, "$gte": result >= 0, "$lt": result < 0, "$lte": result <= 0}[op]
+
+def first_match_index(doc: dict, query: dict, array_path: str) -> int:
+    """Index of the first element of `array_path` matched by `query`, for positional `$` updates"""
+    array = get_path(doc, array_path.split("."))
+    if not isinstance(array, list):
+        raise OperationFailure("The positional operator did not find the match needed from the query.")
+    prefix = array_path + "."
+    conditions = {key[len(prefix):]: condition for key, condition in query.items() if key.startswith(prefix)}
+    for index, element in enumerate(array):
+        if conditions and isinstance(element, dict) and matches(element, conditions):
+            return index
+        if array_path in query and match_field([element], query[array_path]):
+            return index
+    raise OperationFailure("The positional operator did not find the match needed from the query.")
+
+
+# ========== PROJECTIONS ==========
+
+def project(doc: dict, projection) -> dict:
+    if not projection:
+        return copy_value(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    include_id = bool(projection.get("_id", 1))
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    inclusive = any(isinstance(v, dict) or v for v in fields.values())
+    if not inclusive and not fields:
+        inclusive = projection.get("_id", 1) and len(projection) == 1
+
+    if inclusive:
+        result = {}
+        if include_id and "_id" in doc:
+            result["_id"] = copy_value(doc["_id"])
+        for field, spec in fields.items():
+            if isinstance(spec, dict) and "$elemMatch" in spec:
+                array = doc.get(field)
+                if isinstance(array, list):
+                    element = next((e for e in array if match_element(e, spec["$elemMatch"])), MISSING)
+                    if element is not MISSING:
+                        result[field] = [copy_value(element)]
+            elif spec:
+                include_path(doc, result, field.split("."))
+        return result
+
+    result = copy_value(doc)
+    if not include_id:
+        result.pop("_id", None)
+    for field in fields:
+        exclude_path(result, field.split("."))
+    return result
+
+def include_path(source, target: dict, parts: list):
+    head, rest = parts[0], parts[1:]
+    if not isinstance(source, dict) or head not in source:
+        return
+    value = source[head]
+    if not rest:
+        target[head] = copy_value(value)
+    elif isinstance(value, dict):
+        include_path(value, target.setdefault(head, {}), rest)
+    elif isinstance(value, list):
+        elements = target.setdefault(head, [{} for e in value if isinstance(e, dict)])
+        for element, projected in zip((e for e in value if isinstance(e, dict)), elements):
+            include_path(element, projected, rest)
+
+def exclude_path(target, parts: list):
+    if isinstance(target, list):
+        for element in target:
+            exclude_path(element, parts)
+    elif isinstance(target, dict) and parts[0] in target:
+        if len(parts) == 1:
+            del target[parts[0]]
+        else:
+            exclude_path(target[parts[0]], parts[1:])
+
+def sort_docs(items: list, sort: list, doc=lambda item: item) -> list:
+    def key_compare(a, b):
+        for field, direction in sort:
+            result = compare(get_field(doc(a), field), get_field(doc(b), field))
+            if result:
+                return result * direction
+        return 0
+    return sorted(items, key=functools.cmp_to_key(key_compare))
+
+def normalize_sort(key_or_list, direction=None) -> list:
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(field, d) for field, d in key_or_list]
+
+
+# ========== EXPRESSIONS ==========
+
+def evaluate(expr, doc, variables: dict = None):
+    """Evaluate an aggregation expression against `doc`"""
+    if isinstance(expr, str) and expr.startswith("$$"):
+        name, _, path = expr[2:].partition(".")
+        value = doc if name in ("ROOT", "CURRENT") else (variables or {}).get(name, MISSING)
+        return expression_path(value, path.split(".")) if path else value
+    if isinstance(expr, str) and expr.startswith("$"):
+        return expression_path(doc, expr[1:].split("."))
+    if isinstance(expr, list):
+        return [evaluate(e, doc, variables) for e in expr]
+    if isinstance(expr, dict):
+        if len(expr) == 1:
+            (op, arg), = expr.items()
+            if op.startswith("$"):
+                return evaluate_operator(op, arg, doc, variables)
+        return {k: v for k, v in ((k, evaluate(v, doc, variables)) for k, v in expr.items()) if v is not MISSING}
+    return expr
+
+def expression_path(value, parts: list):
+    for part in parts:
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list):
+            value = [v for v in (expression_path(e, [part]) for e in value if isinstance(e, dict)) if v is not MISSING]
+        else:
+            return MISSING
+    return value
+
+def is_null(value) -> bool:
+    return value is None or value is MISSING
+
+def to_string(value):
+    if is_null(value):
+        return None
+    if isinstance(value, datetime):
+        value = value if value.tzinfo is None else value.astimezone(timezone.utc)
+        return value.strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+def date_to_string(value: datetime, fmt: str) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime(fmt.replace("%L", f"{value.microsecond // 1000:03d}"))
+
+def numbers(values) -> list:
+    return [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+
+def evaluate_operator(op: str, arg, doc, variables):
+    if op == "$literal":
+        return arg
+    if op == "$filter":
+        items = evaluate(arg["input"], doc, variables)
+        name = arg.get("as", "this")
+        if is_null(items):
+            return None
+        return [item for item in items if evaluate(arg["cond"], doc, {**(variables or {}), name: item}) not in (False, None, 0, MISSING)]
+    if op == "$map":
+        items = evaluate(arg["input"], doc, variables)
+        name = arg.get("as", "this")
+        return None if is_null(items) else [evaluate(arg["in"], doc, {**(variables or {}), name: item}) for item in items]
+    if op == "$cond":
+        if isinstance(arg, dict):
+            arg = [arg["if"], arg["then"], arg["else"]]
+        condition = evaluate(arg[0], doc, variables)
+        return evaluate(arg[1] if condition not in (False, None, 0, MISSING) else arg[2], doc, variables)
+    if op == "$dateToString":
+        value = evaluate(arg["date"], doc, variables)
+        return None if is_null(value) else date_to_string(value, arg.get("format", "%Y-%m-%dT%H:%M:%S.%LZ"))
+
+    args = evaluate(arg, doc, variables)
+    if not isinstance(arg, list):
+        args = [args]
+    if op == "$ifNull":
+        return next((a for a in args[:-1] if not is_null(a)), args[-1])
+    if op == "$add":
+        if any(is_null(a) for a in args):
+            return None
+        dates = [a for a in args if isinstance(a, datetime)]
+        total = sum(a for a in args if not isinstance(a, datetime))
+        if dates:
+            return dates[0] + timedelta(milliseconds=total)
+        return total
+    if op == "$subtract":
+        return None if any(is_null(a) for a in args) else args[0] - args[1]
+    if op == "$multiply":
+        return None if any(is_null(a) for a in args) else functools.reduce(lambda a, b: a * b, args, 1)
+    if op == "$divide":
+        return None if any(is_null(a) for a in args) else args[0] / args[1]
+    if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        a = None if args[0] is MISSING else args[0]
+        b = None if args[1] is MISSING else args[1]
+        result = compare(a, b)
+        return {"$eq": result == 0, "$ne": result != 0, "$gt": result > 0, "$gte": result >= 0, "$lt": result < 0, "$lte": result <= 0}[op]
+    if op == "$and":
+        return all(a not in (False, None, 0, MISSING) for a in args)
+    if op == "$or":
+        return any(a not in (False, None, 0, MISSING) for a in args)
+    if op == "$not":
+        return args[0] in (False, None, 0, MISSING)
+    if op == "$in":
+        return any(values_equal(args[0], item) for item in args[1])
+    if op == "$size":
+        return len(args[0])
+    if op == "$arrayElemAt":
+        array, index = args
+        return array[index] if -len(array) <= index < len(array) else MISSING
+    if op == "$concat":
+        return None if any(is_null(a) for a in args) else "".join(args)
+    if op == "$toString":
+        return to_string(args[0])
+    if op in ("$substr", "$substrBytes", "$substrCP"):
+        value, start, length = args
+        value = to_string(value) or ""
+        return value[start:] if length < 0 else value[start:start + length]
+    if op in ("$sum", "$max", "$min", "$avg"):
+        values = args[0] if len(args) == 1 and isinstance(args[0], list) else args
+        return accumulate(op, values)
+    raise OperationFailure(f"Unrecognized expression '{op}'")
+
+def accumulate(op: str, values: list):
+    if op == "$sum":
+        return sum(numbers(values))
+    if op == "$avg":
+        found = numbers(values)
+        return sum(found) / len(found) if found else None
+    present = [v for v in values if not is_null(v)]
+    if not present:
+        return None
+    key = functools.cmp_to_key(compare)
+    return max(present, key=key) if op == "$max" else min(present, key=key)
+
+
+# ========== UPDATES ==========
+
+def apply_update(doc: dict, update, query: dict, inserting: bool = False) -> dict:
+    """Return `doc` with `update` (operators or a pipeline) applied"""
+    if isinstance(update, list):
+        for stage in update:
+            doc = apply_stage_to_doc(doc, stage)
+        return doc
+
+    doc = copy_value(doc)
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            parts = path.split(".")
+            if "$" in parts:
+                position = parts.index("$")
+                parts[position] = str(first_match_index(doc, query, ".".join(parts[:position])))
+            apply_field_update(doc, op, parts, arg, inserting)
+    return doc
+
+def apply_field_update(doc: dict, op: str, parts: list, arg, inserting: bool):
+    current = get_path(doc, parts)
+    if op == "$set":
+        set_path(doc, parts, copy_value(arg))
+    elif op == "$setOnInsert":
+        if inserting:
+            set_path(doc, parts, copy_value(arg))
+    elif op == "$unset":
+        unset_path(doc, parts)
+    elif op == "$inc":
+        set_path(doc, parts, arg if current is MISSING or current is None else current + arg)
+    elif op in ("$min", "$max"):
+        if current is MISSING or (compare(arg, current) < 0 if op == "$min" else compare(arg, current) > 0):
+            set_path(doc, parts, copy_value(arg))
+    elif op in ("$push", "$addToSet"):
+        if current is MISSING:
+            current = []
+            set_path(doc, parts, current)
+        if not isinstance(current, list):
+            raise OperationFailure(f"The field '{'.'.join(parts)}' must be an array")
+        items = arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]
+        for item in items:
+            if op == "$push" or not any(values_equal(item, existing) for existing in current):
+                current.append(copy_value(item))
+    elif op == "$pull":
+        if isinstance(current, list):
+            current[:] = [element for element in current if not match_element(element, arg)]
+    else:
+        raise OperationFailure(f"Unknown modifier: {op}")
+
+def apply_stage_to_doc(doc: dict, stage: dict) -> dict:
+    (name, spec), = stage.items()
+    if name in ("$set", "$addFields"):
+        result = copy_value(doc)
+        for field, expr in spec.items():
+            value = evaluate(expr, doc)
+            if value is MISSING:
+                unset_path(result, field.split("."))
+            else:
+                set_path(result, field.split("."), value)
+        return result
+    if name == "$unset":
+        result = copy_value(doc)
+        for field in [spec] if isinstance(spec, str) else spec:
+            unset_path(result, field.split("."))
+        return result
+    if name == "$project":
+        return project_stage(doc, spec)
+    if name == "$replaceRoot":
+        return evaluate(spec["newRoot"], doc)
+    raise OperationFailure(f"Unsupported stage in update pipeline: {name}")
+
+def upsert_seed(query: dict) -> dict:
+    """The document an upsert starts from: the query's equality conditions"""
+    doc = {}
+    for key, condition in query.items():
+        if key == "$and":
+            for sub in condition:
+                doc.update(upsert_seed(sub))
+        elif key.startswith("$"):
+            continue
+        elif is_operator_dict(condition):
+            if "$eq" in condition:
+                set_path(doc, key.split("."), copy_value(condition["$eq"]))
+        else:
+            set_path(doc, key.split("."), copy_value(condition))
+    return doc
+
+
+# ========== AGGREGATION ==========
+
+def project_stage(doc: dict, spec: dict) -> dict:
+    """$project, which unlike find projections may compute fields"""
+    computed = {k: v for k, v in spec.items() if not isinstance(v, (bool, int))}
+    if not computed:
+        return project(doc, spec)
+    result = {}
+    if spec.get("_id", 1) and "_id" not in computed and "_id" in doc:
+        result["_id"] = copy_value(doc["_id"])
+    for field, include in spec.items():
+        if field != "_id" and field not in computed and include:
+            include_path(doc, result, field.split("."))
+    for field, expr in computed.items():
+        value = evaluate(expr, doc)
+        if value is MISSING:
+            result.pop(field, None)
+        else:
+            set_path(result, field.split("."), value)
+    return result
+
+def run_pipeline(docs: list, pipeline: list) -> list:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [doc for doc in docs if matches(doc, spec)]
+        elif name == "$sort":
+            docs = sort_docs(docs, normalize_sort(spec))
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$project":
+            docs = [project_stage(doc, spec) for doc in docs]
+        elif name in ("$set", "$addFields", "$unset", "$replaceRoot"):
+            docs = [apply_stage_to_doc(doc, stage) for doc in docs]
+        elif name == "$unwind":
+            docs = unwind(docs, spec)
+        elif name == "$group":
+            docs = group(docs, spec)
+        elif name == "$sample":
+            docs = random.sample(docs, min(spec["size"], len(docs)))
+        elif name == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        else:
+            raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'")
+    return docs
+
+def unwind(docs: list, spec) -> list:
+    if isinstance(spec, str):
+        spec = {"path": spec}
+    parts = spec["path"][1:].split(".")
+    keep_empty = spec.get("preserveNullAndEmptyArrays", False)
+    result = []
+    for doc in docs:
+        value = get_path(doc, parts)
+        if isinstance(value, list) and value:
+            for element in value:
+                unwound = copy_value(doc)
+                set_path(unwound, parts, element)
+                result.append(unwound)
+        elif keep_empty or (value is not MISSING and value is not None and not isinstance(value, list)):
+            result.append(doc)
+    return result
+
+def group(docs: list, spec: dict) -> list:
+    groups = {}
+    for doc in docs:
+        group_id = evaluate(spec["_id"], doc)
+        if group_id is MISSING:
+            group_id = None
+        entry = groups.setdefault(freeze(group_id), {"_id": group_id, "values": {field: [] for field in spec if field != "_id"}})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (op, expr), = accumulator.items()
+            entry["values"][field].append(1 if op == "$count" else evaluate(expr, doc))
+
+    result = []
+    for entry in groups.values():
+        row = {"_id": entry["_id"]}
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (op, _), = accumulator.items()
+            values = entry["values"][field]
+            if op in ("$sum", "$count"):
+                row[field] = accumulate("$sum", values)
+            elif op in ("$avg", "$min", "$max"):
+                row[field] = accumulate(op, values)
+            elif op == "$push":
+                row[field] = [v for v in values if v is not MISSING]
+            elif op == "$addToSet":
+                row[field] = list({freeze(v): v for v in values if v is not MISSING}.values())
+            elif op == "$first":
+                row[field] = values[0] if values[0] is not MISSING else None
+            elif op == "$last":
+                row[field] = values[-1] if values[-1] is not MISSING else None
+            else:
+                raise OperationFailure(f"unknown group operator '{op}'")
+        result.append(row)
+    return result
+
+
+# ========== RESULTS ==========
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+        self.acknowledged = True
+
+class InsertManyResult:
+    def __init__(self, inserted_ids: list):
+        self.inserted_ids = inserted_ids
+        self.acknowledged = True
+
+class UpdateResult:
+    def __init__(self, matched_count: int, modified_count: int, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+        self.acknowledged = True
+
+class DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+        self.acknowledged = True
+
+class BulkWriteResult:
+    def __init__(self):
+        self.inserted_count = self.matched_count = self.modified_count = self.deleted_count = 0
+        self.upserted_ids = {}
+        self.acknowledged = True
+
+    @property
+    def upserted_count(self) -> int:
+        return len(self.upserted_ids)
+
+    @property
+    def bulk_api_result(self) -> dict:
+        return {
+            "nInserted": self.inserted_count,
+            "nMatched": self.matched_count,
+            "nModified": self.modified_count,
+            "nRemoved": self.deleted_count,
+            "nUpserted": self.upserted_count,
+            "upserted": [{"index": i, "_id": _id} for i, _id in self.upserted_ids.items()],
+        }
+
+
+# ========== COLLECTIONS ==========
+
+class MemoryCursor:
+    """Lazily evaluated find or aggregate cursor"""
+
+    def __init__(self, run):
+        self._run = run
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+        self._position = 0
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _fetch(self) -> list:
+        if self._results is None:
+            self._results = self._run(self._sort, self._skip, self._limit)
+        return self._results
+
+    async def to_list(self, length=None) -> list:
+        results = self._fetch()
+        end = len(results) if length is None else min(len(results), self._position + length)
+        taken = results[self._position:end]
+        self._position = end
+        return taken
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        results = self._fetch()
+        if self._position >= len(results):
+            raise StopAsyncIteration
+        self._position += 1
+        return results[self._position - 1]
+
+class MemoryTailableCursor:
+    """Tailable cursor on a capped collection.
+
+    Yields matching documents in natural order and, once caught up, documents
+    inserted after it. Like Motor's, iteration stops when no document arrives
+    within max_await_time_ms (TAILABLE_AWAIT) or right away (TAILABLE); the
+    cursor stays alive and picks up from where it left off on the next pass.
+    It dies on an empty collection, as on a server.
+    """
+
+    def __init__(self, collection: "MemoryCollection", filter: dict, projection, await_data: bool, max_await_time_ms: int):
+        self._collection = collection
+        self._filter = filter
+        self._projection = projection
+        self._await_data = await_data
+        self._timeout = max_await_time_ms / 1000
+        self._last_seq = -1
+        self._buffer = []
+        self.alive = bool(collection._docs)
+
+    def batch_size(self, size: int):
+        return self
+
+    def max_await_time_ms(self, max_await_time_ms: int):
+        self._timeout = max_await_time_ms / 1000
+        return self
+
+    def _refill(self):
+        if not self._buffer:
+            self._buffer = [item for item in self._collection._matching(self._filter) if item[0] > self._last_seq]
+
+    def _take(self) -> dict:
+        seq, doc = self._buffer.pop(0)
+        self._last_seq = seq
+        return project(doc, self._projection)
+
+    async def to_list(self, length=None) -> list:
+        if not self.alive:
+            return []
+        self._refill()
+        taken = []
+        while self._buffer and (length is None or len(taken) < length):
+            taken.append(self._take())
+        return taken
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.alive:
+            self._refill()
+            if not self._buffer and self._await_data:
+                try:
+                    await asyncio.wait_for(self._collection._next_insert(), self._timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._refill()
+            if self._buffer:
+                return self._take()
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.alive = False
+
+class MemoryIndex:
+    def __init__(self, name: str, keys: list, unique: bool, partial: dict):
+        self.name = name
+        self.keys = keys
+        self.unique = unique
+        self.partial = partial
+        self.entries = {}  # unique key -> seq
+
+    def key(self, doc: dict):
+        if self.partial is not None and not matches(doc, self.partial):
+            return None
+        return tuple(freeze(get_field(doc, field)) for field, _ in self.keys)
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+        self._docs = {}  # seq -> document, in insertion (natural) order
+        self._next_seq = 0
+        self._lookups = {"_id": {}}  # field -> {value: seqs}, for every indexed leading field
+        self._indexes = {"_id_": MemoryIndex("_id_", [("_id", 1)], True, None)}
+        self._capped = None  # {"size": bytes, "max": documents} for capped collections
+        self._sizes = {}  # seq -> BSON size, for capped collections
+        self._insert_waiters = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.database[f"{self.name}.{name}"]
+
+    # ----- index maintenance -----
+
+    def _lookup_values(self, doc: dict, field: str) -> list:
+        values = resolve(doc, field.split("."))
+        keys = []
+        for value in values:
+            keys.append(freeze(value))
+            if isinstance(value, list):
+                keys.extend(freeze(v) for v in value)
+        return keys
+
+    def _check_unique(self, doc: dict, seq: int = None):
+        for index in self._indexes.values():
+            if not index.unique:
+                continue
+            key = index.key(doc)
+            if key is not None and index.entries.get(key, seq) != seq:
+                fields = ", ".join(f"{field}: {get_field(doc, field)!r}" for field, _ in index.keys)
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.full_name} index: {index.name} dup key: {{ {fields} }}",
+                    11000
+                )
+
+    def _add(self, seq: int, doc: dict):
+        self._docs[seq] = doc
+        for field, lookup in self._lookups.items():
+            for key in self._lookup_values(doc, field):
+                lookup.setdefault(key, set()).add(seq)
+        for index in self._indexes.values():
+            key = index.key(doc) if index.unique else None
+            if key is not None:
+                index.entries[key] = seq
+
+    def _remove(self, seq: int):
+        doc = self._docs.pop(seq)
+        for field, lookup in self._lookups.items():
+            for key in self._lookup_values(doc, field):
+                seqs = lookup.get(key)
+                if seqs is not None:
+                    seqs.discard(seq)
+                    if not seqs:
+                        del lookup[key]
+        for index in self._indexes.values():
+            key = index.key(doc) if index.unique else None
+            if key is not None and index.entries.get(key) == seq:
+                del index.entries[key]
+        return doc
+
+    def _candidates(self, query: dict):
+        """Seqs that may match `query`, narrowed by an index where possible"""
+        best = None
+        for field, condition in (query or {}).items():
+            lookup = self._lookups.get(field)
+            if lookup is None:
+                continue
+            if is_operator_dict(condition):
+                if set(condition) == {"$in"}:
+                    values = condition["$in"]
+                elif set(condition) == {"$eq"}:
+                    values = [condition["$eq"]]
+                else:
+                    continue
+            elif isinstance(condition, dict):
+                continue
+            else:
+                values = [condition]
+            seqs = set()
+            for value in values:
+                seqs |= lookup.get(freeze(value), set())
+                if value is None:
+                    seqs |= lookup.get(None, set())
+            if best is None or len(seqs) < len(best):
+                best = seqs
+        return self._docs.keys() if best is None else sorted(best)
+
+    def _matching(self, query: dict) -> list:
+        """(seq, document) pairs matching `query`, in natural order"""
+        query = query or {}
+        return [(seq, self._docs[seq]) for seq in self._candidates(query) if matches(self._docs[seq], query)]
+
+    def _store(self, doc: dict) -> dict:
+        return store_value(doc, self.database.client.tz_aware)
+
+    def _insert(self, doc: dict):
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        stored = self._store(doc)
+        self._check_unique(stored)
+        self.database._created.add(self.name)
+        self._add(self._next_seq, stored)
+        if self._capped is not None:
+            self._sizes[self._next_seq] = len(encode(stored))
+            self._evict()
+        self._next_seq += 1
+        for waiter in self._insert_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._insert_waiters.clear()
+        return doc["_id"]
+
+    def _evict(self):
+        """Drop the oldest documents of a capped collection until it fits"""
+        limit, max_docs = self._capped["size"], self._capped["max"]
+        total = sum(self._sizes.values())
+        while len(self._docs) > 1 and (total > limit or (max_docs and len(self._docs) > max_docs)):
+            seq = next(iter(self._docs))
+            self._remove(seq)
+            total -= self._sizes.pop(seq)
+
+    def _next_insert(self) -> asyncio.Future:
+        waiter = asyncio.get_running_loop().create_future()
+        self._insert_waiters.append(waiter)
+        return waiter
+
+    def _replace(self, seq: int, doc: dict):
+        stored = self._store(doc)
+        self._check_unique(stored, seq)
+        self._remove(seq)
+        self._add(seq, stored)
+
+    def _update(self, query: dict, update, upsert: bool, multi: bool) -> UpdateResult:
+        if not update:
+            raise ValueError("update cannot be empty")
+        matched = self._matching(query)
+        if not multi:
+            matched = matched[:1]
+        modified = 0
+        for seq, doc in matched:
+            updated = apply_update(doc, update, query)
+            if updated.get("_id") != doc.get("_id"):
+                raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'")
+            if updated != doc:
+                self._replace(seq, updated)
+                modified += 1
+        if matched or not upsert:
+            return UpdateResult(len(matched), modified)
+        doc = apply_update(upsert_seed(query), update, query, inserting=True)
+        return UpdateResult(0, 0, self._insert(doc))
+
+    # ----- reads -----
+
+    def find(
+        self, filter: dict = None, projection=None, sort=None, skip: int = 0, limit: int = 0,
+        cursor_type=CursorType.NON_TAILABLE, max_await_time_ms: int = 1000, **kwargs
+    ):
+        if cursor_type in (CursorType.TAILABLE, CursorType.TAILABLE_AWAIT):
+            if self._capped is None:
+                raise OperationFailure(f"error processing query: ns={self.full_name} tailable cursor requested on non capped collection")
+            await_data = cursor_type == CursorType.TAILABLE_AWAIT
+            return MemoryTailableCursor(self, filter, projection, await_data, max_await_time_ms)
+
+        def run(sort_spec, skip_count, limit_count):
+            docs = [doc for _, doc in self._matching(filter)]
+            if sort_spec:
+                if sort_spec[0][0] == "$natural":
+                    docs = docs if sort_spec[0][1] > 0 else docs[::-1]
+                else:
+                    docs = sort_docs(docs, sort_spec)
+            docs = docs[skip_count:]
+            if limit_count:
+                docs = docs[:abs(limit_count)]
+            return [project(doc, projection) for doc in docs]
+
+        cursor = MemoryCursor(run)
+        if sort is not None:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    async def find_one(self, filter: dict = None, projection=None, sort=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        docs = await self.find(filter, projection, sort=sort, limit=1).to_list(None)
+        return docs[0] if docs else None
+
+    async def count_documents(self, filter: dict, limit: int = 0, skip: int = 0, **kwargs) -> int:
+        count = max(0, len(self._matching(filter)) - skip)
+        return min(count, limit) if limit else count
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return len(self._docs)
+
+    async def distinct(self, key: str, filter: dict = None, **kwargs) -> list:
+        values = {}
+        for _, doc in self._matching(filter):
+            for value in resolve(doc, key.split(".")):
+                for item in value if isinstance(value, list) else [value]:
+                    if item is not MISSING:
+                        values.setdefault(freeze(item), copy_value(item))
+        return list(values.values())
+
+    def aggregate(self, pipeline: list, **kwargs) -> MemoryCursor:
+        def run(sort_spec, skip_count, limit_count):
+            stages = list(pipeline)
+            query = stages.pop(0)["$match"] if stages and "$match" in stages[0] else {}
+            return run_pipeline([copy_value(doc) for _, doc in self._matching(query)], stages)
+        return MemoryCursor(run)
+
+    # ----- writes -----
+
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        return InsertOneResult(self._insert(document))
+
+    async def insert_many(self, documents: list, ordered: bool = True, **kwargs) -> InsertManyResult:
+        inserted, errors = [], []
+        for index, doc in enumerate(documents):
+            try:
+                inserted.append(self._insert(doc))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": doc})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": len(inserted),
+                "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": [],
+            })
+        return InsertManyResult(inserted)
+
+    async def update_one(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, multi=False)
+
+    async def update_many(self, filter: dict, update, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, multi=True)
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        matched = self._matching(filter)[:1]
+        if matched:
+            seq, doc = matched[0]
+            replacement = {"_id": doc["_id"], **{k: v for k, v in replacement.items() if k != "_id"}}
+            modified = self._store(replacement) != doc
+            if modified:
+                self._replace(seq, replacement)
+            return UpdateResult(1, int(modified))
+        if not upsert:
+            return UpdateResult(0, 0)
+        seed = upsert_seed(filter)
+        doc = {**({"_id": seed["_id"]} if "_id" in seed else {}), **copy_value(replacement)}
+        return UpdateResult(0, 0, self._insert(doc))
+
+    async def find_one_and_update(
+        self, filter: dict, update, projection=None, sort=None, upsert: bool = False,
+        return_document: bool = False, **kwargs
+    ):
+        matched = self._matching(filter)
+        if sort:
+            matched = sort_docs(matched, normalize_sort(sort), doc=lambda item: item[1])
+        if not matched:
+            if not upsert:
+                return None
+            doc = apply_update(upsert_seed(filter), update, filter, inserting=True)
+            self._insert(doc)
+            return project(self._docs[self._next_seq - 1], projection) if return_document else None
+        seq, before = matched[0]
+        after = apply_update(before, update, filter)
+        if after != before:
+            self._replace(seq, after)
+        return project(self._docs[seq] if return_document else before, projection)
+
+    async def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        matched = self._matching(filter)[:1]
+        for seq, _ in matched:
+            self._remove(seq)
+        return DeleteResult(len(matched))
+
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        matched = self._matching(filter)
+        for seq, _ in matched:
+            self._remove(seq)
+        return DeleteResult(len(matched))
+
+    async def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        result = BulkWriteResult()
+        errors = []
+        for index, request in enumerate(requests):
+            kind = type(request).__name__
+            try:
+                if kind == "InsertOne":
+                    self._insert(request._doc)
+                    result.inserted_count += 1
+                elif kind in ("UpdateOne", "UpdateMany", "ReplaceOne"):
+                    if kind == "ReplaceOne":
+                        outcome = await self.replace_one(request._filter, request._doc, upsert=request._upsert)
+                    else:
+                        outcome = self._update(request._filter, request._doc, request._upsert, multi=kind == "UpdateMany")
+                    result.matched_count += outcome.matched_count
+                    result.modified_count += outcome.modified_count
+                    if outcome.upserted_id is not None:
+                        result.upserted_ids[index] = outcome.upserted_id
+                elif kind in ("DeleteOne", "DeleteMany"):
+                    outcome = await (self.delete_one if kind == "DeleteOne" else self.delete_many)(request._filter)
+                    result.deleted_count += outcome.deleted_count
+                else:
+                    raise TypeError(f"{request!r} is not a valid request")
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": getattr(request, "_doc", None)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({**result.bulk_api_result, "writeErrors": errors, "writeConcernErrors": []})
+        return result
+
+    # ----- indexes -----
+
+    async def create_index(self, keys, unique: bool = False, partialFilterExpression: dict = None, name: str = None, **kwargs) -> str:
+        keys = normalize_sort(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        if name in self._indexes:
+            return name
+        index = MemoryIndex(name, keys, unique, partialFilterExpression)
+        if unique:
+            for seq, doc in self._docs.items():
+                key = index.key(doc)
+                if key is not None and key in index.entries:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} index: {name}", 11000)
+                if key is not None:
+                    index.entries[key] = seq
+        self._indexes[name] = index
+
+        field = keys[0][0]
+        if field not in self._lookups:
+            lookup = self._lookups[field] = {}
+            for seq, doc in self._docs.items():
+                for key in self._lookup_values(doc, field):
+                    lookup.setdefault(key, set()).add(seq)
+        self.database._created.add(self.name)
+        return name
+
+    async def create_indexes(self, indexes: list, **kwargs) -> list:
+        return [await self.create_index(index.document["key"], **{k: v for k, v in index.document.items() if k != "key"}) for index in indexes]
+
+    async def index_information(self) -> dict:
+        return {
+            name: {"key": index.keys, **({"unique": True} if index.unique else {})}
+            for name, index in self._indexes.items()
+        }
+
+    async def drop(self):
+        await self.database.drop_collection(self.name)
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections = {}
+        self._created = set()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> MemoryCollection:
+        return self[name]
+
+    async def create_collection(self, name: str, **options) -> MemoryCollection:
+        """Only the capped options are honored; others (timeseries, validators) are accepted and ignored"""
+        if name in self._created:
+            raise CollectionInvalid(f"collection {name} already exists")
+        self._created.add(name)
+        collection = self[name]
+        if options.get("capped"):
+            collection._capped = {"size": options["size"], "max": options.get("max", 0)}
+            collection._sizes = {seq: len(encode(doc)) for seq, doc in collection._docs.items()}
+            collection._evict()
+        return collection
+
+    async def list_collection_names(self, **kwargs) -> list:
+        return sorted(self._created)
+
+    async def drop_collection(self, name):
+        name = getattr(name, "name", name)
+        self._collections.pop(name, None)
+        self._created.discard(name)
+
+    async def command(self, command, value=None, **kwargs) -> dict:
+        if isinstance(command, str):
+            command = {command: value if value is not None else 1}
+        name = next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        if name == "collStats":
+            collection = self[command[name]]
+            size = sum(len(encode(doc)) for doc in collection._docs.values())
+            count = len(collection._docs)
+            return {
+                "ns": collection.full_name, "count": count, "size": size,
+                "avgObjSize": size // count if count else 0, "storageSize": size,
+                "nindexes": len(collection._indexes), "totalIndexSize": 0,
+                "capped": collection._capped is not None, "ok": 1.0,
+            }
+        raise OperationFailure(f"no such command: '{name}'")
+
+class MemoryClient:
+    """Drop-in for AsyncIOMotorClient holding every database in process memory"""
+
+    def __init__(self, *args, tz_aware: bool = False, **kwargs):
+        self.tz_aware = tz_aware
+        self._databases = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(self, name)
+        return database
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str, **kwargs) -> MemoryDatabase:
+        return self[name]
+
+    async def drop_database(self, name):
+        self._databases.pop(getattr(name, "name", name), None)
+
+    async def list_database_names(self) -> list:
+        return sorted(self._databases)
+
+    def close(self):
+        pass
@@ -1,27 +1,61 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, status
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from memory_store import MemoryClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, TypeAdapter
+from typing import Any, List, Literal, Optional, TypedDict
+from urllib.parse import urlsplit
 import uuid
-from datetime import datetime, timezone, timedelta
+import asyncio
+import functools
+import hashlib
+import gzip
+import time
+from types import MappingProxyType
+from collections import Counter
+from datetime import date, datetime, timezone, timedelta
 from passlib.context import CryptContext
 import jwt
 import json
+import msgpack
+import numpy as np
 import google.generativeai as genai
+from cachetools import LRUCache, TTLCache
+from sortedcontainers import SortedList
+from pymongo import CursorType, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # only needed for LEADERBOARD_BACKEND=redis
+    aioredis = None
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Storage backend (STORAGE_BACKEND):
+#   mongo  - MongoDB at MONGO_URL
+#   memory - process-local collections (memory_store.py) for running the app
+#            in-process in tests and benchmarks; nothing is persisted
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+STORAGE_BACKENDS = {
+    "mongo": lambda: AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True),
+    "memory": lambda: MemoryClient(tz_aware=True),
+}
+client = STORAGE_BACKENDS[STORAGE_BACKEND]()
 db = client[os.environ['DB_NAME']]
 
 # Security
@@ -34,6 +68,16 @@ security = HTTPBearer()
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
+# Normalized schedule payloads: each plan is sent once in a `plans` map and
+# entries reference it by `workout_plan_id` instead of embedding a copy
+NORMALIZED_MEDIA_TYPE = "application/vnd.samastu.normalized+json"
+REST_DAY_DETAILS = {
+    'name': 'Rest Day',
+    'difficulty': 'Recovery',
+    'duration_minutes': 0,
+    'xp_reward': 0
+}
+
 # ========== MODELS ==========
 
 class Exercise(BaseModel):
@@ -104,6 +148,7 @@ class WorkoutSession(BaseModel):
     xp_earned: int
     duration_minutes: int
     status: str
+    schedule_id: Optional[str] = None
 
 class Progress(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -114,12 +159,27 @@ class Progress(BaseModel):
     current_streak_start: Optional[datetime] = None
     last_workout_date: Optional[datetime] = None
     achievements: List[str] = []
-    body_weight_history: List[dict] = []
+    total_workouts: int = 0
+    total_minutes: int = 0
+
+class WeightEntry(BaseModel):
+    weight: float = Field(gt=0, lt=1000)
+    ts: Optional[datetime] = None  # Defaults to now
 
 class WorkoutComplete(BaseModel):
     workout_plan_id: str
     duration_minutes: int
 
+class BulkCompletion(BaseModel):
+    client_id: str  # Client-generated, makes retried uploads idempotent
+    workout_plan_id: str
+    duration_minutes: int
+    completed_at: datetime
+    schedule_id: Optional[str] = None
+
+class BulkCompleteRequest(BaseModel):
+    completions: List[BulkCompletion]
+
 class ScheduledWorkout(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -136,6 +196,19 @@ class TokenResponse(BaseModel):
     token_type: str
     user: User
 
+class BatchOperation(BaseModel):
+    method: Literal["GET", "POST", "PUT", "DELETE"]
+    path: str  # e.g. /api/user/profile or /api/schedule/calendar?start=2025-01-01
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+# Precompiled serializers for hot routes that skip response_model re-validation
+USER_ADAPTER = TypeAdapter(User)
+PROGRESS_ADAPTER = TypeAdapter(Progress)
+WORKOUT_PLANS_ADAPTER = TypeAdapter(List[WorkoutPlan])
+
 # ========== AUTH HELPERS ==========
 
 def hash_password(password: str) -> str:
@@ -154,8 +227,7 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
+def decode_access_token(token: str) -> str:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
@@ -165,20 +237,1571 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    return user_id
+
+async def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # Batch sub-requests reuse the batch's user until a sub-request changes their data
+    batch = request.scope.get("batch")
+    if batch is not None and batch['version'] == data_version_cache.get(batch['user'].id):
+        return batch['user']
     
-    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+    user_id = decode_access_token(credentials.credentials)
+    
+    user_doc = await user_repo.get(user_id)
     if user_doc is None:
         raise HTTPException(status_code=401, detail="User not found")
+    data_version_cache[user_id] = user_doc.get('data_version', 0)
+    
+    user = User(**user_doc)
+    if batch is not None:
+        batch.update(user=user, version=data_version_cache[user_id])
+    return user
+
+# ========== RESPONSE HELPERS ==========
+
+def wants_normalized(request: Request, view: Optional[str]) -> bool:
+    """Normalized shape is negotiated via ?view=normalized or the vendor media type"""
+    if view is not None:
+        return view == "normalized"
+    # Only an explicit media range selects it; wildcards keep the default shape
+    ranges = accepted_media_types(request.headers.get("accept", ""))
+    return NORMALIZED_MEDIA_TYPE in ranges and media_type_quality(ranges, NORMALIZED_MEDIA_TYPE) > 0
+
+def normalized_response(request: Request, plans_dict: dict, entries: list) -> Response:
+    return api_response(request, {"plans": plans_dict, "entries": entries}, NORMALIZED_MEDIA_TYPE)
+
+def parse_fields(fields: Optional[str], allowed: set) -> Optional[set]:
+    """Parse a comma-separated ?fields= sparse fieldset; None means all fields"""
+    if fields is None:
+        return None
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return requested | {"id"}
+
+def trim(doc: dict, fields: Optional[set]) -> dict:
+    if fields is None:
+        return doc
+    return {k: v for k, v in doc.items() if k in fields}
+
+def trim_plans(plans_dict: dict, fields: Optional[set]) -> dict:
+    if fields is None:
+        return plans_dict
+    return {plan_id: trim(plan, fields) for plan_id, plan in plans_dict.items()}
+
+# Hot routes return responses directly: FastAPI then skips response_model
+# validation and jsonable_encoder. Plain payloads are encoded with orjson,
+# pydantic models with a precompiled TypeAdapter.
+def model_response(request: Request, adapter: TypeAdapter, value) -> Response:
+    if wants_msgpack(request):
+        return MsgpackResponse(adapter.dump_python(value, mode="json"))
+    return Response(content=adapter.dump_json(value), media_type="application/json")
+
+# Read routes also speak MessagePack (Accept: application/msgpack) with the
+# same response shapes; mobile clients decode it noticeably faster than JSON.
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+def encode_default(obj):
+    """Shared fallback for MessagePack and event payloads: dates as ISO strings, as in the JSON responses"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+def packb(content) -> bytes:
+    return msgpack.packb(content, default=encode_default, use_bin_type=True)
+
+class MsgpackResponse(Response):
+    media_type = MSGPACK_MEDIA_TYPE
+    
+    def render(self, content) -> bytes:
+        return packb(content)
+
+def accepted_media_types(accept: str) -> dict:
+    """Parse Accept into {media range: q}"""
+    ranges = {}
+    for part in accept.split(","):
+        media_range, *params = part.split(";")
+        media_range = media_range.strip().lower()
+        if not media_range:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        ranges[media_range] = q
+    return ranges
+
+def media_type_quality(ranges: dict, media_type: str) -> float:
+    """q of the most specific range matching media_type, 0 if none does"""
+    main_type = media_type.split("/")[0]
+    for media_range in (media_type, f"{main_type}/*", "*/*"):
+        if media_range in ranges:
+            return ranges[media_range]
+    return 0.0
+
+def wants_msgpack(request: Request) -> bool:
+    """MessagePack only when the client names it and prefers it at least as much as JSON"""
+    ranges = accepted_media_types(request.headers.get("accept", ""))
+    if MSGPACK_MEDIA_TYPE not in ranges:
+        return False
+    q = ranges[MSGPACK_MEDIA_TYPE]
+    return q > 0 and q >= media_type_quality(ranges, "application/json")
+
+def api_response(request: Request, content, media_type: Optional[str] = None) -> Response:
+    """Serialize a read response as MessagePack or JSON depending on the Accept header"""
+    if wants_msgpack(request):
+        return MsgpackResponse(content)
+    return ORJSONResponse(content, media_type=media_type)
+
+# ========== STORED DATES ==========
+
+# Timestamps (users.created_at, session dates, progress.last_workout_date and
+# current_streak_start, created_at of schedule entries and AI plans, and
+# journeys.updated_at) are stored as BSON datetimes and read back timezone-
+# aware; responses serialize them as ISO strings. Documents written before hold
+# ISO strings until `manage.py dates` converts them; meanwhile values are read
+# through as_datetime and range queries built with date_range, which match
+# both formats.
+# scheduled_date stays a "YYYY-MM-DD" string: it is a calendar day, not an instant.
+DATE_MIGRATION_ID = "native_dates"
+legacy_date_strings = True  # Cleared at startup once the migration has completed
+
+def as_datetime(value) -> Optional[datetime]:
+    """A stored timestamp (BSON datetime, ISO string or date) as an aware UTC datetime"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    elif isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def day_start(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+def date_range(field: str, start: Optional[date] = None, end: Optional[date] = None) -> dict:
+    """Query matching `field` from the start of day `start` up to (excluding) day `end`"""
+    native = {}
+    legacy = {}
+    if start is not None:
+        native["$gte"], legacy["$gte"] = day_start(start), start.isoformat()
+    if end is not None:
+        native["$lt"], legacy["$lt"] = day_start(end), end.isoformat()
+    if not legacy_date_strings:
+        return {field: native}
+    return {"$or": [{field: native}, {field: legacy}]}
+
+def day_string(field: str) -> dict:
+    """Aggregation expression for the "YYYY-MM-DD" day of a stored timestamp"""
+    if not legacy_date_strings:
+        return {"$dateToString": {"format": "%Y-%m-%d", "date": field}}
+    # $toString renders datetimes as ISO strings too
+    return {"$substr": [{"$toString": field}, 0, 10]}
+
+# (collection, field) pairs converted by migrate_dates; bucketed session entries are handled separately
+DATE_FIELDS = (
+    ("users", "created_at"),
+    ("workout_sessions", "date"),
+    ("workout_events", "data.date"),
+    ("progress", "last_workout_date"),
+    ("progress", "current_streak_start"),
+    ("scheduled_workouts", "created_at"),
+    ("ai_workout_plans", "created_at"),
+    ("journeys", "updated_at"),
+)
+
+async def load_date_migration_state():
+    global legacy_date_strings
+    migration = await db.migrations.find_one({"_id": DATE_MIGRATION_ID})
+    legacy_date_strings = not (migration and migration.get('complete'))
+
+async def migrate_dates(batch_size: int = 1000, pause: float = 0) -> dict:
+    """Convert ISO-string timestamps to BSON datetimes; returns documents converted per field.
+    
+    Walks each collection in _id order and records its position after every
+    batch, so an interrupted run resumes where it stopped. Updates are
+    conditional on the value read, so a concurrent write always wins.
+    """
+    global legacy_date_strings
+    migration = await db.migrations.find_one({"_id": DATE_MIGRATION_ID}) or {}
+    resume = migration.get('resume', {})
+    converted = {}
+    
+    async def convert(collection: str, key: str, string_query: dict, projection: dict, make_update):
+        converted[key] = 0
+        last_id = resume.get(key)
+        while True:
+            query = dict(string_query)
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            docs = await db[collection].find(query, projection).sort("_id", 1).limit(batch_size).to_list(None)
+            if not docs:
+                return
+            result = await db[collection].bulk_write([make_update(doc) for doc in docs], ordered=False)
+            converted[key] += result.modified_count
+            last_id = docs[-1]['_id']
+            await db.migrations.update_one(
+                {"_id": DATE_MIGRATION_ID},
+                {"$set": {f"resume.{key}": last_id}},
+                upsert=True
+            )
+            if pause:
+                await asyncio.sleep(pause)
+    
+    for collection, field in DATE_FIELDS:
+        def make_update(doc, field=field):
+            value = doc
+            for part in field.split("."):
+                value = value[part]
+            return UpdateOne({"_id": doc['_id'], field: value}, {"$set": {field: as_datetime(value)}})
+        
+        await convert(
+            collection,
+            f"{collection}:{field.replace('.', '/')}",
+            {field: {"$type": "string"}},
+            {"_id": 1, field: 1},
+            make_update
+        )
+    
+    await convert(
+        "workout_session_buckets",
+        "workout_session_buckets:sessions/d",
+        {"sessions.d": {"$type": "string"}},
+        {"_id": 1, "sessions": 1},
+        lambda bucket: UpdateOne(
+            {"_id": bucket['_id'], "sessions": bucket['sessions']},
+            {"$set": {"sessions": [{**entry, "d": as_datetime(entry['d'])} for entry in bucket['sessions']]}}
+        )
+    )
+    
+    await db.migrations.update_one(
+        {"_id": DATE_MIGRATION_ID},
+        {"$set": {"complete": True, "completed_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    legacy_date_strings = False
+    return converted
+
+# ========== DATA VERSIONING ==========
+
+# Every mutating route bumps users.data_version. Read endpoints derive a weak
+# ETag from it and answer If-None-Match with 304 before loading any data.
+# Versions are cached per process; other workers' bumps become visible within
+# DATA_VERSION_TTL_SECONDS.
+data_version_cache = TTLCache(
+    maxsize=int(os.environ.get('DATA_VERSION_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('DATA_VERSION_TTL_SECONDS', '2'))
+)
+
+class NotModified(Exception):
+    def __init__(self, etag: str):
+        self.etag = etag
+
+@app.exception_handler(NotModified)
+async def not_modified_handler(request: Request, exc: NotModified):
+    return Response(status_code=304, headers={"ETag": exc.etag, "Cache-Control": "private, no-cache"})
+
+class ETagMiddleware:
+    """Adds the ETag computed by check_not_modified (request.state.etag) to 200 responses"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_with_etag(message):
+            etag = scope.get("state", {}).get("etag")
+            if message["type"] == "http.response.start" and etag and message["status"] == 200:
+                header_names = {k.lower() for k, _ in message["headers"]}
+                if b"etag" not in header_names:
+                    headers = [(k, v) for k, v in message["headers"] if k.lower() != b"cache-control"]
+                    headers += [(b"etag", etag.encode()), (b"cache-control", b"private, no-cache")]
+                    message = {**message, "headers": headers}
+            await send(message)
+        
+        await self.app(scope, receive, send_with_etag)
+
+async def get_data_version(user_id: str) -> Optional[int]:
+    version = data_version_cache.get(user_id)
+    if version is not None:
+        return version
+    version = await user_repo.data_version(user_id)
+    if version is not None:
+        data_version_cache[user_id] = version
+    return version
+
+async def bump_data_version(user_id: str, changes: Optional[List[dict]] = None) -> int:
+    """Bump the user's data version and append `changes` to their change log.
+    
+    Each change is {"kind", "op", "id", "data"}; see SYNC for how they are read back.
+    """
+    version = await user_repo.bump_data_version(user_id)
+    data_version_cache[user_id] = version
+    
+    if changes:
+        timestamp = datetime.now(timezone.utc)
+        await change_log_repo.insert_many([
+            {"user_id": user_id, "version": version, "ts": timestamp, **change}
+            for change in changes
+        ])
+        if version % CHANGE_LOG_COMPACT_EVERY == 0:
+            await compact_change_log(user_id, version)
+    
+    await publish_event(user_id, "change", {"version": version, "changes": changes or []}, version)
+    return version
+
+def data_etag(request: Request, user_id: str, version: int) -> str:
+    # The representation also depends on query params, negotiated media type,
+    # the default catalog and (for journey unlocks) the current date
+    variant = "|".join([
+        user_id,
+        request.url.path,
+        request.url.query,
+        request.headers.get("accept", ""),
+        str(default_catalog.version),
+        datetime.now(timezone.utc).date().isoformat(),
+    ])
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:12]
+    return f'W/"{version}-{digest}"'
+
+async def check_not_modified(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Route dependency: raise NotModified when the client's ETag is current"""
+    user_id = decode_access_token(credentials.credentials)
+    version = await get_data_version(user_id)
+    if version is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    etag = data_etag(request, user_id, version)
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        raise NotModified(etag)
+    request.state.etag = etag
+
+# ========== SYNC ==========
+
+# Append-only per-user change log backing delta sync. Change kinds:
+#   profile  - patch of user fields
+#   progress - patch of progress fields
+#   session  - insert or delete (undo) of a workout session
+#   schedule - patch of one scheduled entry, or replace of the whole schedule
+#   plans    - replace of the user's AI-generated plans
+# Replace records carry no data; /sync attaches the current collection.
+CHANGE_LOG_RETAIN_VERSIONS = int(os.environ.get('CHANGE_LOG_RETAIN_VERSIONS', '200'))
+CHANGE_LOG_COMPACT_EVERY = int(os.environ.get('CHANGE_LOG_COMPACT_EVERY', '50'))
+
+async def compact_change_log(user_id: str, version: int):
+    """Drop log entries older than the retention window and raise the sync floor.
+    
+    Clients syncing from below the floor are told to do a full resync.
+    """
+    floor = version - CHANGE_LOG_RETAIN_VERSIONS
+    if floor <= 0:
+        return
+    await change_log_repo.delete_through(user_id, floor)
+    await user_repo.raise_change_log_floor(user_id, floor)
+
+def collapse_changes(changes: List[dict]) -> List[dict]:
+    """Fold a version-ordered change list into the minimal equivalent list"""
+    collapsed = {}
+    for change in changes:
+        kind, op = change['kind'], change['op']
+        if op == "replace":
+            # A replace supersedes every earlier change of the same kind
+            for key in [k for k in collapsed if k[0] == kind]:
+                del collapsed[key]
+            collapsed[(kind, None)] = {"kind": kind, "op": "replace", "id": None, "data": None}
+            continue
+        
+        key = (kind, change.get('id'))
+        if op == "insert" and key[1] is None:
+            # An insert without an id is a new entity of its own; never fold it into another
+            key = (kind, object())
+        existing = collapsed.get(key)
+        if existing is not None and existing['op'] == "patch" and op == "patch":
+            existing['data'] = {**existing['data'], **change['data']}
+        else:
+            collapsed.pop(key, None)
+            collapsed[key] = {"kind": kind, "op": op, "id": change.get('id'), "data": change.get('data')}
+    
+    # Patches to an entity inside a replaced collection are already in the replacement
+    replaced = {k[0] for k, c in collapsed.items() if c['op'] == "replace"}
+    return [c for k, c in collapsed.items() if c['op'] == "replace" or k[0] not in replaced]
+
+async def force_resync(user_ids: List[str]):
+    """Bump the version of users changed in bulk, without change records, and raise
+    their sync floor to it so their next /sync is a full resync"""
+    await user_repo.force_resync(user_ids)
+    for user_id in user_ids:
+        data_version_cache.pop(user_id, None)
+
+# ========== EVENTS ==========
+
+# Per-user Server-Sent Events (GET /api/events). Event types:
+#   change       - {"version", "changes"}: the change records written to the sync log
+#   achievements - {"unlocked"}: achievements unlocked by a completion
+#   generation   - {"kind", "status", "count"}: an AI plan or schedule generation finished
+# Clients that miss events (reconnect, resync) catch up through /sync.
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'local')
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', '100'))
+EVENTS_HEARTBEAT_SECONDS = int(os.environ.get('EVENTS_HEARTBEAT_SECONDS', '15'))
+EVENTS_CAPPED_BYTES = int(os.environ.get('EVENTS_CAPPED_BYTES', str(16 * 1024 * 1024)))
+
+class LocalEventBackend:
+    """Fans events out to the subscribers connected to this process"""
+    
+    def __init__(self):
+        self.subscribers = {}
+    
+    async def start(self):
+        pass
+    
+    async def stop(self):
+        pass
+    
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[user_id]
+    
+    def deliver(self, user_id: str, event: dict):
+        for queue in self.subscribers.get(user_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow client: drop its backlog and tell it to catch up through /sync
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"event": "resync", "data": {}, "id": None})
+    
+    async def publish(self, user_id: str, event: dict):
+        self.deliver(user_id, event)
+
+class MongoEventBackend(LocalEventBackend):
+    """Shares events between workers through a capped collection that every worker tails"""
+    
+    def __init__(self):
+        super().__init__()
+        self._task = None
+    
+    async def start(self):
+        try:
+            await db.create_collection("events", capped=True, size=EVENTS_CAPPED_BYTES)
+        except CollectionInvalid:
+            pass  # Already exists
+        last = await db.events.find_one({}, sort=[("$natural", -1)])
+        self._task = asyncio.create_task(self._tail(last['_id'] if last else None))
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+    
+    async def publish(self, user_id: str, event: dict):
+        await db.events.insert_one({"user_id": user_id, **event})
+    
+    async def _tail(self, last_id):
+        while True:
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            try:
+                cursor = db.events.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for doc in cursor:
+                    last_id = doc['_id']
+                    if doc['user_id'] in self.subscribers:
+                        self.deliver(doc['user_id'], {"event": doc['event'], "data": doc['data'], "id": doc.get('id')})
+            except Exception as e:
+                logger.warning(f"Event tailing failed: {e}")
+            # Tailable cursors die on an empty collection; retry shortly
+            await asyncio.sleep(1)
+
+EVENT_BACKENDS = {
+    "local": LocalEventBackend,
+    "mongo": MongoEventBackend,
+}
+event_backend = EVENT_BACKENDS[EVENTS_BACKEND]()
+
+async def publish_event(user_id: str, event: str, data: dict, event_id: Optional[int] = None):
+    """Best-effort push to the user's event streams; never fails the write that triggered it"""
+    try:
+        await event_backend.publish(user_id, {"event": event, "data": data, "id": event_id})
+    except Exception as e:
+        logger.warning(f"Failed to publish {event} event: {e}")
+
+def format_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'), default=encode_default)}")
+    return "\n".join(lines) + "\n\n"
+
+# ========== REPOSITORIES ==========
+
+# Request-path queries live in one repository per collection; only index
+# setup, migrations, maintenance jobs and the event backend use `db` directly.
+# Each method is one database round trip and projects only the fields its
+# callers read; results are plain dicts, typed with the records below where
+# they are partial. Pydantic models are built from them at the API boundary
+# only. `round_trips` counts calls per method, session store methods included
+# (see `benchmarks.py roundtrips`).
+round_trips = Counter()
+
+def round_trip(method):
+    name = method.__qualname__
+    
+    @functools.wraps(method)
+    async def counted(*args, **kwargs):
+        round_trips[name] += 1
+        return await method(*args, **kwargs)
+    return counted
+
+class SyncState(TypedDict, total=False):
+    data_version: int
+    change_log_floor: int
+
+class ProgressState(TypedDict, total=False):
+    total_xp: int
+    level: int
+    streak: int
+    last_workout_date: Optional[datetime]
+    achievements: List[str]
+    total_workouts: int
+    total_minutes: int
+
+class PlanReward(TypedDict):
+    id: str
+    xp_reward: int
+
+class ScheduleRef(TypedDict):
+    id: str
+    workout_plan_id: str
+    is_rest_day: bool
+
+class UserRepository:
+    @property
+    def collection(self):
+        return db.users
+    
+    @round_trip
+    async def get(self, user_id: str) -> Optional[dict]:
+        """Profile fields, without the password hash"""
+        return await self.collection.find_one({"id": user_id}, {"_id": 0, "password_hash": 0})
+    
+    @round_trip
+    async def get_by_email(self, email: str) -> Optional[dict]:
+        """Profile fields and password hash, for login"""
+        return await self.collection.find_one({"email": email}, {"_id": 0})
+    
+    @round_trip
+    async def email_exists(self, email: str) -> bool:
+        return await self.collection.find_one({"email": email}, {"_id": 1}) is not None
+    
+    @round_trip
+    async def names(self, user_ids: List[str]) -> dict:
+        """user_id -> name"""
+        users = await self.collection.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+        return {u['id']: u['name'] for u in users}
+    
+    @round_trip
+    async def count(self) -> int:
+        return await self.collection.count_documents({})
+    
+    @round_trip
+    async def insert(self, user_doc: dict):
+        await self.collection.insert_one(user_doc)
+    
+    @round_trip
+    async def update(self, user_id: str, fields: dict):
+        await self.collection.update_one({"id": user_id}, {"$set": fields})
+    
+    @round_trip
+    async def delete(self, user_id: str):
+        await self.collection.delete_one({"id": user_id})
+    
+    @round_trip
+    async def data_version(self, user_id: str) -> Optional[int]:
+        """None if the user does not exist"""
+        user_doc = await self.collection.find_one({"id": user_id}, {"_id": 0, "data_version": 1})
+        return user_doc.get('data_version', 0) if user_doc is not None else None
+    
+    @round_trip
+    async def sync_state(self, user_id: str) -> SyncState:
+        return await self.collection.find_one({"id": user_id}, {"_id": 0, "data_version": 1, "change_log_floor": 1}) or {}
+    
+    @round_trip
+    async def bump_data_version(self, user_id: str) -> int:
+        user_doc = await self.collection.find_one_and_update(
+            {"id": user_id},
+            {"$inc": {"data_version": 1}},
+            {"_id": 0, "data_version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return user_doc.get('data_version', 0) if user_doc else 0
+    
+    @round_trip
+    async def raise_change_log_floor(self, user_id: str, floor: int):
+        await self.collection.update_one(
+            {"id": user_id, "change_log_floor": {"$not": {"$gte": floor}}},
+            {"$set": {"change_log_floor": floor}}
+        )
+    
+    @round_trip
+    async def force_resync(self, user_ids: List[str]):
+        """Bump data versions and raise the sync floors to them"""
+        await self.collection.bulk_write([
+            UpdateOne({"id": user_id}, [
+                {"$set": {"data_version": {"$add": [{"$ifNull": ["$data_version", 0]}, 1]}}},
+                {"$set": {"change_log_floor": "$data_version"}},
+            ])
+            for user_id in user_ids
+        ], ordered=False)
+    
+    @round_trip
+    async def reserve_event_seqs(self, user_id: str, count: int) -> int:
+        """Reserve `count` workout event sequence numbers; returns the last one"""
+        user_doc = await self.collection.find_one_and_update(
+            {"id": user_id},
+            {"$inc": {"event_seq": count}},
+            {"_id": 0, "event_seq": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        return user_doc['event_seq']
+
+class ProgressRepository:
+    @property
+    def collection(self):
+        return db.progress
+    
+    @round_trip
+    async def get(self, user_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"user_id": user_id}, PROGRESS_PROJECTION)
+    
+    @round_trip
+    async def state(self, user_id: str) -> Optional[ProgressState]:
+        """The fields workout events fold into (PROGRESS_STATE_FIELDS)"""
+        projection = {"_id": 0, **{field: 1 for field in PROGRESS_STATE_FIELDS}}
+        return await self.collection.find_one({"user_id": user_id}, projection)
+    
+    @round_trip
+    async def achievements(self, user_id: str) -> Optional[ProgressState]:
+        return await self.collection.find_one({"user_id": user_id}, {"_id": 0, "achievements": 1, "total_workouts": 1})
+    
+    @round_trip
+    async def xp_totals(self) -> dict:
+        """user_id -> total_xp of users with any XP"""
+        progress_docs = await self.collection.find(
+            {"total_xp": {"$gt": 0}},
+            {"_id": 0, "user_id": 1, "total_xp": 1}
+        ).to_list(None)
+        return {doc['user_id']: doc['total_xp'] for doc in progress_docs}
+    
+    @round_trip
+    async def insert(self, progress_doc: dict):
+        await self.collection.insert_one(progress_doc)
+    
+    @round_trip
+    async def set_state(self, user_id: str, state: ProgressState):
+        await self.collection.update_one({"user_id": user_id}, {"$set": state}, upsert=True)
+    
+    @round_trip
+    async def set_states(self, states: dict):
+        """Upsert user_id -> state in one bulk write"""
+        await self.collection.bulk_write([
+            UpdateOne({"user_id": user_id}, {"$set": state}, upsert=True)
+            for user_id, state in states.items()
+        ], ordered=False)
+    
+    @round_trip
+    async def delete(self, user_id: str):
+        await self.collection.delete_many({"user_id": user_id})
+
+class PlanRepository:
+    """Workout plans: AI-generated per user (`ai_workout_plans`) or the default catalog (`workout_plans`)"""
+    
+    def __init__(self, name: str):
+        self.name = name
+    
+    @property
+    def collection(self):
+        return db[self.name]
+    
+    @round_trip
+    async def by_ids(self, plan_ids: List[str]) -> List[dict]:
+        return await self.collection.find({"id": {"$in": plan_ids}}, PLAN_PROJECTION).to_list(None)
+    
+    @round_trip
+    async def rewards(self, plan_ids: List[str]) -> List[PlanReward]:
+        return await self.collection.find({"id": {"$in": plan_ids}}, {"_id": 0, "id": 1, "xp_reward": 1}).to_list(None)
+    
+    @round_trip
+    async def for_user(self, user_id: str, projection: Optional[dict] = None, limit: Optional[int] = 100) -> List[dict]:
+        return await self.collection.find({"user_id": user_id}, projection or {"_id": 0}).to_list(limit)
+    
+    @round_trip
+    async def ids_for_user(self, user_id: str) -> List[str]:
+        plan_docs = await self.collection.find({"user_id": user_id}, {"_id": 0, "id": 1}).to_list(None)
+        return [plan['id'] for plan in plan_docs]
+    
+    @round_trip
+    async def all(self, limit: int = 100) -> List[dict]:
+        return await self.collection.find({}, {"_id": 0}).to_list(limit)
+    
+    @round_trip
+    async def count(self) -> int:
+        return await self.collection.count_documents({})
+    
+    @round_trip
+    async def insert_many(self, plan_docs: List[dict]):
+        await self.collection.insert_many(plan_docs)
+    
+    @round_trip
+    async def delete_for_user(self, user_id: str) -> int:
+        result = await self.collection.delete_many({"user_id": user_id})
+        return result.deleted_count
+
+class ScheduleRepository:
+    @property
+    def collection(self):
+        return db.scheduled_workouts
+    
+    @round_trip
+    async def window(
+        self,
+        user_id: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        fields: Optional[set] = None
+    ) -> List[dict]:
+        """Up to 1000 entries in date order; see schedule_pipeline"""
+        return await self.collection.aggregate(schedule_pipeline(user_id, start_date, end_date, fields)).to_list(1000)
+    
+    @round_trip
+    async def all(self, user_id: str) -> List[dict]:
+        return await self.collection.find({"user_id": user_id}, {"_id": 0}).sort("scheduled_date", 1).to_list(None)
+    
+    @round_trip
+    async def get(self, user_id: str, schedule_id: str) -> Optional[ScheduleRef]:
+        return await self.collection.find_one(
+            {"id": schedule_id, "user_id": user_id},
+            {"_id": 0, "id": 1, "workout_plan_id": 1, "is_rest_day": 1}
+        )
+    
+    @round_trip
+    async def completion_states(self, user_id: str, schedule_ids: List[str]) -> dict:
+        """id -> is_completed for the ids among `schedule_ids` that are the user's workout (not rest) days"""
+        scheduled = await self.collection.find(
+            {"id": {"$in": schedule_ids}, "user_id": user_id, "is_rest_day": False},
+            {"_id": 0, "id": 1, "is_completed": 1}
+        ).to_list(None)
+        return {s['id']: s.get('is_completed', False) for s in scheduled}
+    
+    @round_trip
+    async def set_completed(self, user_id: str, schedule_ids: List[str], completed: bool = True):
+        await self.collection.update_many(
+            {"id": {"$in": schedule_ids}, "user_id": user_id},
+            {"$set": {"is_completed": completed}}
+        )
+    
+    @round_trip
+    async def insert_many(self, entries: List[dict]):
+        await self.collection.insert_many(entries)
+    
+    @round_trip
+    async def delete_for_user(self, user_id: str) -> int:
+        result = await self.collection.delete_many({"user_id": user_id})
+        return result.deleted_count
+
+class JourneyRepository:
+    @property
+    def collection(self):
+        return db.journeys
+    
+    @round_trip
+    async def get(self, user_id: str, with_plans: bool = True) -> Optional[dict]:
+        projection = {"_id": 0} if with_plans else {"_id": 0, "plans": 0}
+        return await self.collection.find_one({"user_id": user_id}, projection)
+    
+    @round_trip
+    async def replace(self, user_id: str, journey_doc: dict):
+        await self.collection.replace_one({"user_id": user_id}, journey_doc, upsert=True)
+    
+    @round_trip
+    async def set_completed(self, user_id: str, schedule_ids: List[str], completed: bool = True):
+        await self.collection.bulk_write([
+            UpdateOne({"user_id": user_id, "nodes.schedule_id": schedule_id}, {"$set": {"nodes.$.is_completed": completed}})
+            for schedule_id in schedule_ids
+        ], ordered=False)
+    
+    @round_trip
+    async def delete(self, user_id: str):
+        await self.collection.delete_one({"user_id": user_id})
+
+class CatalogMetaRepository:
+    """Version counters of shared catalogs, keyed by collection name"""
+    
+    @property
+    def collection(self):
+        return db.catalog_meta
+    
+    @round_trip
+    async def version(self, name: str) -> int:
+        meta = await self.collection.find_one({"_id": name}, {"_id": 0, "version": 1})
+        return meta.get('version', 0) if meta else 0
+    
+    @round_trip
+    async def bump_version(self, name: str):
+        await self.collection.update_one({"_id": name}, {"$inc": {"version": 1}}, upsert=True)
+
+class ChangeLogRepository:
+    @property
+    def collection(self):
+        return db.change_log
+    
+    @round_trip
+    async def since(self, user_id: str, since: int, version: int) -> List[dict]:
+        """Changes after version `since` up to `version`, in version order"""
+        return await self.collection.find(
+            {"user_id": user_id, "version": {"$gt": since, "$lte": version}},
+            {"_id": 0, "version": 1, "kind": 1, "op": 1, "id": 1, "data": 1}
+        ).sort([("version", 1), ("_id", 1)]).to_list(None)
+    
+    @round_trip
+    async def insert_many(self, entries: List[dict]):
+        await self.collection.insert_many(entries)
+    
+    @round_trip
+    async def delete_through(self, user_id: str, version: int):
+        await self.collection.delete_many({"user_id": user_id, "version": {"$lte": version}})
+    
+    @round_trip
+    async def delete_for_user(self, user_id: str):
+        await self.collection.delete_many({"user_id": user_id})
+
+class WorkoutEventRepository:
+    @property
+    def collection(self):
+        return db.workout_events
+    
+    @round_trip
+    async def after(self, user_id: str, seq: Optional[int] = None) -> List[dict]:
+        """The user's events after `seq` (all of them if None), in seq order"""
+        query = {"user_id": user_id}
+        if seq is not None:
+            query["seq"] = {"$gt": seq}
+        return await self.collection.find(query, {"_id": 0}).sort("seq", 1).to_list(None)
+    
+    @round_trip
+    async def first_seq(self, user_id: str) -> Optional[int]:
+        event = await self.collection.find_one({"user_id": user_id}, {"_id": 0, "seq": 1}, sort=[("seq", 1)])
+        return event['seq'] if event else None
+    
+    @round_trip
+    async def completion_seq(self, user_id: str, session_id: str) -> Optional[int]:
+        event = await self.collection.find_one(
+            {"user_id": user_id, "type": "completion", "data.session_id": session_id},
+            {"_id": 0, "seq": 1}
+        )
+        return event['seq'] if event else None
+    
+    @round_trip
+    async def logged_session_ids(self, user_id: str) -> List[str]:
+        return await self.collection.distinct("data.session_id", {"user_id": user_id, "type": "completion"})
+    
+    @round_trip
+    async def insert_many(self, events: List[dict]):
+        await self.collection.insert_many(events)
+    
+    @round_trip
+    async def delete_for_user(self, user_id: str):
+        await self.collection.delete_many({"user_id": user_id})
+
+class SnapshotRepository:
+    @property
+    def collection(self):
+        return db.progress_snapshots
+    
+    @round_trip
+    async def latest(self, user_id: str, before_seq: Optional[int] = None) -> Optional[dict]:
+        """The user's latest snapshot, or the latest one before `before_seq`"""
+        query = {"user_id": user_id}
+        if before_seq is not None:
+            query["seq"] = {"$lt": before_seq}
+        return await self.collection.find_one(query, {"_id": 0}, sort=[("seq", -1)])
+    
+    @round_trip
+    async def save(self, user_id: str, seq: int, state: dict):
+        await self.collection.update_one(
+            {"user_id": user_id, "seq": seq},
+            {"$set": {"state": state, "ts": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+    
+    @round_trip
+    async def insert_many(self, snapshots: List[dict]):
+        await self.collection.insert_many(snapshots)
+    
+    @round_trip
+    async def delete_for_users(self, user_ids: List[str]):
+        await self.collection.delete_many({"user_id": {"$in": user_ids}})
+
+class RollupRepository:
+    @property
+    def collection(self):
+        return db.stats_rollups
+    
+    @round_trip
+    async def window(self, user_id: str, bucket: str, start: str, end: str) -> List[dict]:
+        """The user's `bucket` rollups starting in [start, end)"""
+        return await self.collection.find(
+            {"user_id": user_id, "bucket": bucket, "start": {"$gte": start, "$lt": end}},
+            {"_id": 0, "start": 1, "workouts": 1, "minutes": 1, "xp": 1}
+        ).to_list(None)
+    
+    @round_trip
+    async def increment(self, user_id: str, increments: dict):
+        """Add {(bucket, start): totals} to the user's rollups, creating missing ones"""
+        await self.collection.bulk_write([
+            UpdateOne({"user_id": user_id, "bucket": bucket, "start": start}, {"$inc": totals}, upsert=True)
+            for (bucket, start), totals in increments.items()
+        ], ordered=False)
+    
+    @round_trip
+    async def delete_empty(self, user_id: str):
+        await self.collection.delete_many({"user_id": user_id, "workouts": {"$lte": 0}})
+    
+    @round_trip
+    async def insert_many(self, rollups: List[dict]):
+        await self.collection.insert_many(rollups)
+    
+    @round_trip
+    async def delete_for_users(self, user_ids: Optional[List[str]]):
+        """Rollups of `user_ids`, or of everyone if None"""
+        await self.collection.delete_many({"user_id": {"$in": user_ids}} if user_ids is not None else {})
+
+class BodyWeightRepository:
+    @property
+    def collection(self):
+        return db.body_weight
+    
+    @round_trip
+    async def latest(self, user_id: str, ts_range: dict, limit: int) -> List[dict]:
+        """The most recent `limit` entries in `ts_range`, newest first"""
+        match = {"user_id": user_id, **({"ts": ts_range} if ts_range else {})}
+        return await self.collection.find(match, {"_id": 0, "ts": 1, "weight": 1}).sort("ts", -1).to_list(limit)
+    
+    @round_trip
+    async def buckets(self, user_id: str, ts_range: dict, date_format: str) -> List[dict]:
+        """Average, min, max and count per `date_format` bucket of ts, in bucket order"""
+        match = {"user_id": user_id, **({"ts": ts_range} if ts_range else {})}
+        return await self.collection.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": {"$dateToString": {"format": date_format, "date": "$ts"}},
+                "weight": {"$avg": "$weight"},
+                "min": {"$min": "$weight"},
+                "max": {"$max": "$weight"},
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"_id": 1}},
+        ]).to_list(None)
+    
+    @round_trip
+    async def insert_many(self, entries: List[dict]):
+        await self.collection.insert_many(entries)
+    
+    @round_trip
+    async def delete_for_user(self, user_id: str):
+        await self.collection.delete_many({"user_id": user_id})
+
+user_repo = UserRepository()
+progress_repo = ProgressRepository()
+ai_plan_repo = PlanRepository("ai_workout_plans")
+default_plan_repo = PlanRepository("workout_plans")
+schedule_repo = ScheduleRepository()
+journey_repo = JourneyRepository()
+catalog_meta_repo = CatalogMetaRepository()
+change_log_repo = ChangeLogRepository()
+event_repo = WorkoutEventRepository()
+snapshot_repo = SnapshotRepository()
+rollup_repo = RollupRepository()
+body_weight_repo = BodyWeightRepository()
+
+# ========== SESSION STORAGE ==========
+
+# Completed workout sessions are stored in one of two layouts (SESSION_STORAGE):
+#   documents - one document per session in `workout_sessions`
+#   buckets   - one document per user and month in `workout_session_buckets`:
+#               {user_id, month: "YYYY-MM", count, minutes, xp, sessions: [entry]}
+#               with compact entries (SESSION_ENTRY_KEYS) and running totals in
+#               the header, so a user's history reads one document per month.
+#               Uploaded client_ids are claimed in `workout_session_client_ids`.
+# Both stores take and return sessions as WorkoutSession documents.
+# `manage.py sessions --to <layout>` copies sessions from the other layout.
+SESSION_STORAGE = os.environ.get('SESSION_STORAGE', 'documents')
+SESSION_ENTRY_KEYS = {
+    "id": "i",
+    "workout_plan_id": "p",
+    "date": "d",
+    "xp_earned": "x",
+    "duration_minutes": "m",
+    "schedule_id": "s",
+    "client_id": "c",
+    "status": "t",
+}
+
+class DocumentSessionStore:
+    """One document per session"""
+    
+    @property
+    def collection(self):
+        return db.workout_sessions
+    
+    async def ensure_indexes(self):
+        await self.collection.create_index([("user_id", 1), ("date", 1)])
+        await self.collection.create_index(
+            [("user_id", 1), ("client_id", 1)],
+            unique=True,
+            partialFilterExpression={"client_id": {"$exists": True}}
+        )
+    
+    @round_trip
+    async def insert(self, session_docs: List[dict]) -> set:
+        """Insert sessions; returns the indexes of those skipped as duplicates (by client_id)"""
+        try:
+            await self.collection.insert_many(session_docs, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(error['code'] != 11000 for error in errors):
+                raise
+            return {error['index'] for error in errors}
+        return set()
+    
+    @round_trip
+    async def uploaded(self, user_id: str, client_ids: List[str]) -> set:
+        """The client_ids among `client_ids` the user has already uploaded"""
+        session_docs = await self.collection.find(
+            {"user_id": user_id, "client_id": {"$in": client_ids}},
+            {"_id": 0, "client_id": 1}
+        ).to_list(None)
+        return {doc['client_id'] for doc in session_docs}
+    
+    @round_trip
+    async def load(self, session_docs: List[dict]):
+        """Bulk insert sessions known to be new, e.g. when migrating"""
+        if session_docs:
+            await self.collection.insert_many(session_docs, ordered=False)
+    
+    @round_trip
+    async def find(self, user_id: str, session_id: str) -> Optional[dict]:
+        session_doc = await self.collection.find_one({"id": session_id, "user_id": user_id}, {"_id": 0})
+        if session_doc:
+            session_doc['date'] = as_datetime(session_doc['date'])
+        return session_doc
+    
+    @round_trip
+    async def delete(self, user_id: str, session_doc: dict):
+        await self.collection.delete_one({"id": session_doc['id'], "user_id": user_id})
+    
+    @round_trip
+    async def delete_users(self, user_ids: List[str]):
+        await self.collection.delete_many({"user_id": {"$in": user_ids}})
+    
+    @round_trip
+    async def list(self, user_ids: List[str], exclude_ids: List[str] = ()) -> List[dict]:
+        """Sessions of `user_ids` in date order"""
+        query = {"user_id": {"$in": user_ids}}
+        if exclude_ids:
+            query["id"] = {"$nin": list(exclude_ids)}
+        session_docs = await self.collection.find(query, {"_id": 0}).to_list(None)
+        for doc in session_docs:
+            doc['date'] = as_datetime(doc['date'])
+        return sorted(session_docs, key=lambda doc: doc['date'])
+    
+    @round_trip
+    async def user_ids(self) -> List[str]:
+        return await self.collection.distinct("user_id")
+    
+    @round_trip
+    async def totals(self, user_ids: Optional[List[str]] = None) -> dict:
+        """user_id -> {"total_workouts", "total_minutes"}"""
+        pipeline = [
+            {"$group": {
+                "_id": "$user_id",
+                "total_workouts": {"$sum": 1},
+                "total_minutes": {"$sum": "$duration_minutes"},
+            }},
+        ]
+        if user_ids is not None:
+            pipeline.insert(0, {"$match": {"user_id": {"$in": user_ids}}})
+        rows = await self.collection.aggregate(pipeline).to_list(None)
+        return {row['_id']: {"total_workouts": row['total_workouts'], "total_minutes": row['total_minutes']} for row in rows}
+    
+    @round_trip
+    async def xp_since(self, start: datetime) -> dict:
+        """user_id -> XP from sessions on or after `start`"""
+        rows = await self.collection.aggregate([
+            {"$match": date_range("date", start.date())},
+            {"$group": {"_id": "$user_id", "xp": {"$sum": "$xp_earned"}}},
+        ]).to_list(None)
+        return {row['_id']: row['xp'] for row in rows}
+    
+    @round_trip
+    async def daily_totals(self, user_ids: Optional[List[str]] = None) -> List[dict]:
+        """Rows of {user_id, day, workouts, minutes, xp} per user and UTC day"""
+        match = {"user_id": {"$in": user_ids}} if user_ids is not None else {}
+        rows = await self.collection.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": {"user_id": "$user_id", "day": day_string("$date")},
+                "workouts": {"$sum": 1},
+                "minutes": {"$sum": "$duration_minutes"},
+                "xp": {"$sum": "$xp_earned"},
+            }},
+        ]).to_list(None)
+        return [{**row['_id'], "workouts": row['workouts'], "minutes": row['minutes'], "xp": row['xp']} for row in rows]
+
+def session_entry(session_doc: dict) -> dict:
+    entry = {
+        short: session_doc[field] for field, short in SESSION_ENTRY_KEYS.items()
+        if session_doc.get(field) is not None
+    }
+    if entry.get("t") == "completed":
+        del entry["t"]
+    return entry
+
+def session_from_entry(user_id: str, entry: dict) -> dict:
+    session_doc = {"user_id": user_id, "status": "completed", "schedule_id": None}
+    session_doc.update({field: entry[short] for field, short in SESSION_ENTRY_KEYS.items() if short in entry})
+    session_doc['date'] = as_datetime(session_doc['date'])
+    return session_doc
+
+def session_month(session_doc: dict) -> str:
+    return as_datetime(session_doc['date']).strftime("%Y-%m")
+
+class BucketedSessionStore:
+    """One document per user and month, holding that month's sessions.
+    
+    Uploaded client_ids are claimed in a separate collection, as a bucket's
+    unique index only covers its own month.
+    """
+    
+    @property
+    def collection(self):
+        return db.workout_session_buckets
+    
+    @property
+    def claims(self):
+        return db.workout_session_client_ids
+    
+    async def ensure_indexes(self):
+        await self.collection.create_index([("user_id", 1), ("month", 1)], unique=True)
+        await self.claims.create_index([("user_id", 1), ("client_id", 1)], unique=True)
+    
+    def _push(self, user_id: str, session_doc: dict):
+        """Filter and update appending a session to its bucket (creating the bucket if needed)"""
+        return {"user_id": user_id, "month": session_month(session_doc)}, {
+            "$push": {"sessions": session_entry(session_doc)},
+            "$inc": {"count": 1, "minutes": session_doc['duration_minutes'], "xp": session_doc['xp_earned']},
+        }
+    
+    async def _claim(self, session_docs: List[dict]) -> set:
+        """Claim the sessions' client_ids; returns the indexes of those already claimed"""
+        claimed = [i for i, doc in enumerate(session_docs) if doc.get('client_id')]
+        if not claimed:
+            return set()
+        try:
+            await self.claims.insert_many([
+                {"user_id": session_docs[i]['user_id'], "client_id": session_docs[i]['client_id']} for i in claimed
+            ], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(error['code'] != 11000 for error in errors):
+                raise
+            return {claimed[error['index']] for error in errors}
+        return set()
+    
+    @round_trip
+    async def insert(self, session_docs: List[dict]) -> set:
+        """Append sessions; returns the indexes of those skipped as duplicates (by client_id)"""
+        duplicates = await self._claim(session_docs)
+        pushed = [i for i in range(len(session_docs)) if i not in duplicates]
+        if not pushed:
+            return duplicates
+        try:
+            await self.collection.bulk_write([
+                UpdateOne(*self._push(session_docs[i]['user_id'], session_docs[i]), upsert=True) for i in pushed
+            ], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(error['code'] != 11000 for error in errors):
+                raise
+            for error in errors:
+                # Another upsert created the bucket first: retry
+                doc = session_docs[pushed[error['index']]]
+                await self.collection.update_one(*self._push(doc['user_id'], doc), upsert=True)
+        return duplicates
+    
+    @round_trip
+    async def uploaded(self, user_id: str, client_ids: List[str]) -> set:
+        """The client_ids among `client_ids` the user has already uploaded"""
+        claims = await self.claims.find(
+            {"user_id": user_id, "client_id": {"$in": client_ids}},
+            {"_id": 0, "client_id": 1}
+        ).to_list(None)
+        return {claim['client_id'] for claim in claims}
+    
+    @round_trip
+    async def load(self, session_docs: List[dict]):
+        """Bulk insert sessions known to be new, e.g. when migrating; their buckets must not exist yet"""
+        buckets = {}
+        for doc in sorted(session_docs, key=lambda doc: as_datetime(doc['date'])):
+            month = session_month(doc)
+            bucket = buckets.setdefault((doc['user_id'], month), {
+                "user_id": doc['user_id'], "month": month, "count": 0, "minutes": 0, "xp": 0, "sessions": []
+            })
+            bucket['count'] += 1
+            bucket['minutes'] += doc['duration_minutes']
+            bucket['xp'] += doc['xp_earned']
+            bucket['sessions'].append(session_entry(doc))
+        if buckets:
+            await self.collection.insert_many(list(buckets.values()), ordered=False)
+        claims = [{"user_id": doc['user_id'], "client_id": doc['client_id']} for doc in session_docs if doc.get('client_id')]
+        if claims:
+            await self.claims.insert_many(claims, ordered=False)
+    
+    @round_trip
+    async def find(self, user_id: str, session_id: str) -> Optional[dict]:
+        bucket = await self.collection.find_one(
+            {"user_id": user_id, "sessions.i": session_id},
+            {"_id": 0, "sessions": {"$elemMatch": {"i": session_id}}}
+        )
+        return session_from_entry(user_id, bucket['sessions'][0]) if bucket else None
+    
+    @round_trip
+    async def delete(self, user_id: str, session_doc: dict):
+        month = session_month(session_doc)
+        await self.collection.update_one(
+            {"user_id": user_id, "month": month, "sessions.i": session_doc['id']},
+            {
+                "$pull": {"sessions": {"i": session_doc['id']}},
+                "$inc": {"count": -1, "minutes": -session_doc['duration_minutes'], "xp": -session_doc['xp_earned']},
+            }
+        )
+        await self.collection.delete_one({"user_id": user_id, "month": month, "count": {"$lte": 0}})
+        if session_doc.get('client_id'):
+            # Like deleting a session document, this frees its client_id
+            await self.claims.delete_one({"user_id": user_id, "client_id": session_doc['client_id']})
     
-    if isinstance(user_doc.get('created_at'), str):
-        user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
+    @round_trip
+    async def delete_users(self, user_ids: List[str]):
+        await self.collection.delete_many({"user_id": {"$in": user_ids}})
+        await self.claims.delete_many({"user_id": {"$in": user_ids}})
     
-    return User(**user_doc)
+    @round_trip
+    async def list(self, user_ids: List[str], exclude_ids: List[str] = ()) -> List[dict]:
+        """Sessions of `user_ids` in date order"""
+        exclude_ids = set(exclude_ids)
+        buckets = await self.collection.find(
+            {"user_id": {"$in": user_ids}},
+            {"_id": 0, "user_id": 1, "sessions": 1}
+        ).to_list(None)
+        session_docs = [
+            session_from_entry(bucket['user_id'], entry)
+            for bucket in buckets
+            for entry in bucket['sessions']
+            if entry['i'] not in exclude_ids
+        ]
+        return sorted(session_docs, key=lambda doc: doc['date'])
+    
+    @round_trip
+    async def user_ids(self) -> List[str]:
+        return await self.collection.distinct("user_id")
+    
+    @round_trip
+    async def totals(self, user_ids: Optional[List[str]] = None) -> dict:
+        """user_id -> {"total_workouts", "total_minutes"}, from the bucket headers"""
+        pipeline = [
+            {"$group": {
+                "_id": "$user_id",
+                "total_workouts": {"$sum": "$count"},
+                "total_minutes": {"$sum": "$minutes"},
+            }},
+        ]
+        if user_ids is not None:
+            pipeline.insert(0, {"$match": {"user_id": {"$in": user_ids}}})
+        rows = await self.collection.aggregate(pipeline).to_list(None)
+        return {row['_id']: {"total_workouts": row['total_workouts'], "total_minutes": row['total_minutes']} for row in rows}
+    
+    @round_trip
+    async def xp_since(self, start: datetime) -> dict:
+        """user_id -> XP from sessions on or after `start`"""
+        rows = await self.collection.aggregate([
+            {"$match": {"month": {"$gte": start.strftime("%Y-%m")}}},
+            {"$unwind": "$sessions"},
+            {"$match": date_range("sessions.d", start.date())},
+            {"$group": {"_id": "$user_id", "xp": {"$sum": "$sessions.x"}}},
+        ]).to_list(None)
+        return {row['_id']: row['xp'] for row in rows}
+    
+    @round_trip
+    async def daily_totals(self, user_ids: Optional[List[str]] = None) -> List[dict]:
+        """Rows of {user_id, day, workouts, minutes, xp} per user and UTC day"""
+        match = {"user_id": {"$in": user_ids}} if user_ids is not None else {}
+        rows = await self.collection.aggregate([
+            {"$match": match},
+            {"$unwind": "$sessions"},
+            {"$group": {
+                "_id": {"user_id": "$user_id", "day": day_string("$sessions.d")},
+                "workouts": {"$sum": 1},
+                "minutes": {"$sum": "$sessions.m"},
+                "xp": {"$sum": "$sessions.x"},
+            }},
+        ]).to_list(None)
+        return [{**row['_id'], "workouts": row['workouts'], "minutes": row['minutes'], "xp": row['xp']} for row in rows]
+
+SESSION_STORES = {
+    "documents": DocumentSessionStore,
+    "buckets": BucketedSessionStore,
+}
+session_store = SESSION_STORES[SESSION_STORAGE]()
+
+async def migrate_sessions(source, target, user_ids: List[str]) -> int:
+    """Copy the sessions of `user_ids` from one store to another, replacing what the target has for them"""
+    session_docs = await source.list(user_ids)
+    await target.delete_users(user_ids)
+    await target.load(session_docs)
+    return len(session_docs)
+
+# ========== LEADERBOARD ==========
+
+# XP leaderboards per window: "all" ranks total_xp, "week" ranks XP earned
+# since Monday 00:00 UTC. Completions and undos update them incrementally;
+# they are rebuilt from progress and sessions at startup (and so pick up
+# progress replayed offline on the next restart).
+LEADERBOARD_BACKEND = os.environ.get('LEADERBOARD_BACKEND', 'local')
+LEADERBOARD_WINDOWS = ("all", "week")
+LEADERBOARD_MAX_LIMIT = 100
+
+def week_start(now: Optional[datetime] = None) -> datetime:
+    now = now or datetime.now(timezone.utc)
+    monday = now.date() - timedelta(days=now.weekday())
+    return datetime(monday.year, monday.month, monday.day, tzinfo=timezone.utc)
+
+class LocalLeaderboardBackend:
+    """In-process order-statistics index: a SortedList of (-xp, user_id) per window.
+    
+    Updates, ranks and range reads are O(log n).
+    """
+    
+    def __init__(self):
+        self.boards = {window: ({}, SortedList()) for window in LEADERBOARD_WINDOWS}
+        self.week = week_start()
+    
+    def _board(self, window: str):
+        if window == "week" and week_start() != self.week:
+            # New week: the weekly board starts empty
+            self.week = week_start()
+            self.boards["week"] = ({}, SortedList())
+        return self.boards[window]
+    
+    async def rebuild(self, window: str, scores: dict):
+        self.boards[window] = (
+            {user_id: xp for user_id, xp in scores.items() if xp > 0},
+            SortedList((-xp, user_id) for user_id, xp in scores.items() if xp > 0)
+        )
+        if window == "week":
+            self.week = week_start()
+    
+    async def set(self, window: str, user_id: str, xp: int):
+        scores, index = self._board(window)
+        old = scores.pop(user_id, None)
+        if old is not None:
+            index.remove((-old, user_id))
+        if xp > 0:
+            scores[user_id] = xp
+            index.add((-xp, user_id))
+    
+    async def incr(self, window: str, user_id: str, delta: int):
+        scores, _ = self._board(window)
+        await self.set(window, user_id, scores.get(user_id, 0) + delta)
+    
+    async def rank(self, window: str, user_id: str):
+        """(0-based rank, xp), or None if the user is not on the board"""
+        scores, index = self._board(window)
+        xp = scores.get(user_id)
+        if xp is None:
+            return None
+        return index.index((-xp, user_id)), xp
+    
+    async def range(self, window: str, start: int, count: int) -> list:
+        _, index = self._board(window)
+        return [(user_id, -neg_xp) for neg_xp, user_id in index[start:start + count]]
+
+class RedisLeaderboardBackend:
+    """Sorted sets in Redis, shared by every worker"""
+    
+    def __init__(self):
+        if aioredis is None:
+            raise RuntimeError("LEADERBOARD_BACKEND=redis requires the redis package")
+        self.redis = aioredis.from_url(os.environ['REDIS_URL'])
+    
+    def _key(self, window: str) -> str:
+        if window == "week":
+            return f"leaderboard:week:{week_start().date().isoformat()}"
+        return f"leaderboard:{window}"
+    
+    async def rebuild(self, window: str, scores: dict):
+        key = self._key(window)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            items = {user_id: xp for user_id, xp in scores.items() if xp > 0}
+            if items:
+                pipe.zadd(key, items)
+            if window == "week":
+                pipe.expire(key, 8 * 24 * 3600)
+            await pipe.execute()
+    
+    async def set(self, window: str, user_id: str, xp: int):
+        if xp > 0:
+            await self.redis.zadd(self._key(window), {user_id: xp})
+        else:
+            await self.redis.zrem(self._key(window), user_id)
+    
+    async def incr(self, window: str, user_id: str, delta: int):
+        key = self._key(window)
+        xp = await self.redis.zincrby(key, delta, user_id)
+        if xp <= 0:
+            await self.redis.zrem(key, user_id)
+        if window == "week":
+            await self.redis.expire(key, 8 * 24 * 3600)
+    
+    async def rank(self, window: str, user_id: str):
+        key = self._key(window)
+        rank = await self.redis.zrevrank(key, user_id)
+        if rank is None:
+            return None
+        return rank, int(await self.redis.zscore(key, user_id))
+    
+    async def range(self, window: str, start: int, count: int) -> list:
+        rows = await self.redis.zrevrange(self._key(window), start, start + count - 1, withscores=True)
+        return [(user_id.decode(), int(xp)) for user_id, xp in rows]
+
+LEADERBOARD_BACKENDS = {
+    "local": LocalLeaderboardBackend,
+    "redis": RedisLeaderboardBackend,
+}
+leaderboard = LEADERBOARD_BACKENDS[LEADERBOARD_BACKEND]()
+
+async def load_leaderboards():
+    totals = await progress_repo.xp_totals()
+    await leaderboard.rebuild("all", totals)
+    
+    weekly = await session_store.xp_since(week_start())
+    await leaderboard.rebuild("week", weekly)
+    logger.info(f"Loaded leaderboards ({len(totals)} users, {len(weekly)} this week)")
+
+async def update_leaderboards(user_id: str, total_xp: int, week_delta: int = 0):
+    """Best-effort leaderboard update after a user's XP changed"""
+    try:
+        await leaderboard.set("all", user_id, total_xp)
+        if week_delta:
+            await leaderboard.incr("week", user_id, week_delta)
+    except Exception as e:
+        logger.warning(f"Failed to update leaderboards: {e}")
+
+def week_xp(session_docs: List[dict]) -> int:
+    """XP from the sessions that fall in the current leaderboard week"""
+    start = week_start()
+    return sum(doc['xp_earned'] for doc in session_docs if as_datetime(doc['date']) >= start)
+
+# ========== STATS ROLLUPS ==========
+
+# Per-user totals of workouts, minutes and XP per UTC day and per week
+# (starting Monday), in `stats_rollups` keyed by (user_id, bucket, start).
+# Completions and undos $inc them; backfill_rollups builds them from
+# the session store for sessions recorded before the rollups existed.
+# Months are summed from day rollups on read.
+ROLLUP_BUCKETS = ("day", "week")
+STATS_BUCKETS = ("day", "week", "month")
+STATS_HISTORY_MAX_BUCKETS = 400
+STATS_HISTORY_DEFAULT_BUCKETS = 12
+
+def bucket_start(day: date, bucket: str) -> date:
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+def next_bucket_start(start: date, bucket: str) -> date:
+    if bucket == "day":
+        return start + timedelta(days=1)
+    if bucket == "week":
+        return start + timedelta(weeks=1)
+    return (start + timedelta(days=32)).replace(day=1)
+
+def rollup_increments(session_docs: List[dict], sign: int = 1) -> dict:
+    """{(bucket, start): {"workouts", "minutes", "xp"}} for the sessions, negated when sign is -1"""
+    increments = {}
+    for doc in session_docs:
+        day = parse_workout_date(doc['date'])
+        for bucket in ROLLUP_BUCKETS:
+            totals = increments.setdefault((bucket, bucket_start(day, bucket).isoformat()), {"workouts": 0, "minutes": 0, "xp": 0})
+            totals['workouts'] += sign
+            totals['minutes'] += sign * doc['duration_minutes']
+            totals['xp'] += sign * doc['xp_earned']
+    return increments
+
+async def update_rollups(user_id: str, session_docs: List[dict], sign: int = 1):
+    """Add (or with sign=-1, remove) sessions to the user's day and week rollups"""
+    increments = rollup_increments(session_docs, sign)
+    if not increments:
+        return
+    await rollup_repo.increment(user_id, increments)
+    if sign < 0:
+        await rollup_repo.delete_empty(user_id)
+
+async def backfill_rollups(user_ids: Optional[List[str]] = None) -> int:
+    """Rebuild rollups from stored sessions (for `user_ids`, or everyone); returns the rollups written.
+    
+    Rollups are overwritten rather than incremented, so re-running is safe; run it
+    while completions are quiet, as a completion between the read and the write is lost.
+    """
+    days = await session_store.daily_totals(user_ids)
+    
+    rollups = {}
+    for row in days:
+        user_id, day = row['user_id'], date.fromisoformat(row['day'])
+        for bucket in ROLLUP_BUCKETS:
+            totals = rollups.setdefault((user_id, bucket, bucket_start(day, bucket).isoformat()), {"workouts": 0, "minutes": 0, "xp": 0})
+            for field in totals:
+                totals[field] += row[field]
+    
+    await rollup_repo.delete_for_users(user_ids)
+    if rollups:
+        await rollup_repo.insert_many([
+            {"user_id": user_id, "bucket": bucket, "start": start, **totals}
+            for (user_id, bucket, start), totals in rollups.items()
+        ])
+    return len(rollups)
 
 # ========== SEED WORKOUT PLANS ==========
 
 async def seed_workout_plans():
-    existing = await db.workout_plans.count_documents({})
+    existing = await default_plan_repo.count()
     if existing > 0:
         return
     
@@ -325,355 +1948,1621 @@ async def seed_workout_plans():
         },
     ]
     
-    await db.workout_plans.insert_many(workout_plans)
+    await default_plan_repo.insert_many(workout_plans)
+    await catalog_meta_repo.bump_version("workout_plans")
     logger.info(f"Seeded {len(workout_plans)} workout plans")
 
+# ========== DEFAULT PLAN CATALOG ==========
+
+CATALOG_CHECK_SECONDS = int(os.environ.get('CATALOG_CHECK_SECONDS', '60'))
+
+class DefaultPlanCatalog:
+    """In-process copy of the seeded default plans.
+    
+    Loaded once at startup and pre-serialized to JSON and MessagePack, each with
+    a content-hash ETag.
+    The `catalog_meta` version is re-checked at most every CATALOG_CHECK_SECONDS
+    and the catalog reloaded only when it changes.
+    """
+    
+    def __init__(self):
+        self.version = None
+        self.plans = ()
+        self.by_id = MappingProxyType({})
+        self.bodies = {}
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def load(self):
+        version = await catalog_meta_repo.version("workout_plans")
+        plans = await default_plan_repo.all()
+        
+        self.plans = tuple(plans)
+        self.by_id = MappingProxyType({p['id']: p for p in plans})
+        # media type -> (body, etag, precompressed bodies)
+        self.bodies = {
+            media_type: (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"', precompress(body))
+            for media_type, body in (
+                ("application/json", json.dumps(plans, separators=(",", ":")).encode()),
+                (MSGPACK_MEDIA_TYPE, packb(plans)),
+            )
+        }
+        self.version = version
+        self._checked_at = time.monotonic()
+        logger.info(f"Loaded default plan catalog v{self.version} ({len(plans)} plans)")
+    
+    async def ensure_fresh(self):
+        if time.monotonic() - self._checked_at < CATALOG_CHECK_SECONDS:
+            return
+        async with self._lock:
+            if time.monotonic() - self._checked_at < CATALOG_CHECK_SECONDS:
+                return
+            version = await catalog_meta_repo.version("workout_plans")
+            if version != self.version:
+                await self.load()
+            else:
+                self._checked_at = time.monotonic()
+    
+    def response(self, request: Request) -> Response:
+        media_type = MSGPACK_MEDIA_TYPE if wants_msgpack(request) else "application/json"
+        body, etag, encoded_bodies = self.bodies[media_type]
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept, Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        
+        # Serve the precompressed body; the compression middleware leaves encoded responses alone
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), encoded_bodies)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(content=encoded_bodies[encoding], media_type=media_type, headers=headers)
+        return Response(content=body, media_type=media_type, headers=headers)
+
+default_catalog = DefaultPlanCatalog()
+
+# ========== SCHEDULE QUERIES ==========
+
+# Plan fields the schedule views need (drops user_id, created_at and _id)
+PLAN_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "name": 1,
+    "difficulty": 1,
+    "exercises": 1,
+    "target_muscles": 1,
+    "xp_reward": 1,
+    "duration_minutes": 1,
+}
+
+PLAN_FIELDS = {field for field in PLAN_PROJECTION if field != "_id"}
+SCHEDULE_FIELDS = {
+    "id", "user_id", "workout_plan_id", "scheduled_date", "day_of_week",
+    "is_rest_day", "is_completed", "created_at"
+}
+JOURNEY_NODE_FIELDS = {
+    "id", "schedule_id", "workout_plan_id", "is_completed", "is_next",
+    "is_rest_day", "scheduled_date", "is_locked", "position"
+}
+
+def schedule_pipeline(
+    user_id: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    fields: Optional[set] = None
+) -> list:
+    """Aggregation over a user's schedule, optionally limited to a date window and field subset"""
+    match = {"user_id": user_id}
+    if start_date or end_date:
+        match["scheduled_date"] = {}
+        if start_date:
+            match["scheduled_date"]["$gte"] = start_date
+        if end_date:
+            match["scheduled_date"]["$lte"] = end_date
+    
+    projection = {"_id": 0}
+    if fields is not None:
+        # Fields needed to resolve plans are always fetched; callers trim afterwards
+        needed = (fields & SCHEDULE_FIELDS) | {"id", "workout_plan_id", "is_rest_day", "scheduled_date"}
+        projection.update({field: 1 for field in needed})
+    
+    return [
+        {"$match": match},
+        {"$sort": {"scheduled_date": 1}},
+        {"$limit": 1000},
+        {"$project": projection},
+    ]
+
+async def fetch_enriched_schedule(
+    user_id: str,
+    resolver: "PlanResolver",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    fields: Optional[set] = None,
+    with_plans: bool = True
+):
+    """Return (scheduled entries, plans keyed by id) for a user's schedule.
+    
+    Plans come from the shared plan cache, so a warm cache costs a single
+    schedule query.
+    """
+    scheduled = await schedule_repo.window(user_id, start_date, end_date, fields)
+    if not with_plans:
+        return scheduled, {}
+    
+    workout_ids = [s['workout_plan_id'] for s in scheduled if not s['is_rest_day']]
+    plans_dict = await resolver.load_many(workout_ids)
+    return scheduled, plans_dict
+
+async def ensure_indexes():
+    await db.scheduled_workouts.create_index([("user_id", 1), ("scheduled_date", 1)])
+    await db.ai_workout_plans.create_index("id")
+    await db.ai_workout_plans.create_index("user_id")
+    await db.workout_plans.create_index("id")
+    await db.journeys.create_index("user_id", unique=True)
+    await db.change_log.create_index([("user_id", 1), ("version", 1)])
+    await db.workout_events.create_index([("user_id", 1), ("seq", 1)], unique=True)
+    await db.workout_events.create_index([("user_id", 1), ("data.session_id", 1)])
+    await db.progress_snapshots.create_index([("user_id", 1), ("seq", -1)])
+    await db.stats_rollups.create_index([("user_id", 1), ("bucket", 1), ("start", 1)], unique=True)
+    await db.progress.create_index(
+        "last_workout_date",
+        partialFilterExpression={"streak": {"$gt": 0}}
+    )
+    await session_store.ensure_indexes()
+    await create_body_weight_collection()
+    await db.body_weight.create_index([("user_id", 1), ("ts", 1)])
+
+# ========== PLAN RESOLVER ==========
+
+# Plans are immutable once created (regeneration issues new ids), so they can
+# be cached process-wide by id. Treat cached documents as read-only.
+plan_cache = LRUCache(maxsize=int(os.environ.get('PLAN_CACHE_SIZE', '4096')))
+
+async def fetch_plans_by_id(plan_ids: List[str]) -> dict:
+    """Look up plans by id: AI-generated plans first, default plans for the rest"""
+    found = {}
+    for plan in await ai_plan_repo.by_ids(plan_ids):
+        found[plan['id']] = plan
+    
+    # Fallback to the default catalog for ids without an AI plan (backwards compatibility)
+    missing = []
+    for plan_id in plan_ids:
+        if plan_id in found:
+            continue
+        if plan_id in default_catalog.by_id:
+            found[plan_id] = default_catalog.by_id[plan_id]
+        else:
+            missing.append(plan_id)
+    if missing:
+        for plan in await default_plan_repo.by_ids(missing):
+            found[plan['id']] = plan
+    return found
+
+class PlanResolver:
+    """Request-scoped plan loader.
+    
+    Ids requested in the same event loop tick are collected and resolved with at
+    most one query per plan collection; ids already in `plan_cache` never hit
+    the database.
+    """
+    
+    def __init__(self, cache: LRUCache):
+        self._cache = cache
+        self._pending = {}
+        self._dispatch_scheduled = False
+        self._tasks = set()
+    
+    async def load(self, plan_id: str) -> Optional[dict]:
+        return (await self.load_many([plan_id])).get(plan_id)
+    
+    async def load_many(self, plan_ids: List[str]) -> dict:
+        loop = asyncio.get_running_loop()
+        results = {}
+        waiting = {}
+        for plan_id in set(plan_ids):
+            plan = self._cache.get(plan_id)
+            if plan is not None:
+                results[plan_id] = plan
+                continue
+            future = self._pending.get(plan_id)
+            if future is None:
+                future = loop.create_future()
+                self._pending[plan_id] = future
+            waiting[plan_id] = future
+        
+        if waiting and not self._dispatch_scheduled:
+            self._dispatch_scheduled = True
+            # The task first runs on the next loop iteration, after every caller
+            # in this tick has added its ids. The loop only keeps weak references
+            # to tasks, so hold on to it until it finishes.
+            task = loop.create_task(self._dispatch())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        
+        for plan_id, future in waiting.items():
+            plan = await future
+            if plan is not None:
+                results[plan_id] = plan
+        return results
+    
+    async def rewards(self, plan_ids: List[str]) -> dict:
+        """plan id -> xp_reward, for completions.
+        
+        Uncached plans are looked up by reward alone rather than loaded whole,
+        and are not added to the cache.
+        """
+        rewards = {}
+        missing = []
+        for plan_id in set(plan_ids):
+            plan = self._cache.get(plan_id) or default_catalog.by_id.get(plan_id)
+            if plan is not None:
+                rewards[plan_id] = plan['xp_reward']
+            else:
+                missing.append(plan_id)
+        
+        for repo in (ai_plan_repo, default_plan_repo):
+            if not missing:
+                break
+            for plan in await repo.rewards(missing):
+                rewards[plan['id']] = plan['xp_reward']
+            missing = [plan_id for plan_id in missing if plan_id not in rewards]
+        return rewards
+    
+    async def _dispatch(self):
+        batch, self._pending = self._pending, {}
+        self._dispatch_scheduled = False
+        try:
+            found = await fetch_plans_by_id(list(batch))
+        except BaseException as e:
+            # Every waiter fails with the query, so none of them hangs
+            for future in batch.values():
+                if future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        
+        for plan_id, future in batch.items():
+            plan = found.get(plan_id)
+            if plan is not None:
+                self._cache[plan_id] = plan
+            if not future.done():
+                future.set_result(plan)
+
+def get_plan_resolver() -> PlanResolver:
+    return PlanResolver(plan_cache)
+
+async def delete_ai_plans(user_id: str) -> int:
+    """Delete a user's AI-generated plans and drop them from the plan cache"""
+    for plan_id in await ai_plan_repo.ids_for_user(user_id):
+        plan_cache.pop(plan_id, None)
+    return await ai_plan_repo.delete_for_user(user_id)
+
+# ========== JOURNEY VIEW ==========
+
+# The journey is materialized per user in `journeys` when the schedule is
+# generated and patched when an entry is completed. Only is_next/is_locked
+# depend on the current date, so they are derived at read time.
+JOURNEY_REST_DAY = {**REST_DAY_DETAILS, "exercises": [], "target_muscles": "Recovery"}
+
+def build_journey_doc(user_id: str, scheduled: list, plans_dict: dict) -> dict:
+    nodes = []
+    used_plan_ids = set()
+    for idx, item in enumerate(sorted(scheduled, key=lambda s: s['scheduled_date'])):
+        nodes.append({
+            "schedule_id": item['id'],
+            "workout_plan_id": item['workout_plan_id'],
+            "scheduled_date": item['scheduled_date'],
+            "is_rest_day": item['is_rest_day'],
+            "is_completed": item['is_completed'],
+            "position": idx
+        })
+        if not item['is_rest_day']:
+            used_plan_ids.add(item['workout_plan_id'])
+    
+    plans = {}
+    for plan_id in used_plan_ids:
+        plan = plans_dict.get(plan_id)
+        if plan:
+            plans[plan_id] = {k: plan[k] for k in PLAN_PROJECTION if k != "_id" and k in plan}
+    
+    return {
+        "user_id": user_id,
+        "nodes": nodes,
+        "plans": plans,
+        "updated_at": datetime.now(timezone.utc)
+    }
+
+async def save_journey(user_id: str, scheduled: list, plans_dict: dict) -> dict:
+    journey_doc = build_journey_doc(user_id, scheduled, plans_dict)
+    await journey_repo.replace(user_id, journey_doc)
+    return journey_doc
+
+async def load_journey(user_id: str, resolver: PlanResolver, with_plans: bool = True) -> Optional[dict]:
+    """Return the user's materialized journey, or None if they have no schedule.
+    
+    Schedules created before the journey was materialized are built on first read.
+    """
+    journey_doc = await journey_repo.get(user_id, with_plans)
+    if journey_doc is not None:
+        return journey_doc
+    
+    scheduled, plans_dict = await fetch_enriched_schedule(user_id, resolver)
+    if not scheduled:
+        return None
+    return await save_journey(user_id, scheduled, plans_dict)
+
+def render_journey(journey_doc: dict, normalized: bool) -> list:
+    today = datetime.now(timezone.utc).date().isoformat()
+    plans_dict = journey_doc.get('plans', {})
+    journey = []
+    
+    for item in journey_doc['nodes']:
+        is_next = item['scheduled_date'] == today and not item['is_completed']
+        is_locked = item['scheduled_date'] > today
+        
+        if item['is_rest_day']:
+            # Rest day node
+            node = {
+                "id": item['schedule_id'],
+                "is_completed": item['is_completed'],
+                "is_next": is_next,
+                "is_rest_day": True,
+                "scheduled_date": item['scheduled_date'],
+                "is_locked": is_locked,
+                "position": item['position']
+            }
+            if normalized:
+                node["workout_plan_id"] = item['workout_plan_id']
+            else:
+                node.update(JOURNEY_REST_DAY)
+            journey.append(node)
+        else:
+            # Workout day node
+            node = {
+                "id": item['workout_plan_id'],
+                "schedule_id": item['schedule_id'],
+                "is_completed": item['is_completed'],
+                "is_next": is_next,
+                "is_rest_day": False,
+                "scheduled_date": item['scheduled_date'],
+                "is_locked": is_locked,
+                "position": item['position']
+            }
+            if normalized:
+                node["workout_plan_id"] = item['workout_plan_id']
+                journey.append(node)
+            else:
+                plan = plans_dict.get(item['workout_plan_id'], {})
+                journey.append({**plan, **node})
+    
+    return journey
+
+async def fallback_journey(user_id: str, normalized: bool):
+    """Journey for users without a schedule: their plans in order, unlocked by completion.
+    
+    Returns (plans keyed by id, journey nodes).
+    """
+    # First try to get user's AI-generated plans
+    plans = await ai_plan_repo.for_user(user_id)
+    
+    # Fallback to default workout plans if no AI plans exist
+    if not plans:
+        await default_catalog.ensure_fresh()
+        plans = list(default_catalog.plans)
+    completed_sessions = await session_store.list([user_id])
+    
+    completed_plan_ids = [session['workout_plan_id'] for session in completed_sessions]
+    
+    journey = []
+    for idx, plan in enumerate(plans):
+        is_completed = plan['id'] in completed_plan_ids
+        is_next = not is_completed and (idx == 0 or plans[idx-1]['id'] in completed_plan_ids)
+        
+        node = {
+            "is_completed": is_completed,
+            "is_next": is_next,
+            "is_rest_day": False,
+            "scheduled_date": None,
+            "position": idx
+        }
+        if normalized:
+            journey.append({"id": plan['id'], "workout_plan_id": plan['id'], **node})
+        else:
+            journey.append({**plan, **node})
+    
+    return {p['id']: p for p in plans}, journey
+
+def render_calendar(scheduled: list, plans_dict: dict, normalized: bool, rest_details: dict = REST_DAY_DETAILS) -> list:
+    if normalized:
+        # Entries already reference their plan through workout_plan_id
+        return scheduled
+    
+    # Enrich scheduled workouts with plan details
+    for item in scheduled:
+        if not item['is_rest_day']:
+            item['workout_details'] = plans_dict.get(item['workout_plan_id'])
+        else:
+            item['workout_details'] = rest_details
+    return scheduled
+
 # ========== AUTH ROUTES ==========
 
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(user_data: UserCreate):
-    existing_user = await db.users.find_one({"email": user_data.email})
-    if existing_user:
+    if await user_repo.email_exists(user_data.email):
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    user_dict = user_data.model_dump(exclude={"password"})
-    user_obj = User(**user_dict)
-    user_doc = user_obj.model_dump()
-    user_doc['password_hash'] = hash_password(user_data.password)
-    user_doc['created_at'] = user_doc['created_at'].isoformat()
+    user_dict = user_data.model_dump(exclude={"password"})
+    user_obj = User(**user_dict)
+    user_doc = user_obj.model_dump()
+    user_doc['password_hash'] = hash_password(user_data.password)
+    
+    await user_repo.insert(user_doc)
+    
+    # Initialize progress
+    progress = Progress(user_id=user_obj.id)
+    progress_doc = progress.model_dump()
+    await progress_repo.insert(progress_doc)
+    if user_obj.weight:
+        await record_weights(user_obj.id, [{"ts": datetime.now(timezone.utc), "weight": user_obj.weight}])
+    
+    access_token = create_access_token(data={"sub": user_obj.id})
+    
+    return TokenResponse(
+        access_token=access_token,
+        token_type="bearer",
+        user=user_obj
+    )
+
+@api_router.post("/auth/login", response_model=TokenResponse)
+async def login(credentials: UserLogin):
+    user_doc = await user_repo.get_by_email(credentials.email)
+    if not user_doc:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    
+    if not verify_password(credentials.password, user_doc['password_hash']):
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    
+    user_doc.pop('password_hash', None)
+    
+    user_obj = User(**user_doc)
+    access_token = create_access_token(data={"sub": user_obj.id})
+    
+    return TokenResponse(
+        access_token=access_token,
+        token_type="bearer",
+        user=user_obj
+    )
+
+@api_router.get("/auth/me", response_model=User)
+async def get_me(request: Request, current_user: User = Depends(get_current_user)):
+    return model_response(request, USER_ADAPTER, current_user)
+
+# ========== USER ROUTES ==========
+
+@api_router.get("/user/profile", response_model=User)
+async def get_profile(request: Request, current_user: User = Depends(get_current_user)):
+    return model_response(request, USER_ADAPTER, current_user)
+
+@api_router.put("/user/profile", response_model=User)
+async def update_profile(user_update: UserUpdate, current_user: User = Depends(get_current_user)):
+    update_data = user_update.model_dump(exclude_unset=True)
+    if update_data:
+        await user_repo.update(current_user.id, update_data)
+        changes = [{"kind": "profile", "op": "patch", "data": update_data}]
+        if update_data.get('weight'):
+            # Profile weight changes are also logged as body weight entries
+            entry = {"ts": datetime.now(timezone.utc), "weight": update_data['weight']}
+            await record_weights(current_user.id, [entry])
+            changes.append(weight_change(entry))
+        await bump_data_version(current_user.id, changes)
+    
+    updated_user_doc = await user_repo.get(current_user.id)
+    return User(**updated_user_doc)
+
+@api_router.delete("/user/account")
+async def delete_account(current_user: User = Depends(get_current_user)):
+    """Delete user account and all associated data"""
+    # Delete all user data
+    await user_repo.delete(current_user.id)
+    # Otherwise the cached version keeps answering 304s for the deleted user
+    data_version_cache.pop(current_user.id, None)
+    await session_store.delete_users([current_user.id])
+    await progress_repo.delete(current_user.id)
+    await schedule_repo.delete_for_user(current_user.id)
+    await journey_repo.delete(current_user.id)
+    await change_log_repo.delete_for_user(current_user.id)
+    await event_repo.delete_for_user(current_user.id)
+    await snapshot_repo.delete_for_users([current_user.id])
+    await rollup_repo.delete_for_users([current_user.id])
+    await body_weight_repo.delete_for_user(current_user.id)
+    for window in LEADERBOARD_WINDOWS:
+        await leaderboard.set(window, current_user.id, 0)
+    
+    return {"success": True, "message": "Account deleted successfully"}
+
+# ========== ACHIEVEMENTS ==========
+
+# Every achievement is a threshold over one progress counter:
+#   total_workouts, total_minutes, total_xp, streak
+# Add new ones here, then run `python backend/manage.py achievements` to award
+# them to users who already qualify.
+ACHIEVEMENTS = (
+    {"id": "first_5", "name": "First Steps", "description": "Complete 5 workouts", "icon": "award", "counter": "total_workouts", "threshold": 5},
+    {"id": "first_10", "name": "Getting Strong", "description": "Complete 10 workouts", "icon": "trophy", "counter": "total_workouts", "threshold": 10},
+    {"id": "warrior_50", "name": "Warrior", "description": "Complete 50 workouts", "icon": "crown", "counter": "total_workouts", "threshold": 50},
+    {"id": "streak_7", "name": "Week Warrior", "description": "7-day streak", "icon": "flame", "counter": "streak", "threshold": 7},
+    {"id": "streak_30", "name": "Unstoppable", "description": "30-day streak", "icon": "zap", "counter": "streak", "threshold": 30},
+)
+
+# counter -> its rules in ascending threshold order
+ACHIEVEMENTS_BY_COUNTER = {}
+for _rule in sorted(ACHIEVEMENTS, key=lambda rule: rule['threshold']):
+    ACHIEVEMENTS_BY_COUNTER.setdefault(_rule['counter'], []).append(_rule)
+
+def unlock_achievements(achievements: List[str], counters: dict) -> List[str]:
+    """Return `achievements` plus any earned by the updated `counters`.
+    
+    Only rules over the given counters are checked, up to the first unmet threshold.
+    """
+    unlocked = list(achievements)
+    for counter, value in counters.items():
+        for rule in ACHIEVEMENTS_BY_COUNTER.get(counter, ()):
+            if value < rule['threshold']:
+                break
+            if rule['id'] not in unlocked:
+                unlocked.append(rule['id'])
+    return unlocked
+
+async def session_totals(user_ids: Optional[List[str]] = None) -> dict:
+    """user_id -> {"total_workouts", "total_minutes"} aggregated from workout sessions"""
+    return await session_store.totals(user_ids)
+
+async def backfill_counters() -> int:
+    """Set the counters on progress documents that predate them; returns the number updated"""
+    user_ids = await db.progress.distinct("user_id", {"total_workouts": {"$exists": False}})
+    if not user_ids:
+        return 0
+    totals = await session_totals(user_ids)
+    result = await db.progress.bulk_write([
+        UpdateOne({"user_id": user_id}, {"$set": totals.get(user_id, {"total_workouts": 0, "total_minutes": 0})})
+        for user_id in user_ids
+    ], ordered=False)
+    return result.modified_count
+
+async def reevaluate_achievements(rules=ACHIEVEMENTS) -> int:
+    """Award `rules` to every user who qualifies but lacks them; returns the number of users updated.
+    
+    One aggregation finds the missing achievements, one bulk_write awards them.
+    Affected users are forced into a full resync.
+    """
+    earned = [
+        {"$cond": [{"$gte": [{"$ifNull": [f"${rule['counter']}", 0]}, rule['threshold']]}, rule['id'], None]}
+        for rule in rules
+    ]
+    pipeline = [
+        {"$project": {
+            "_id": 0,
+            "user_id": 1,
+            "missing": {"$filter": {
+                "input": earned,
+                "cond": {"$and": [
+                    {"$ne": ["$$this", None]},
+                    {"$not": [{"$in": ["$$this", {"$ifNull": ["$achievements", []]}]}]},
+                ]},
+            }},
+        }},
+        {"$match": {"missing.0": {"$exists": True}}},
+    ]
+    rows = await db.progress.aggregate(pipeline).to_list(None)
+    if not rows:
+        return 0
+    
+    await db.progress.bulk_write([
+        UpdateOne({"user_id": row['user_id']}, {"$addToSet": {"achievements": {"$each": row['missing']}}})
+        for row in rows
+    ], ordered=False)
+    await force_resync([row['user_id'] for row in rows])
+    return len(rows)
+
+# ========== WORKOUT EVENTS ==========
+
+# Append-only per-user log of workout events, ordered by `seq`:
+#   completion      - {session_id, workout_plan_id, schedule_id, date, xp_earned, duration_minutes}
+#   undo            - {session_id, completion_seq}: the completion no longer counts
+#   schedule_change - {op, count}: schedule generated or reset (does not affect progress)
+# `progress` is a projection of the log: apply_event folds events into it.
+# A snapshot of the projection is saved every PROGRESS_SNAPSHOT_EVERY events,
+# so a rebuild only folds the events after the latest snapshot. Sessions
+# recorded before the log existed are back-filled with seq <= 0.
+PROGRESS_SNAPSHOT_EVERY = int(os.environ.get('PROGRESS_SNAPSHOT_EVERY', '50'))
+PROGRESS_STATE_FIELDS = {
+    "total_xp": 0,
+    "level": 1,
+    "streak": 0,
+    "last_workout_date": None,
+    "achievements": [],
+    "total_workouts": 0,
+    "total_minutes": 0,
+}
+
+def parse_workout_date(value) -> Optional[date]:
+    if value is None or type(value) is date:
+        return value
+    return as_datetime(value).date()
+
+def advance_streak(streak: int, last_workout_date: Optional[date], workout_date: date) -> int:
+    """Streak after a workout on `workout_date`, given the date of the previous one"""
+    if not last_workout_date:
+        return 1
+    days_diff = (workout_date - last_workout_date).days
+    if days_diff <= 0:
+        # Same day (or a late upload of an earlier workout), no change
+        return streak
+    if days_diff == 1:
+        # Consecutive day
+        return streak + 1
+    # Streak broken
+    return 1
+
+def new_progress_state() -> dict:
+    return {field: list(default) if isinstance(default, list) else default for field, default in PROGRESS_STATE_FIELDS.items()}
+
+def apply_event(state: dict, event: dict) -> dict:
+    """Fold one workout event into a progress state; returns a new state"""
+    if event['type'] != "completion":
+        return state
+    
+    data = event['data']
+    workout_date = parse_workout_date(data['date'])
+    last_workout_date = parse_workout_date(state['last_workout_date'])
+    total_xp = state['total_xp'] + data['xp_earned']
+    streak = advance_streak(state['streak'], last_workout_date, workout_date)
+    counters = {
+        "total_workouts": state['total_workouts'] + 1,
+        "total_minutes": state['total_minutes'] + data['duration_minutes'],
+    }
+    if last_workout_date and last_workout_date > workout_date:
+        workout_date = last_workout_date
+    
+    return {
+        "total_xp": total_xp,
+        "level": (total_xp // 500) + 1,
+        "streak": streak,
+        "last_workout_date": day_start(workout_date),
+        "achievements": unlock_achievements(state['achievements'], {**counters, "streak": streak, "total_xp": total_xp}),
+        **counters
+    }
+
+def completion_event(session_doc: dict) -> dict:
+    return {
+        "type": "completion",
+        "data": {
+            "session_id": session_doc['id'],
+            "workout_plan_id": session_doc['workout_plan_id'],
+            "schedule_id": session_doc.get('schedule_id'),
+            "date": session_doc['date'],
+            "xp_earned": session_doc['xp_earned'],
+            "duration_minutes": session_doc['duration_minutes'],
+        }
+    }
+
+async def bootstrap_workout_events(user_id: str, exclude_session_ids: List[str] = ()) -> int:
+    """Log completions for sessions that predate the event log, ahead of every logged event"""
+    logged = await event_repo.logged_session_ids(user_id)
+    sessions = await session_store.list([user_id], [*logged, *exclude_session_ids])
+    if not sessions:
+        return 0
+    
+    first_seq = await event_repo.first_seq(user_id)
+    start = min(first_seq if first_seq is not None else 1, 1) - len(sessions)
+    await event_repo.insert_many([
+        {"user_id": user_id, "seq": start + i, "ts": session['date'], **completion_event(session)}
+        for i, session in enumerate(sessions)
+    ])
+    return len(sessions)
+
+async def append_workout_events(user_id: str, events: List[dict], state: Optional[dict] = None) -> int:
+    """Append events to the user's log and return the last seq.
+    
+    `state` is the projection after these events; it is snapshotted when the
+    append crosses a PROGRESS_SNAPSHOT_EVERY boundary.
+    """
+    last_seq = await user_repo.reserve_event_seqs(user_id, len(events))
+    first_seq = last_seq - len(events) + 1
+    if first_seq == 1:
+        # First logged events for this user: log their earlier sessions first
+        await bootstrap_workout_events(user_id, [e['data']['session_id'] for e in events if e['type'] == "completion"])
     
-    await db.users.insert_one(user_doc)
+    timestamp = datetime.now(timezone.utc)
+    await event_repo.insert_many([
+        {"user_id": user_id, "seq": first_seq + i, "ts": timestamp, **event}
+        for i, event in enumerate(events)
+    ])
+    if state is not None and last_seq // PROGRESS_SNAPSHOT_EVERY > (first_seq - 1) // PROGRESS_SNAPSHOT_EVERY:
+        await snapshot_repo.save(user_id, last_seq, state)
+    return last_seq
+
+async def rebuild_progress(user_id: str, use_snapshots: bool = True):
+    """Fold the user's event log into a progress state; returns (state, last seq).
     
-    # Initialize progress
-    progress = Progress(user_id=user_obj.id)
-    progress_doc = progress.model_dump()
-    await db.progress.insert_one(progress_doc)
+    Starts from the latest snapshot, or an older one when a later undo reaches
+    back past it.
+    """
+    snapshot = None
+    if use_snapshots:
+        snapshot = await snapshot_repo.latest(user_id)
+    while True:
+        events = await event_repo.after(user_id, snapshot['seq'] if snapshot is not None else None)
+        if snapshot is None:
+            break
+        reverted = [
+            e['data']['completion_seq'] for e in events
+            if e['type'] == "undo" and e['data']['completion_seq'] <= snapshot['seq']
+        ]
+        if not reverted:
+            break
+        snapshot = await snapshot_repo.latest(user_id, before_seq=min(reverted))
     
-    access_token = create_access_token(data={"sub": user_obj.id})
+    state = {**new_progress_state(), **snapshot['state']} if snapshot else new_progress_state()
+    undone = {e['data']['session_id'] for e in events if e['type'] == "undo"}
+    for event in events:
+        if event['type'] == "completion" and event['data']['session_id'] in undone:
+            continue
+        state = apply_event(state, event)
     
-    return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        user=user_obj
-    )
+    last_seq = events[-1]['seq'] if events else (snapshot['seq'] if snapshot else 0)
+    return state, last_seq
 
-@api_router.post("/auth/login", response_model=TokenResponse)
-async def login(credentials: UserLogin):
-    user_doc = await db.users.find_one({"email": credentials.email})
-    if not user_doc:
-        raise HTTPException(status_code=401, detail="Invalid email or password")
+async def record_completions(user_id: str, session_docs: List[dict]):
+    """Log already inserted sessions and fold them into the user's progress.
     
-    if not verify_password(credentials.password, user_doc['password_hash']):
-        raise HTTPException(status_code=401, detail="Invalid email or password")
+    Returns (previous progress document, updated progress fields).
+    """
+    progress_doc = await progress_repo.state(user_id)
+    if not progress_doc:
+        progress_doc = new_progress_state()
     
-    user_doc.pop('password_hash', None)
-    user_doc.pop('_id', None)
+    state = {field: progress_doc.get(field, default) for field, default in new_progress_state().items()}
+    if 'total_workouts' not in progress_doc or 'total_minutes' not in progress_doc:
+        # Progress predating the counters: the session totals already include the new sessions
+        totals = (await session_totals([user_id])).get(user_id, {"total_workouts": 0, "total_minutes": 0})
+        state['total_workouts'] = totals['total_workouts'] - len(session_docs)
+        state['total_minutes'] = totals['total_minutes'] - sum(doc['duration_minutes'] for doc in session_docs)
     
-    if isinstance(user_doc.get('created_at'), str):
-        user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
+    events = [completion_event(doc) for doc in session_docs]
+    for event in events:
+        state = apply_event(state, event)
     
-    user_obj = User(**user_doc)
-    access_token = create_access_token(data={"sub": user_obj.id})
+    await progress_repo.set_state(user_id, state)
+    await append_workout_events(user_id, events, state)
+    await update_rollups(user_id, session_docs)
+    await update_leaderboards(user_id, state['total_xp'], week_xp(session_docs))
+    return progress_doc, state
+
+async def replay_progress(user_ids: List[str]) -> int:
+    """Rebuild progress for `user_ids` from their full event logs, e.g. after a rules change.
     
-    return TokenResponse(
-        access_token=access_token,
-        token_type="bearer",
-        user=user_obj
-    )
+    Snapshots are replaced by one at each user's latest event.
+    """
+    results = await asyncio.gather(*(rebuild_progress(user_id, use_snapshots=False) for user_id in user_ids))
+    results = [(expire_streak(state), seq) for state, seq in results]
+    await progress_repo.set_states({user_id: state for user_id, (state, _) in zip(user_ids, results)})
+    await snapshot_repo.delete_for_users(user_ids)
+    timestamp = datetime.now(timezone.utc)
+    await snapshot_repo.insert_many([
+        {"user_id": user_id, "seq": seq, "state": state, "ts": timestamp}
+        for user_id, (state, seq) in zip(user_ids, results)
+    ])
+    await force_resync(user_ids)
+    return len(user_ids)
 
-@api_router.get("/auth/me", response_model=User)
-async def get_me(current_user: User = Depends(get_current_user)):
-    return current_user
+# ========== STREAK MAINTENANCE ==========
 
-# ========== USER ROUTES ==========
+# Streaks only change when a workout is recorded, so a user who stops
+# training would keep showing their last streak. expire_streaks zeroes every
+# streak whose last workout was before yesterday (UTC); reconcile_streaks
+# recomputes streaks from session history to catch drift, e.g. from late
+# offline uploads. Both run nightly through `manage.py streaks`.
 
-@api_router.get("/user/profile", response_model=User)
-async def get_profile(current_user: User = Depends(get_current_user)):
-    return current_user
+def streak_cutoff(today: Optional[date] = None) -> date:
+    """Streaks with a last workout before this day have lapsed"""
+    today = today or datetime.now(timezone.utc).date()
+    return today - timedelta(days=1)
 
-@api_router.put("/user/profile", response_model=User)
-async def update_profile(user_update: UserUpdate, current_user: User = Depends(get_current_user)):
-    update_data = user_update.model_dump(exclude_unset=True)
-    if update_data:
-        await db.users.update_one(
-            {"id": current_user.id},
-            {"$set": update_data}
-        )
+def expire_streak(state: dict, today: Optional[date] = None) -> dict:
+    """Progress state with the streak zeroed if it has lapsed"""
+    last_workout_date = parse_workout_date(state.get('last_workout_date'))
+    if state.get('streak') and last_workout_date and last_workout_date < streak_cutoff(today):
+        return {**state, "streak": 0}
+    return state
+
+async def expire_streaks(user_ids: Optional[List[str]] = None, today: Optional[date] = None) -> int:
+    """Zero lapsed streaks with one update_many; returns the number of users expired"""
+    query = {"streak": {"$gt": 0}, **date_range("last_workout_date", end=streak_cutoff(today))}
+    if user_ids is not None:
+        query["user_id"] = {"$in": user_ids}
+    expired = [doc['user_id'] for doc in await db.progress.find(query, {"_id": 0, "user_id": 1}).to_list(None)]
+    if not expired:
+        return 0
+    await db.progress.update_many(query, {"$set": {"streak": 0}})
+    await force_resync(expired)
+    return len(expired)
+
+def compute_streaks(user_codes: np.ndarray, days: np.ndarray, today: int):
+    """Current streak per user from (user code, day number) session pairs, in any order.
     
-    updated_user_doc = await db.users.find_one({"id": current_user.id}, {"_id": 0, "password_hash": 0})
-    if isinstance(updated_user_doc.get('created_at'), str):
-        updated_user_doc['created_at'] = datetime.fromisoformat(updated_user_doc['created_at'])
+    Returns (user codes, streaks) for every user with a session. A streak is the
+    run of consecutive days ending at the user's last workout day, or 0 if that
+    day is before yesterday.
+    """
+    order = np.lexsort((days, user_codes))
+    users, days = user_codes[order], days[order]
     
-    return User(**updated_user_doc)
+    # One entry per user and day
+    distinct = np.ones(len(users), dtype=bool)
+    distinct[1:] = (users[1:] != users[:-1]) | (days[1:] != days[:-1])
+    users, days = users[distinct], days[distinct]
+    
+    first_of_user = np.ones(len(users), dtype=bool)
+    first_of_user[1:] = users[1:] != users[:-1]
+    run_start = first_of_user.copy()
+    run_start[1:] |= (days[1:] - days[:-1]) != 1
+    last_of_user = np.ones(len(users), dtype=bool)
+    last_of_user[:-1] = first_of_user[1:]
+    
+    positions = np.arange(len(users))
+    current_run_start = np.maximum.accumulate(np.where(run_start, positions, 0))
+    run_lengths = (positions - current_run_start + 1)[last_of_user]
+    active = days[last_of_user] >= today - 1
+    return users[last_of_user], np.where(active, run_lengths, 0)
 
-@api_router.delete("/user/account")
-async def delete_account(current_user: User = Depends(get_current_user)):
-    """Delete user account and all associated data"""
-    # Delete all user data
-    await db.users.delete_one({"id": current_user.id})
-    await db.workout_sessions.delete_many({"user_id": current_user.id})
-    await db.progress.delete_many({"user_id": current_user.id})
-    await db.scheduled_workouts.delete_many({"user_id": current_user.id})
+async def reconcile_streaks(user_ids: List[str], today: Optional[date] = None, fix: bool = False) -> List[dict]:
+    """Compare stored streaks of `user_ids` with their session history.
     
-    return {"success": True, "message": "Account deleted successfully"}
+    Returns the mismatches as {user_id, stored, expected}; with fix=True the
+    expected streaks are written back.
+    """
+    today = today or datetime.now(timezone.utc).date()
+    sessions = await session_store.list(user_ids)
+    progress_docs = await db.progress.find(
+        {"user_id": {"$in": user_ids}},
+        {"_id": 0, "user_id": 1, "streak": 1}
+    ).to_list(None)
+    
+    codes = {user_id: i for i, user_id in enumerate(user_ids)}
+    user_codes = np.fromiter((codes[s['user_id']] for s in sessions), dtype=np.int64, count=len(sessions))
+    days = np.array([s['date'].date() for s in sessions], dtype="datetime64[D]").astype(np.int64)
+    today_day = np.datetime64(today.isoformat(), "D").astype(np.int64)
+    
+    expected = np.zeros(len(user_ids), dtype=np.int64)
+    users, streaks = compute_streaks(user_codes, days, today_day)
+    expected[users] = streaks
+    
+    mismatches = [
+        {"user_id": doc['user_id'], "stored": doc.get('streak', 0), "expected": int(expected[codes[doc['user_id']]])}
+        for doc in progress_docs
+        if doc.get('streak', 0) != expected[codes[doc['user_id']]]
+    ]
+    if fix and mismatches:
+        await db.progress.bulk_write([
+            UpdateOne({"user_id": m['user_id']}, {"$set": {"streak": m['expected']}})
+            for m in mismatches
+        ], ordered=False)
+        await force_resync([m['user_id'] for m in mismatches])
+    return mismatches
+
+# ========== BODY WEIGHT ==========
+
+# Body weight entries live in `body_weight` ({user_id, ts, weight}), a
+# MongoDB time-series collection (metaField user_id) where the server
+# supports one, so progress documents stay constant-size. Progress documents
+# from before may still embed body_weight_history; it is projected out of
+# progress reads and moved here by `manage.py weights`.
+PROGRESS_PROJECTION = {"_id": 0, "body_weight_history": 0}
+WEIGHT_BUCKETS = {
+    "day": "%Y-%m-%d",
+    "week": "%G-%V",
+    "month": "%Y-%m",
+}
+WEIGHT_HISTORY_MAX_POINTS = 1000
+
+async def create_body_weight_collection():
+    try:
+        await db.create_collection(
+            "body_weight",
+            timeseries={"timeField": "ts", "metaField": "user_id", "granularity": "hours"}
+        )
+    except CollectionInvalid:
+        pass  # Already exists
+    except OperationFailure as e:
+        # Time-series collections need MongoDB 5.0; a regular collection works the same
+        logger.warning(f"Storing body weight in a regular collection: {e}")
+
+async def record_weights(user_id: str, entries: List[dict]):
+    """Insert {ts, weight} entries for the user"""
+    if entries:
+        await body_weight_repo.insert_many([
+            {"user_id": user_id, "ts": entry['ts'], "weight": entry['weight']}
+            for entry in entries
+        ])
+
+def weight_change(entry: dict) -> dict:
+    """Change record for a new {ts, weight} entry, identified by its ts so weigh-ins don't collapse"""
+    return {"kind": "weight", "op": "insert", "id": entry['ts'].isoformat(), "data": entry}
+
+async def migrate_embedded_weights(batch_size: int = 500) -> tuple:
+    """Move body_weight_history out of progress documents; returns (users, entries moved)"""
+    users = moved = 0
+    while True:
+        progress_docs = await db.progress.find(
+            {"body_weight_history": {"$exists": True}},
+            {"_id": 0, "user_id": 1, "body_weight_history": 1}
+        ).to_list(batch_size)
+        if not progress_docs:
+            return users, moved
+        for doc in progress_docs:
+            entries = []
+            for entry in doc['body_weight_history'] or []:
+                ts = as_datetime(entry.get('ts') or entry.get('date'))
+                if ts is None or not entry.get('weight'):
+                    continue
+                entries.append({"ts": ts, "weight": entry['weight']})
+            await record_weights(doc['user_id'], entries)
+            moved += len(entries)
+        user_ids = [doc['user_id'] for doc in progress_docs]
+        await db.progress.update_many({"user_id": {"$in": user_ids}}, {"$unset": {"body_weight_history": ""}})
+        users += len(user_ids)
+
+def bucket_label_start(label: str, bucket: str) -> date:
+    if bucket == "week":
+        year, week = label.split("-")
+        return date.fromisocalendar(int(year), int(week), 1)
+    if bucket == "month":
+        return date.fromisoformat(f"{label}-01")
+    return date.fromisoformat(label)
 
 # ========== WORKOUT ROUTES ==========
 
 @api_router.get("/workouts/plans", response_model=List[WorkoutPlan])
-async def get_workout_plans(current_user: User = Depends(get_current_user)):
+async def get_workout_plans(
+    request: Request,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    selected = parse_fields(fields, PLAN_FIELDS)
+    projection = {"_id": 0}
+    if selected is not None:
+        projection.update({field: 1 for field in selected})
+    
     # First try to get user's AI-generated plans
-    ai_plans = await db.ai_workout_plans.find(
-        {"user_id": current_user.id}, 
-        {"_id": 0}
-    ).to_list(100)
+    ai_plans = await ai_plan_repo.for_user(current_user.id, projection)
     
-    # Fallback to default workout plans if no AI plans exist
+    # Fallback to default workout plans if no AI plans exist (served pre-serialized with ETag)
     if not ai_plans:
-        plans = await db.workout_plans.find({}, {"_id": 0}).to_list(100)
-        return plans
+        await default_catalog.ensure_fresh()
+        if selected is not None:
+            return api_response(request, [trim(plan, selected) for plan in default_catalog.plans])
+        return default_catalog.response(request)
     
-    return ai_plans
+    if selected is not None:
+        return api_response(request, ai_plans)
+    return model_response(request, WORKOUT_PLANS_ADAPTER, WORKOUT_PLANS_ADAPTER.validate_python(ai_plans))
 
-@api_router.get("/workouts/journey")
-async def get_workout_journey(current_user: User = Depends(get_current_user)):
-    """Get user's workout journey based on their schedule"""
-    # Get user's scheduled workouts
-    scheduled = await db.scheduled_workouts.find(
-        {"user_id": current_user.id},
-        {"_id": 0}
-    ).sort("scheduled_date", 1).to_list(1000)
-    
-    if not scheduled:
-        # Fallback to old behavior if no schedule
-        # First try to get user's AI-generated plans
-        plans = await db.ai_workout_plans.find(
-            {"user_id": current_user.id}, 
-            {"_id": 0}
-        ).to_list(100)
-        
-        # Fallback to default workout plans if no AI plans exist
-        if not plans:
-            plans = await db.workout_plans.find({}, {"_id": 0}).to_list(100)
-        completed_sessions = await db.workout_sessions.find(
-            {"user_id": current_user.id},
-            {"_id": 0}
-        ).to_list(1000)
-        
-        completed_plan_ids = [session['workout_plan_id'] for session in completed_sessions]
-        
-        journey = []
-        for idx, plan in enumerate(plans):
-            is_completed = plan['id'] in completed_plan_ids
-            is_next = not is_completed and (idx == 0 or plans[idx-1]['id'] in completed_plan_ids)
-            
-            journey.append({
-                **plan,
-                "is_completed": is_completed,
-                "is_next": is_next,
-                "is_rest_day": False,
-                "scheduled_date": None,
-                "position": idx
-            })
-        
-        return journey
-    
-    # Get workout plan details from AI-generated plans
-    workout_ids = [s['workout_plan_id'] for s in scheduled if not s['is_rest_day']]
+@api_router.get("/workouts/journey", dependencies=[Depends(check_not_modified)])
+async def get_workout_journey(
+    request: Request,
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    resolver: PlanResolver = Depends(get_plan_resolver)
+):
+    """Get user's workout journey based on their schedule.
     
-    # First try to get from AI-generated plans
-    ai_workout_plans = await db.ai_workout_plans.find(
-        {"id": {"$in": workout_ids}},
-        {"_id": 0}
-    ).to_list(1000)
+    `fields` selects node and plan fields, e.g. fields=name,difficulty,is_completed,scheduled_date
+    for the map view; plans are not loaded when no plan field is requested.
+    """
+    normalized = wants_normalized(request, view)
+    selected = parse_fields(fields, PLAN_FIELDS | JOURNEY_NODE_FIELDS)
+    with_plans = selected is None or bool(selected & (PLAN_FIELDS - {"id"}))
+    # Normalized entries must keep their reference into the plans map
+    node_fields = selected | {"workout_plan_id"} if selected is not None and normalized else selected
     
-    # Fallback to regular workout_plans if needed (for backwards compatibility)
-    if not ai_workout_plans:
-        ai_workout_plans = await db.workout_plans.find(
-            {"id": {"$in": workout_ids}},
-            {"_id": 0}
-        ).to_list(1000)
-    
-    plans_dict = {p['id']: p for p in ai_workout_plans}
-    
-    # Build journey from schedule
-    today = datetime.now(timezone.utc).date().isoformat()
-    journey = []
+    # Materialized journey: one indexed read
+    journey_doc = await load_journey(current_user.id, resolver, with_plans)
     
-    for idx, item in enumerate(scheduled):
-        if item['is_rest_day']:
-            # Rest day node
-            journey.append({
-                "id": item['id'],
-                "name": "Rest Day",
-                "difficulty": "Recovery",
-                "exercises": [],
-                "target_muscles": "Recovery",
-                "xp_reward": 0,
-                "duration_minutes": 0,
-                "is_completed": item['is_completed'],
-                "is_next": item['scheduled_date'] == today and not item['is_completed'],
-                "is_rest_day": True,
-                "scheduled_date": item['scheduled_date'],
-                "is_locked": item['scheduled_date'] > today,
-                "position": idx
-            })
-        else:
-            # Workout day node
-            plan = plans_dict.get(item['workout_plan_id'], {})
-            is_next = item['scheduled_date'] == today and not item['is_completed']
-            is_locked = item['scheduled_date'] > today
-            
-            journey.append({
-                **plan,
-                "id": item['workout_plan_id'],
-                "schedule_id": item['id'],
-                "is_completed": item['is_completed'],
-                "is_next": is_next,
-                "is_rest_day": False,
-                "scheduled_date": item['scheduled_date'],
-                "is_locked": is_locked,
-                "position": idx
-            })
+    if journey_doc is None:
+        # Fallback to old behavior if no schedule
+        plans_dict, journey = await fallback_journey(current_user.id, normalized)
+        journey = [trim(node, node_fields) for node in journey]
+        if normalized:
+            return normalized_response(request, trim_plans(plans_dict, selected), journey)
+        return api_response(request, journey)
     
-    return journey
+    journey = [trim(node, node_fields) for node in render_journey(journey_doc, normalized)]
+    if normalized:
+        plans_dict = {**journey_doc.get('plans', {}), "rest": JOURNEY_REST_DAY}
+        return normalized_response(request, trim_plans(plans_dict, selected), journey)
+    return api_response(request, journey)
 
 @api_router.post("/workouts/complete")
-async def complete_workout(workout_data: WorkoutComplete, current_user: User = Depends(get_current_user)):
-    # Get workout plan from AI-generated plans first
-    plan = await db.ai_workout_plans.find_one({"id": workout_data.workout_plan_id})
+async def complete_workout(
+    workout_data: WorkoutComplete,
+    current_user: User = Depends(get_current_user),
+    resolver: PlanResolver = Depends(get_plan_resolver)
+):
+    # AI-generated plans first, default plans as fallback
+    xp_reward = (await resolver.rewards([workout_data.workout_plan_id])).get(workout_data.workout_plan_id)
     
-    # Fallback to regular workout_plans if needed (for backwards compatibility)
-    if not plan:
-        plan = await db.workout_plans.find_one({"id": workout_data.workout_plan_id})
-    
-    if not plan:
+    if xp_reward is None:
         raise HTTPException(status_code=404, detail="Workout plan not found")
     
     # Create workout session
     session = WorkoutSession(
         user_id=current_user.id,
         workout_plan_id=workout_data.workout_plan_id,
-        xp_earned=plan['xp_reward'],
+        xp_earned=xp_reward,
         duration_minutes=workout_data.duration_minutes,
         status="completed"
     )
     session_doc = session.model_dump()
-    session_doc['date'] = session_doc['date'].isoformat()
-    await db.workout_sessions.insert_one(session_doc)
-    
-    # Update progress
-    progress_doc = await db.progress.find_one({"user_id": current_user.id})
-    if not progress_doc:
-        progress_doc = Progress(user_id=current_user.id).model_dump()
-    
-    # Update XP and level
-    new_total_xp = progress_doc.get('total_xp', 0) + plan['xp_reward']
-    new_level = (new_total_xp // 500) + 1
-    
-    # Update streak
-    today = datetime.now(timezone.utc).date()
-    last_workout_date = progress_doc.get('last_workout_date')
-    
-    if isinstance(last_workout_date, str):
-        last_workout_date = datetime.fromisoformat(last_workout_date).date()
-    elif isinstance(last_workout_date, datetime):
-        last_workout_date = last_workout_date.date()
-    
-    current_streak = progress_doc.get('streak', 0)
-    
-    if last_workout_date:
-        days_diff = (today - last_workout_date).days
-        if days_diff == 0:
-            # Same day, no change
-            new_streak = current_streak
-        elif days_diff == 1:
-            # Consecutive day
-            new_streak = current_streak + 1
-        else:
-            # Streak broken
-            new_streak = 1
-    else:
-        new_streak = 1
-    
-    # Check achievements
-    achievements = progress_doc.get('achievements', [])
-    total_workouts = await db.workout_sessions.count_documents({"user_id": current_user.id})
-    
-    if total_workouts >= 5 and "first_5" not in achievements:
-        achievements.append("first_5")
-    if total_workouts >= 10 and "first_10" not in achievements:
-        achievements.append("first_10")
-    if total_workouts >= 50 and "warrior_50" not in achievements:
-        achievements.append("warrior_50")
-    if new_streak >= 7 and "streak_7" not in achievements:
-        achievements.append("streak_7")
-    if new_streak >= 30 and "streak_30" not in achievements:
-        achievements.append("streak_30")
-    
-    # Update progress document
-    update_data = {
-        "total_xp": new_total_xp,
-        "level": new_level,
-        "streak": new_streak,
-        "last_workout_date": today.isoformat(),
-        "achievements": achievements
-    }
+    await session_store.insert([session_doc])
     
-    await db.progress.update_one(
-        {"user_id": current_user.id},
-        {"$set": update_data},
-        upsert=True
-    )
+    # Update progress: XP, level, streak and achievements
+    progress_doc, update_data = await record_completions(current_user.id, [session_doc])
+    await bump_data_version(current_user.id, [
+        {"kind": "session", "op": "insert", "id": session.id, "data": {k: v for k, v in session_doc.items() if k != '_id'}},
+        {"kind": "progress", "op": "patch", "data": update_data},
+    ])
     
     # Get new achievements (just unlocked)
     old_achievements = progress_doc.get('achievements', [])
-    new_achievements = [a for a in achievements if a not in old_achievements]
+    new_achievements = [a for a in update_data['achievements'] if a not in old_achievements]
+    if new_achievements:
+        await publish_event(current_user.id, "achievements", {"unlocked": new_achievements})
     
     return {
         "success": True,
-        "xp_earned": plan['xp_reward'],
-        "new_total_xp": new_total_xp,
-        "new_level": new_level,
-        "new_streak": new_streak,
+        "xp_earned": xp_reward,
+        "new_total_xp": update_data['total_xp'],
+        "new_level": update_data['level'],
+        "new_streak": update_data['streak'],
+        "new_achievements": new_achievements
+    }
+
+BULK_COMPLETE_MAX = int(os.environ.get('BULK_COMPLETE_MAX', '200'))
+
+@api_router.post("/workouts/complete/bulk")
+async def complete_workouts_bulk(
+    bulk: BulkCompleteRequest,
+    current_user: User = Depends(get_current_user),
+    resolver: PlanResolver = Depends(get_plan_resolver)
+):
+    """Record workouts completed offline.
+    
+    Completions are idempotent by client_id: re-uploads are reported as duplicates
+    and not counted again. A scheduled workout is completed at most once: other
+    entries for one that is already completed, or claimed earlier in the same
+    upload, are rejected. Streak and XP are recomputed once, in completion order.
+    """
+    if len(bulk.completions) > BULK_COMPLETE_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_COMPLETE_MAX} completions per upload")
+    
+    completions = sorted(bulk.completions, key=lambda c: c.completed_at.timestamp())
+    rewards = await resolver.rewards([c.workout_plan_id for c in completions])
+    schedule_ids = list({c.schedule_id for c in completions if c.schedule_id})
+    completion_states = {}
+    if schedule_ids:
+        completion_states = await schedule_repo.completion_states(current_user.id, schedule_ids)
+    claimed = set()
+    # Known client_ids first, so a retried upload reports duplicates rather than
+    # rejecting the scheduled workouts it already completed
+    uploaded = await session_store.uploaded(current_user.id, [c.client_id for c in completions])
+    
+    rejected = []
+    duplicates = []
+    sessions = []
+    for completion in completions:
+        if completion.client_id in uploaded:
+            duplicates.append(completion.client_id)
+            continue
+        xp_reward = rewards.get(completion.workout_plan_id)
+        if xp_reward is None:
+            rejected.append({"client_id": completion.client_id, "detail": "Workout plan not found"})
+            continue
+        if completion.schedule_id:
+            if completion.schedule_id not in completion_states:
+                rejected.append({"client_id": completion.client_id, "detail": "Scheduled workout not found"})
+                continue
+            if completion_states[completion.schedule_id] or completion.schedule_id in claimed:
+                rejected.append({"client_id": completion.client_id, "detail": "Scheduled workout already completed"})
+                continue
+            claimed.add(completion.schedule_id)
+        
+        completed_at = completion.completed_at
+        if completed_at.tzinfo is None:
+            completed_at = completed_at.replace(tzinfo=timezone.utc)
+        session = WorkoutSession(
+            user_id=current_user.id,
+            workout_plan_id=completion.workout_plan_id,
+            date=completed_at.astimezone(timezone.utc),
+            xp_earned=xp_reward,
+            duration_minutes=completion.duration_minutes,
+            status="completed",
+            schedule_id=completion.schedule_id
+        )
+        session_doc = session.model_dump()
+        session_doc['client_id'] = completion.client_id
+        sessions.append((completion, session_doc))
+        uploaded.add(completion.client_id)
+    
+    # Uploads racing this one are still skipped by client_id on insert
+    duplicate_indexes = set()
+    if sessions:
+        duplicate_indexes = await session_store.insert([doc for _, doc in sessions])
+    
+    accepted = [item for i, item in enumerate(sessions) if i not in duplicate_indexes]
+    duplicates += [sessions[i][0].client_id for i in sorted(duplicate_indexes)]
+    
+    result = {
+        "success": True,
+        "accepted": [completion.client_id for completion, _ in accepted],
+        "duplicates": duplicates,
+        "rejected": rejected,
+    }
+    if not accepted:
+        progress = progress_from_doc(current_user.id, await progress_repo.get(current_user.id))
+        return {
+            **result,
+            "xp_earned": 0,
+            "new_total_xp": progress.total_xp,
+            "new_level": progress.level,
+            "new_streak": progress.streak,
+            "new_achievements": []
+        }
+    
+    completed_schedule_ids = [c.schedule_id for c, _ in accepted if c.schedule_id]
+    if completed_schedule_ids:
+        await schedule_repo.set_completed(current_user.id, completed_schedule_ids)
+        await journey_repo.set_completed(current_user.id, completed_schedule_ids)
+    
+    # Fold the batch into progress once, in completion order
+    progress_doc, update_data = await record_completions(current_user.id, [doc for _, doc in accepted])
+    await bump_data_version(current_user.id, [
+        *[{"kind": "schedule", "op": "patch", "id": schedule_id, "data": {"is_completed": True}} for schedule_id in completed_schedule_ids],
+        *[{"kind": "session", "op": "insert", "id": doc['id'], "data": {k: v for k, v in doc.items() if k != '_id'}} for _, doc in accepted],
+        {"kind": "progress", "op": "patch", "data": update_data},
+    ])
+    
+    new_achievements = [a for a in update_data['achievements'] if a not in progress_doc.get('achievements', [])]
+    if new_achievements:
+        await publish_event(current_user.id, "achievements", {"unlocked": new_achievements})
+    
+    return {
+        **result,
+        "xp_earned": sum(doc['xp_earned'] for _, doc in accepted),
+        "new_total_xp": update_data['total_xp'],
+        "new_level": update_data['level'],
+        "new_streak": update_data['streak'],
         "new_achievements": new_achievements
     }
 
+@api_router.post("/workouts/sessions/{session_id}/undo")
+async def undo_workout(session_id: str, current_user: User = Depends(get_current_user)):
+    """Undo a completed workout; progress is rebuilt from the event log without it"""
+    session_doc = await session_store.find(current_user.id, session_id)
+    if not session_doc:
+        raise HTTPException(status_code=404, detail="Workout session not found")
+    
+    completion_seq = await event_repo.completion_seq(current_user.id, session_id)
+    if completion_seq is None:
+        # Session from before the event log: log the user's history first
+        await bootstrap_workout_events(current_user.id)
+        completion_seq = await event_repo.completion_seq(current_user.id, session_id)
+    
+    await session_store.delete(current_user.id, session_doc)
+    changes = [{"kind": "session", "op": "delete", "id": session_id}]
+    schedule_id = session_doc.get('schedule_id')
+    if schedule_id:
+        await schedule_repo.set_completed(current_user.id, [schedule_id], completed=False)
+        await journey_repo.set_completed(current_user.id, [schedule_id], completed=False)
+        changes.append({"kind": "schedule", "op": "patch", "id": schedule_id, "data": {"is_completed": False}})
+    
+    await append_workout_events(current_user.id, [
+        {"type": "undo", "data": {"session_id": session_id, "completion_seq": completion_seq}}
+    ])
+    state, seq = await rebuild_progress(current_user.id)
+    state = expire_streak(state)
+    await progress_repo.set_state(current_user.id, state)
+    await snapshot_repo.save(current_user.id, seq, state)
+    await update_rollups(current_user.id, [session_doc], sign=-1)
+    await update_leaderboards(current_user.id, state['total_xp'], -week_xp([session_doc]))
+    changes.append({"kind": "progress", "op": "patch", "data": state})
+    await bump_data_version(current_user.id, changes)
+    
+    return {
+        "success": True,
+        "xp_removed": session_doc['xp_earned'],
+        "new_total_xp": state['total_xp'],
+        "new_level": state['level'],
+        "new_streak": state['streak'],
+        "achievements": state['achievements']
+    }
+
 # ========== PROGRESS ROUTES ==========
 
-@api_router.get("/progress", response_model=Progress)
-async def get_progress(current_user: User = Depends(get_current_user)):
-    progress_doc = await db.progress.find_one({"user_id": current_user.id}, {"_id": 0})
+def progress_from_doc(user_id: str, progress_doc: Optional[dict]) -> Progress:
     if not progress_doc:
-        progress = Progress(user_id=current_user.id)
-        return progress
+        return Progress(user_id=user_id)
     
-    # Convert date strings back to datetime if needed
-    if isinstance(progress_doc.get('current_streak_start'), str):
-        progress_doc['current_streak_start'] = datetime.fromisoformat(progress_doc['current_streak_start'])
-    if isinstance(progress_doc.get('last_workout_date'), str):
-        progress_doc['last_workout_date'] = datetime.fromisoformat(progress_doc['last_workout_date'])
+    progress_doc['current_streak_start'] = as_datetime(progress_doc.get('current_streak_start'))
+    progress_doc['last_workout_date'] = as_datetime(progress_doc.get('last_workout_date'))
     
     return Progress(**progress_doc)
 
-@api_router.get("/achievements")
-async def get_achievements(current_user: User = Depends(get_current_user)):
-    progress_doc = await db.progress.find_one({"user_id": current_user.id})
+@api_router.get("/progress", response_model=Progress, dependencies=[Depends(check_not_modified)])
+async def get_progress(request: Request, current_user: User = Depends(get_current_user)):
+    progress_doc = await progress_repo.get(current_user.id)
+    return model_response(request, PROGRESS_ADAPTER, progress_from_doc(current_user.id, progress_doc))
+
+@api_router.post("/progress/weight")
+async def add_weight(entry: WeightEntry, current_user: User = Depends(get_current_user)):
+    ts = as_datetime(entry.ts) or datetime.now(timezone.utc)
+    data = {"ts": ts.astimezone(timezone.utc), "weight": entry.weight}
+    await record_weights(current_user.id, [data])
+    await bump_data_version(current_user.id, [weight_change(data)])
+    return {"success": True, **data}
+
+@api_router.get("/progress/weight", dependencies=[Depends(check_not_modified)])
+async def get_weight_history(
+    request: Request,
+    from_: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    downsample: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Body weight entries between `from` and `to` (inclusive dates, UTC).
+    
+    With downsample=day|week|month, entries are averaged per bucket on the
+    server and returned as {start, weight, min, max, count}.
+    """
+    if downsample is not None and downsample not in WEIGHT_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"downsample must be one of: {', '.join(WEIGHT_BUCKETS)}")
+    if from_ and to and from_ > to:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    
+    ts_range = {}
+    if from_:
+        ts_range["$gte"] = datetime(from_.year, from_.month, from_.day, tzinfo=timezone.utc)
+    if to:
+        after = to + timedelta(days=1)
+        ts_range["$lt"] = datetime(after.year, after.month, after.day, tzinfo=timezone.utc)
+    
+    if downsample is None:
+        # The most recent WEIGHT_HISTORY_MAX_POINTS entries, oldest first
+        entries = await body_weight_repo.latest(current_user.id, ts_range, WEIGHT_HISTORY_MAX_POINTS)
+        entries.reverse()
+        return api_response(request, {"downsample": None, "entries": entries})
+    
+    rows = await body_weight_repo.buckets(current_user.id, ts_range, WEIGHT_BUCKETS[downsample])
+    entries = [
+        {
+            "start": bucket_label_start(row['_id'], downsample).isoformat(),
+            "weight": round(row['weight'], 2),
+            "min": row['min'],
+            "max": row['max'],
+            "count": row['count'],
+        }
+        for row in rows
+    ]
+    return api_response(request, {"downsample": downsample, "entries": entries})
+
+@api_router.get("/achievements", dependencies=[Depends(check_not_modified)])
+async def get_achievements(request: Request, current_user: User = Depends(get_current_user)):
+    progress_doc = await progress_repo.achievements(current_user.id)
     achievements = progress_doc.get('achievements', []) if progress_doc else []
     
-    total_workouts = await db.workout_sessions.count_documents({"user_id": current_user.id})
+    if progress_doc and 'total_workouts' in progress_doc:
+        total_workouts = progress_doc['total_workouts']
+    else:
+        totals = await session_totals([current_user.id])
+        total_workouts = totals.get(current_user.id, {}).get('total_workouts', 0)
     
     achievement_list = [
-        {"id": "first_5", "name": "First Steps", "description": "Complete 5 workouts", "unlocked": "first_5" in achievements, "icon": "award"},
-        {"id": "first_10", "name": "Getting Strong", "description": "Complete 10 workouts", "unlocked": "first_10" in achievements, "icon": "trophy"},
-        {"id": "warrior_50", "name": "Warrior", "description": "Complete 50 workouts", "unlocked": "warrior_50" in achievements, "icon": "crown"},
-        {"id": "streak_7", "name": "Week Warrior", "description": "7-day streak", "unlocked": "streak_7" in achievements, "icon": "flame"},
-        {"id": "streak_30", "name": "Unstoppable", "description": "30-day streak", "unlocked": "streak_30" in achievements, "icon": "zap"},
+        {
+            "id": rule['id'],
+            "name": rule['name'],
+            "description": rule['description'],
+            "unlocked": rule['id'] in achievements,
+            "icon": rule['icon']
+        }
+        for rule in ACHIEVEMENTS
     ]
     
-    return {
+    return api_response(request, {
         "achievements": achievement_list,
         "total_workouts": total_workouts
+    })
+
+# ========== LEADERBOARD ROUTES ==========
+
+@api_router.get("/leaderboard")
+async def get_leaderboard(
+    request: Request,
+    window: str = "all",
+    around: Optional[str] = None,
+    limit: int = LEADERBOARD_MAX_LIMIT,
+    current_user: User = Depends(get_current_user)
+):
+    """XP leaderboard for window=all|week: the top `limit`, or with around=me the page around the caller"""
+    if window not in LEADERBOARD_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"window must be one of: {', '.join(LEADERBOARD_WINDOWS)}")
+    if around not in (None, "me"):
+        raise HTTPException(status_code=400, detail="around only supports 'me'")
+    limit = max(1, min(limit, LEADERBOARD_MAX_LIMIT))
+    
+    me = await leaderboard.rank(window, current_user.id)
+    start = max(0, me[0] - limit // 2) if around == "me" and me else 0
+    rows = await leaderboard.range(window, start, limit)
+    
+    names = await user_repo.names([user_id for user_id, _ in rows])
+    
+    entries = [
+        {"rank": start + i + 1, "name": names.get(user_id, ""), "xp": xp, "is_me": user_id == current_user.id}
+        for i, (user_id, xp) in enumerate(rows)
+    ]
+    return api_response(request, {
+        "window": window,
+        "entries": entries,
+        "me": {"rank": me[0] + 1, "xp": me[1]} if me else None
+    })
+
+# ========== STATS ROUTES ==========
+
+@api_router.get("/stats/history", dependencies=[Depends(check_not_modified)])
+async def get_stats_history(
+    request: Request,
+    bucket: str = "week",
+    from_: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Workouts, minutes and XP per day, week or month between `from` and `to` (inclusive).
+    
+    Every bucket in the range is listed, including empty ones. Defaults to the
+    last STATS_HISTORY_DEFAULT_BUCKETS buckets.
+    """
+    if bucket not in STATS_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {', '.join(STATS_BUCKETS)}")
+    
+    to = bucket_start(to or datetime.now(timezone.utc).date(), bucket)
+    if from_ is None:
+        start = to
+        for _ in range(STATS_HISTORY_DEFAULT_BUCKETS - 1):
+            start = bucket_start(start - timedelta(days=1), bucket)
+    else:
+        start = bucket_start(from_, bucket)
+    if start > to:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    
+    starts = [start]
+    while starts[-1] < to:
+        if len(starts) >= STATS_HISTORY_MAX_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"At most {STATS_HISTORY_MAX_BUCKETS} buckets per request")
+        starts.append(next_bucket_start(starts[-1], bucket))
+    
+    rollups = await rollup_repo.window(
+        current_user.id,
+        "day" if bucket == "month" else bucket,
+        start.isoformat(),
+        next_bucket_start(to, bucket).isoformat()
+    )
+    
+    buckets = {s.isoformat(): {"start": s.isoformat(), "workouts": 0, "minutes": 0, "xp": 0} for s in starts}
+    for rollup in rollups:
+        totals = buckets[bucket_start(date.fromisoformat(rollup['start']), bucket).isoformat()]
+        for field in ("workouts", "minutes", "xp"):
+            totals[field] += rollup[field]
+    
+    history = list(buckets.values())
+    return api_response(request, {
+        "bucket": bucket,
+        "from": start.isoformat(),
+        "to": to.isoformat(),
+        "buckets": history,
+        "totals": {field: sum(b[field] for b in history) for field in ("workouts", "minutes", "xp")},
+    })
+
+# ========== HOME DASHBOARD ==========
+
+@api_router.get("/home", dependencies=[Depends(check_not_modified)])
+async def get_home(
+    request: Request,
+    view: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    resolver: PlanResolver = Depends(get_plan_resolver)
+):
+    """Journey, progress and calendar for the home screen, built from one schedule read"""
+    normalized = wants_normalized(request, view)
+    
+    (scheduled, plans_dict), progress_doc = await asyncio.gather(
+        fetch_enriched_schedule(current_user.id, resolver),
+        progress_repo.get(current_user.id),
+    )
+    
+    if scheduled:
+        journey_doc = build_journey_doc(current_user.id, scheduled, plans_dict)
+        journey = render_journey(journey_doc, normalized)
+    else:
+        journey_plans, journey = await fallback_journey(current_user.id, normalized)
+        plans_dict = {**plans_dict, **journey_plans}
+    
+    calendar = render_calendar(scheduled, plans_dict, normalized)
+    progress = progress_from_doc(current_user.id, progress_doc)
+    
+    if normalized:
+        return api_response(
+            request,
+            {
+                "plans": {**plans_dict, "rest": JOURNEY_REST_DAY},
+                "journey": journey,
+                "progress": progress.model_dump(mode="json"),
+                "calendar": calendar
+            },
+            NORMALIZED_MEDIA_TYPE
+        )
+    return api_response(request, {"journey": journey, "progress": progress.model_dump(mode="json"), "calendar": calendar})
+
+# ========== SYNC ROUTES ==========
+
+@api_router.get("/sync")
+async def sync_changes(request: Request, since: int = 0, current_user: User = Depends(get_current_user)):
+    """Collapsed changes to the user's data after version `since`"""
+    sync_state = await user_repo.sync_state(current_user.id)
+    version = sync_state.get('data_version', 0)
+    floor = sync_state.get('change_log_floor', 0)
+    
+    if since >= version:
+        return api_response(request, {"version": version, "full_resync": False, "changes": []})
+    if since <= 0 or since < floor:
+        # Nothing to diff against, or the log was compacted past `since`
+        return api_response(request, {"version": version, "full_resync": True, "changes": []})
+    
+    entries = await change_log_repo.since(current_user.id, since, version)
+    # bump_data_version logs a version's changes after bumping it: report only
+    # versions already in the log, so the next sync picks up the rest
+    version = max((entry['version'] for entry in entries), default=since)
+    changes = collapse_changes(entries)
+    
+    for change in changes:
+        if change['op'] != "replace":
+            continue
+        if change['kind'] == "schedule":
+            change['data'] = await schedule_repo.all(current_user.id)
+        elif change['kind'] == "plans":
+            change['data'] = await ai_plan_repo.for_user(current_user.id, limit=None)
+    
+    return api_response(request, {"version": version, "full_resync": False, "changes": changes})
+
+# ========== EVENT ROUTES ==========
+
+def get_event_user_id(request: Request, token: Optional[str] = None) -> str:
+    """EventSource cannot set headers, so the access token may also be passed as ?token="""
+    if token is None:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+    return decode_access_token(token)
+
+@api_router.get("/events")
+async def stream_events(request: Request, user_id: str = Depends(get_event_user_id)):
+    """Live per-user updates as Server-Sent Events"""
+    version = await get_data_version(user_id)
+    if version is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    queue = event_backend.subscribe(user_id)
+    
+    async def stream():
+        try:
+            yield f"retry: 3000\n{format_event('ready', {'version': version}, version)}"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event['event'], event['data'], event.get('id'))
+        finally:
+            event_backend.unsubscribe(user_id, queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ========== BATCH ROUTES ==========
+
+BATCH_MAX_OPERATIONS = int(os.environ.get('BATCH_MAX_OPERATIONS', '20'))
+BATCH_EXCLUDED_PATHS = ("/api/batch", "/api/events")
+
+async def dispatch_subrequest(request: Request, batch: dict, operation: BatchOperation):
+    """Run one batch operation through the API router in-process; return (status, body)"""
+    url = urlsplit(operation.path)
+    if not url.path.startswith("/api/") or url.path.startswith(BATCH_EXCLUDED_PATHS):
+        return 400, {"detail": f"Operation not allowed in a batch: {operation.method} {url.path}"}
+    
+    body = json.dumps(operation.body).encode() if operation.body is not None else b""
+    headers = [
+        (b"authorization", request.headers.get("authorization", "").encode()),
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"accept", b"application/json"),
+    ]
+    scope = {
+        **request.scope,
+        "method": operation.method,
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+        "state": {},
+        "batch": batch,
     }
+    
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    async def receive():
+        if messages:
+            return messages.pop()
+        return {"type": "http.disconnect"}
+    
+    response = {"status": 500, "body": b""}
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+    
+    try:
+        await request.app.router(scope, receive, send)
+    except StarletteHTTPException as e:
+        # Unmatched paths and methods are raised by the router itself
+        return e.status_code, {"detail": e.detail}
+    
+    try:
+        content = json.loads(response["body"]) if response["body"] else None
+    except ValueError:
+        content = response["body"].decode(errors="replace")
+    return response["status"], content
+
+@api_router.post("/batch")
+async def run_batch(batch_request: BatchRequest, request: Request, current_user: User = Depends(get_current_user)):
+    """Run sub-requests in order with one auth resolution, stopping at the first failure.
+    
+    Returns one {"status", "body"} result per operation that ran.
+    """
+    if len(batch_request.operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {BATCH_MAX_OPERATIONS} operations")
+    
+    batch = {"user": current_user, "version": data_version_cache.get(current_user.id)}
+    results = []
+    for operation in batch_request.operations:
+        status_code, body = await dispatch_subrequest(request, batch, operation)
+        results.append({"status": status_code, "body": body})
+        if status_code >= 400:
+            break
+    
+    return api_response(request, {
+        "success": all(r['status'] < 400 for r in results),
+        "results": results
+    })
 
 # ========== PUBLIC STATS ==========
 
@@ -681,7 +3570,7 @@ async def get_achievements(current_user: User = Depends(get_current_user)):
 async def get_users_count():
     """Get total registered users count (public endpoint)"""
     try:
-        count = await db.users.count_documents({})
+        count = await user_repo.count()
         return {
             "success": True,
             "users_count": count
@@ -783,7 +3672,7 @@ Return ONLY the JSON array, no other text."""
         
         # Create a copy for database insertion (will have _id added by MongoDB)
         plans_for_db = []
-        timestamp = datetime.now(timezone.utc).isoformat()
+        timestamp = datetime.now(timezone.utc)
         for plan in workout_plans:
             db_plan = json.loads(json.dumps(plan))  # Deep copy
             db_plan['user_id'] = current_user.id
@@ -791,11 +3680,13 @@ Return ONLY the JSON array, no other text."""
             plans_for_db.append(db_plan)
         
         # Delete old AI-generated plans for this user
-        await db.ai_workout_plans.delete_many({"user_id": current_user.id})
+        await delete_ai_plans(current_user.id)
         
         # Store new plans in database
         if plans_for_db:
-            await db.ai_workout_plans.insert_many(plans_for_db)
+            await ai_plan_repo.insert_many(plans_for_db)
+        await bump_data_version(current_user.id, [{"kind": "plans", "op": "replace"}])
+        await publish_event(current_user.id, "generation", {"kind": "plans", "status": "completed", "count": len(workout_plans)})
         
         # Return the original clean workout_plans (without user_id, created_at, or MongoDB _id)
         return {
@@ -813,13 +3704,10 @@ Return ONLY the JSON array, no other text."""
         raise HTTPException(status_code=500, detail=f"Failed to generate AI workouts: {str(e)}")
 
 @api_router.get("/workouts/ai-plans")
-async def get_ai_plans(current_user: User = Depends(get_current_user)):
+async def get_ai_plans(request: Request, current_user: User = Depends(get_current_user)):
     """Get user's AI-generated workout plans"""
-    plans = await db.ai_workout_plans.find(
-        {"user_id": current_user.id},
-        {"_id": 0}
-    ).to_list(100)
-    return plans
+    plans = await ai_plan_repo.for_user(current_user.id)
+    return api_response(request, plans)
 
 # ========== SCHEDULE ROUTES ==========
 
@@ -829,11 +3717,9 @@ async def generate_schedule(current_user: User = Depends(get_current_user)):
     if not current_user.available_days or len(current_user.available_days) == 0:
         raise HTTPException(status_code=400, detail="No available days set. Please update your profile.")
     
-    # Delete existing schedule
-    await db.scheduled_workouts.delete_many({"user_id": current_user.id})
-    
     # Check if user has AI-generated plans, if not generate them
-    ai_plans = await db.ai_workout_plans.find({"user_id": current_user.id}, {"_id": 0}).to_list(100)
+    ai_plans = await ai_plan_repo.for_user(current_user.id)
+    plans_generated = not ai_plans
     
     if not ai_plans:
         # Auto-generate AI workout plans
@@ -928,7 +3814,7 @@ Return ONLY the JSON array, no other text."""
             
             # Create a copy for database insertion
             plans_for_db = []
-            timestamp = datetime.now(timezone.utc).isoformat()
+            timestamp = datetime.now(timezone.utc)
             for plan in workout_plans:
                 db_plan = json.loads(json.dumps(plan))  # Deep copy
                 db_plan['user_id'] = current_user.id
@@ -937,7 +3823,7 @@ Return ONLY the JSON array, no other text."""
             
             # Store new plans in database
             if plans_for_db:
-                await db.ai_workout_plans.insert_many(plans_for_db)
+                await ai_plan_repo.insert_many(plans_for_db)
             
             ai_plans = workout_plans
             logger.info(f"Successfully generated {len(ai_plans)} AI workout plans for user {current_user.id}")
@@ -1066,76 +3952,103 @@ Return ONLY the JSON array, no other text."""
                     workout_index += 1
                 
                 schedule.append(scheduled.model_dump())
-                schedule[-1]['created_at'] = schedule[-1]['created_at'].isoformat()
             else:
                 # Day not available for user - natural rest day, reset consecutive counter
                 consecutive_workout_count = 0
     
+    # Replace the existing schedule only now that generation has succeeded, so a
+    # failed request leaves the previous schedule (and its ETags) intact
+    await schedule_repo.delete_for_user(current_user.id)
+    await journey_repo.delete(current_user.id)
     if schedule:
-        await db.scheduled_workouts.insert_many(schedule)
+        await schedule_repo.insert_many(schedule)
+    
+    await save_journey(current_user.id, schedule, {p['id']: p for p in suitable_plans})
+    changes = [{"kind": "schedule", "op": "replace"}]
+    if plans_generated:
+        changes.append({"kind": "plans", "op": "replace"})
+    await bump_data_version(current_user.id, changes)
+    await append_workout_events(current_user.id, [
+        {"type": "schedule_change", "data": {"op": "generate", "count": len(schedule)}}
+    ])
+    await publish_event(current_user.id, "generation", {"kind": "schedule", "status": "completed", "count": len(schedule)})
     
     return {"success": True, "scheduled_count": len(schedule), "message": "Workout schedule generated successfully"}
 
-@api_router.get("/schedule/calendar")
-async def get_calendar(current_user: User = Depends(get_current_user)):
-    """Get user's workout calendar"""
-    scheduled = await db.scheduled_workouts.find(
-        {"user_id": current_user.id},
-        {"_id": 0}
-    ).sort("scheduled_date", 1).to_list(1000)
-    
-    # Get workout plan details from AI-generated plans
-    workout_ids = [s['workout_plan_id'] for s in scheduled if not s['is_rest_day']]
-    
-    # First try to get from AI-generated plans
-    ai_workout_plans = await db.ai_workout_plans.find(
-        {"id": {"$in": workout_ids}},
-        {"_id": 0}
-    ).to_list(1000)
+@api_router.get("/schedule/calendar", dependencies=[Depends(check_not_modified)])
+async def get_calendar(
+    request: Request,
+    view: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    resolver: PlanResolver = Depends(get_plan_resolver)
+):
+    """Get user's workout calendar, optionally limited to a start/end date window (YYYY-MM-DD).
     
-    # Fallback to regular workout_plans if needed (for backwards compatibility)
-    if not ai_workout_plans:
-        ai_workout_plans = await db.workout_plans.find(
-            {"id": {"$in": workout_ids}},
-            {"_id": 0}
-        ).to_list(1000)
+    `fields` selects entry fields and plan fields (applied to workout_details);
+    `workout_details` alone selects the full plan.
+    """
+    normalized = wants_normalized(request, view)
+    selected = parse_fields(fields, SCHEDULE_FIELDS | PLAN_FIELDS | {"workout_details"})
+    entry_fields = plan_fields = None
+    with_plans = True
+    if selected is not None:
+        entry_fields = selected & SCHEDULE_FIELDS
+        if normalized:
+            entry_fields |= {"workout_plan_id"}
+        if "workout_details" not in selected:
+            plan_fields = selected & PLAN_FIELDS
+            with_plans = bool(plan_fields - {"id"})
+        if with_plans and not normalized:
+            entry_fields |= {"workout_details"}
     
-    plans_dict = {p['id']: p for p in ai_workout_plans}
-    
-    # Enrich scheduled workouts with plan details
-    for item in scheduled:
-        if not item['is_rest_day']:
-            item['workout_details'] = plans_dict.get(item['workout_plan_id'])
-        else:
-            item['workout_details'] = {
-                'name': 'Rest Day',
-                'difficulty': 'Recovery',
-                'duration_minutes': 0,
-                'xp_reward': 0
-            }
+    scheduled, plans_dict = await fetch_enriched_schedule(
+        current_user.id, resolver, start, end, entry_fields, with_plans
+    )
+    plans_dict = trim_plans(plans_dict, plan_fields)
+    rest_details = trim(REST_DAY_DETAILS, plan_fields)
     
-    return scheduled
+    if normalized:
+        entries = [trim(item, entry_fields) for item in render_calendar(scheduled, plans_dict, True)]
+        return normalized_response(request, {**plans_dict, "rest": rest_details}, entries)
+    entries = render_calendar(scheduled, plans_dict, False, rest_details)
+    return api_response(request, [trim(item, entry_fields) for item in entries])
 
 @api_router.delete("/schedule/reset")
 async def reset_schedule(current_user: User = Depends(get_current_user)):
     """Delete current workout schedule and AI-generated plans (will regenerate on next schedule creation)"""
     # Delete scheduled workouts
-    schedule_result = await db.scheduled_workouts.delete_many({"user_id": current_user.id})
+    deleted_schedule_count = await schedule_repo.delete_for_user(current_user.id)
+    await journey_repo.delete(current_user.id)
     
     # Delete AI-generated plans
-    ai_plans_result = await db.ai_workout_plans.delete_many({"user_id": current_user.id})
+    deleted_ai_plans_count = await delete_ai_plans(current_user.id)
+    await bump_data_version(current_user.id, [
+        {"kind": "schedule", "op": "replace"},
+        {"kind": "plans", "op": "replace"},
+    ])
+    await append_workout_events(current_user.id, [
+        {"type": "schedule_change", "data": {"op": "reset", "count": deleted_schedule_count}}
+    ])
     
     return {
         "success": True, 
-        "deleted_schedule_count": schedule_result.deleted_count,
-        "deleted_ai_plans_count": ai_plans_result.deleted_count,
+        "deleted_schedule_count": deleted_schedule_count,
+        "deleted_ai_plans_count": deleted_ai_plans_count,
         "message": "Schedule and AI plans deleted successfully. New AI plans will be generated when you create a new schedule."
     }
 
 @api_router.post("/schedule/complete/{schedule_id}")
-async def complete_scheduled_workout(schedule_id: str, duration_minutes: int, current_user: User = Depends(get_current_user)):
+async def complete_scheduled_workout(
+    schedule_id: str,
+    duration_minutes: int,
+    current_user: User = Depends(get_current_user),
+    resolver: PlanResolver = Depends(get_plan_resolver)
+):
     """Mark a scheduled workout as completed"""
-    scheduled = await db.scheduled_workouts.find_one({"id": schedule_id, "user_id": current_user.id})
+    scheduled = await schedule_repo.get(current_user.id, schedule_id)
     
     if not scheduled:
         raise HTTPException(status_code=404, detail="Scheduled workout not found")
@@ -1143,112 +4056,179 @@ async def complete_scheduled_workout(schedule_id: str, duration_minutes: int, cu
     if scheduled['is_rest_day']:
         raise HTTPException(status_code=400, detail="Cannot complete a rest day")
     
-    # Mark as completed
-    await db.scheduled_workouts.update_one(
-        {"id": schedule_id},
-        {"$set": {"is_completed": True}}
-    )
-    
-    # Record workout session (same as before)
-    # Get workout plan from AI-generated plans first
-    plan = await db.ai_workout_plans.find_one({"id": scheduled['workout_plan_id']})
-    
-    # Fallback to regular workout_plans if needed (for backwards compatibility)
-    if not plan:
-        plan = await db.workout_plans.find_one({"id": scheduled['workout_plan_id']})
+    # Resolve the plan before writing anything, so a 404 leaves no unversioned change
+    xp_reward = (await resolver.rewards([scheduled['workout_plan_id']])).get(scheduled['workout_plan_id'])
     
-    if not plan:
+    if xp_reward is None:
         raise HTTPException(status_code=404, detail="Workout plan not found")
     
+    # Mark as completed
+    await schedule_repo.set_completed(current_user.id, [schedule_id])
+    await journey_repo.set_completed(current_user.id, [schedule_id])
+    
+    # Record workout session (same as before)
     session = WorkoutSession(
         user_id=current_user.id,
         workout_plan_id=scheduled['workout_plan_id'],
-        xp_earned=plan['xp_reward'],
+        xp_earned=xp_reward,
         duration_minutes=duration_minutes,
-        status="completed"
+        status="completed",
+        schedule_id=schedule_id
     )
     session_doc = session.model_dump()
-    session_doc['date'] = session_doc['date'].isoformat()
-    await db.workout_sessions.insert_one(session_doc)
+    await session_store.insert([session_doc])
     
     # Update progress (same as before)
-    progress_doc = await db.progress.find_one({"user_id": current_user.id})
-    if not progress_doc:
-        progress_doc = Progress(user_id=current_user.id).model_dump()
-    
-    new_total_xp = progress_doc.get('total_xp', 0) + plan['xp_reward']
-    new_level = (new_total_xp // 500) + 1
-    
-    today = datetime.now(timezone.utc).date()
-    last_workout_date = progress_doc.get('last_workout_date')
-    
-    if isinstance(last_workout_date, str):
-        last_workout_date = datetime.fromisoformat(last_workout_date).date()
-    elif isinstance(last_workout_date, datetime):
-        last_workout_date = last_workout_date.date()
-    
-    current_streak = progress_doc.get('streak', 0)
-    
-    if last_workout_date:
-        days_diff = (today - last_workout_date).days
-        if days_diff == 0:
-            new_streak = current_streak
-        elif days_diff == 1:
-            new_streak = current_streak + 1
-        else:
-            new_streak = 1
-    else:
-        new_streak = 1
-    
-    achievements = progress_doc.get('achievements', [])
-    total_workouts = await db.workout_sessions.count_documents({"user_id": current_user.id})
-    
-    if total_workouts >= 5 and "first_5" not in achievements:
-        achievements.append("first_5")
-    if total_workouts >= 10 and "first_10" not in achievements:
-        achievements.append("first_10")
-    if total_workouts >= 50 and "warrior_50" not in achievements:
-        achievements.append("warrior_50")
-    if new_streak >= 7 and "streak_7" not in achievements:
-        achievements.append("streak_7")
-    if new_streak >= 30 and "streak_30" not in achievements:
-        achievements.append("streak_30")
-    
-    update_data = {
-        "total_xp": new_total_xp,
-        "level": new_level,
-        "streak": new_streak,
-        "last_workout_date": today.isoformat(),
-        "achievements": achievements
-    }
-    
-    await db.progress.update_one(
-        {"user_id": current_user.id},
-        {"$set": update_data},
-        upsert=True
-    )
+    progress_doc, update_data = await record_completions(current_user.id, [session_doc])
+    await bump_data_version(current_user.id, [
+        {"kind": "schedule", "op": "patch", "id": schedule_id, "data": {"is_completed": True}},
+        {"kind": "session", "op": "insert", "id": session.id, "data": {k: v for k, v in session_doc.items() if k != '_id'}},
+        {"kind": "progress", "op": "patch", "data": update_data},
+    ])
     
     old_achievements = progress_doc.get('achievements', [])
-    new_achievements = [a for a in achievements if a not in old_achievements]
+    new_achievements = [a for a in update_data['achievements'] if a not in old_achievements]
+    if new_achievements:
+        await publish_event(current_user.id, "achievements", {"unlocked": new_achievements})
     
     return {
         "success": True,
-        "xp_earned": plan['xp_reward'],
-        "new_total_xp": new_total_xp,
-        "new_level": new_level,
-        "new_streak": new_streak,
+        "xp_earned": xp_reward,
+        "new_total_xp": update_data['total_xp'],
+        "new_level": update_data['level'],
+        "new_streak": update_data['streak'],
         "new_achievements": new_achievements
     }
 
+# ========== COMPRESSION ==========
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    NORMALIZED_MEDIA_TYPE,
+    MSGPACK_MEDIA_TYPE,
+    "text/",
+)
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """Parse Accept-Encoding into {encoding: q}"""
+    encodings = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[name.strip().lower()] = q
+    return encodings
+
+def choose_encoding(accept_encoding: str, available) -> Optional[str]:
+    """Best of br/gzip that is both available and accepted by the client"""
+    encodings = accepted_encodings(accept_encoding)
+    for encoding in ("br", "gzip"):
+        if encoding in available and encodings.get(encoding, encodings.get("*", 0)) > 0:
+            return encoding
+    return None
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=6)
+
+def precompress(body: bytes) -> dict:
+    """Maximum-effort encodings for static payloads that are compressed once"""
+    encoded = {"gzip": gzip.compress(body, compresslevel=9)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body, quality=11)
+    return encoded
+
+class CompressionMiddleware:
+    """gzip/brotli compression for complete responses above a size threshold.
+    
+    Only allowlisted content types are compressed. Streaming responses and
+    responses that already carry a Content-Encoding pass through untouched.
+    """
+    
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, content_types=COMPRESSIBLE_TYPES):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.content_types = content_types
+        self.available = ("br", "gzip") if brotli is not None else ("gzip",)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request_headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""), self.available)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        
+        start_message = None
+        
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+            
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in start["headers"]}
+            content_type = headers.get("content-type", "")
+            
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not content_type.startswith(self.content_types)
+            ):
+                await send(start)
+                await send(message)
+                return
+            
+            compressed = compress(body, encoding)
+            raw_headers = [
+                (k, v) for k, v in start["headers"]
+                if k.lower() not in (b"content-length", b"vary")
+            ]
+            vary = headers.get("vary")
+            raw_headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", (f"{vary}, Accept-Encoding" if vary else "Accept-Encoding").encode()),
+            ]
+            await send({**start, "headers": raw_headers})
+            await send({**message, "body": compressed})
+        
+        await self.app(scope, receive, send_compressed)
+
 # ========== STARTUP ==========
 
 @app.on_event("startup")
 async def startup_event():
+    await load_date_migration_state()
+    await ensure_indexes()
     await seed_workout_plans()
+    await default_catalog.load()
+    await load_leaderboards()
+    await event_backend.start()
     logger.info("Application started")
 
 app.include_router(api_router)
 
+app.add_middleware(ETagMiddleware)
+app.add_middleware(CompressionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1265,4 +4245,5 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await event_backend.stop()
     client.close()
\ No newline at end of file
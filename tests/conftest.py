@@ -0,0 +1,50 @@
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+
+# The suite runs the app in-process on memory_store; no MongoDB is needed
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("DB_NAME", "samastu_test")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def app_db():
+    """A fresh database per test, initialized as on application startup"""
+    server.db = server.client[f"test_{uuid.uuid4().hex}"]
+    server.data_version_cache.clear()
+    server.plan_cache.clear()
+    await server.startup_event()
+    yield server.db
+    await server.event_backend.stop()
+    await server.client.drop_database(server.db.name)
+
+
+@pytest.fixture
+async def api(app_db):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+async def auth(api):
+    """Headers of a newly registered user"""
+    response = await api.post("/api/auth/register", json={
+        "email": f"test-{uuid.uuid4().hex[:8]}@samastu.com",
+        "password": "secret123",
+        "name": "Test User",
+    })
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
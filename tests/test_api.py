@@ -0,0 +1,382 @@
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+AVAILABLE_DAYS = [
+    {"day": "Monday", "minutes": 30},
+    {"day": "Wednesday", "minutes": 30},
+    {"day": "Friday", "minutes": 45},
+]
+
+
+def make_plans(user_id, count=3):
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "name": f"Test Plan {i}",
+            "difficulty": "Beginner",
+            "exercises": [{"name": "Squats", "reps": "15 reps", "sets": 3, "rest_seconds": 45, "icon": "activity"}],
+            "target_muscles": "Legs",
+            "xp_reward": 50,
+            "duration_minutes": 20,
+        }
+        for i in range(count)
+    ]
+
+
+async def schedule_user(api, app_db, auth):
+    """Seed AI plans (so no generation call is made) and generate a schedule; returns the calendar"""
+    user = (await api.get("/api/auth/me", headers=auth)).json()
+    await app_db.ai_workout_plans.insert_many(make_plans(user['id']))
+    response = await api.put("/api/user/profile", headers=auth, json={"available_days": AVAILABLE_DAYS})
+    assert response.status_code == 200
+
+    response = await api.post("/api/schedule/generate", headers=auth)
+    assert response.status_code == 200
+    assert response.json()['scheduled_count'] > 0
+
+    response = await api.get("/api/schedule/calendar", headers=auth)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_schedule_complete_sync_undo_delete(api, app_db, auth):
+    calendar = await schedule_user(api, app_db, auth)
+    workout = next(entry for entry in calendar if not entry['is_rest_day'])
+
+    response = await api.get("/api/progress", headers=auth)
+    etag = response.headers['etag']
+    response = await api.get("/api/progress", headers={**auth, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    version = (await api.get("/api/sync", headers=auth)).json()['version']
+
+    response = await api.post(f"/api/schedule/complete/{workout['id']}", headers=auth, params={"duration_minutes": 25})
+    assert response.status_code == 200
+    assert response.json()['xp_earned'] == 50
+
+    # The write moved the ETag on
+    response = await api.get("/api/progress", headers={**auth, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers['etag'] != etag
+    assert response.json()['total_xp'] == 50
+
+    sync = (await api.get("/api/sync", headers=auth, params={"since": version})).json()
+    assert not sync['full_resync']
+    changes = {(change['kind'], change['op']): change for change in sync['changes']}
+    assert changes[("schedule", "patch")]['data'] == {"is_completed": True}
+    assert changes[("progress", "patch")]['data']['total_xp'] == 50
+    session_id = changes[("session", "insert")]['id']
+
+    response = await api.post(f"/api/workouts/sessions/{session_id}/undo", headers=auth)
+    assert response.status_code == 200
+    assert response.json()['new_total_xp'] == 0
+    calendar = (await api.get("/api/schedule/calendar", headers=auth)).json()
+    assert not next(entry for entry in calendar if entry['id'] == workout['id'])['is_completed']
+
+    etag = (await api.get("/api/progress", headers=auth)).headers['etag']
+    response = await api.delete("/api/user/account", headers=auth)
+    assert response.status_code == 200
+    # The deleted user's token no longer gets a 304
+    response = await api.get("/api/progress", headers={**auth, "If-None-Match": etag})
+    assert response.status_code == 401
+    assert (await app_db.users.count_documents({})) == 0
+    assert (await app_db.scheduled_workouts.count_documents({})) == 0
+    assert (await app_db.workout_events.count_documents({})) == 0
+
+
+async def test_schedule_timestamps_are_stored_as_datetimes(api, app_db, auth):
+    calendar = await schedule_user(api, app_db, auth)
+    entry = await app_db.scheduled_workouts.find_one({"id": calendar[0]['id']})
+    assert isinstance(entry['created_at'], datetime)
+    journey = await app_db.journeys.find_one({"user_id": entry['user_id']})
+    assert isinstance(journey['updated_at'], datetime)
+    # and are served as ISO strings
+    assert datetime.fromisoformat(calendar[0]['created_at']) == entry['created_at']
+
+
+async def test_complete_unknown_plan_writes_nothing(api, app_db, auth):
+    calendar = await schedule_user(api, app_db, auth)
+    workout = next(entry for entry in calendar if not entry['is_rest_day'])
+    await app_db.ai_workout_plans.delete_many({"id": workout['workout_plan_id']})
+    server.plan_cache.clear()
+    etag = (await api.get("/api/progress", headers=auth)).headers['etag']
+
+    response = await api.post(f"/api/schedule/complete/{workout['id']}", headers=auth, params={"duration_minutes": 25})
+    assert response.status_code == 404
+    assert (await app_db.scheduled_workouts.find_one({"id": workout['id']}))['is_completed'] is False
+    response = await api.get("/api/progress", headers={**auth, "If-None-Match": etag})
+    assert response.status_code == 304
+
+
+@pytest.mark.parametrize("accept, media_type", [
+    ("application/msgpack", "application/msgpack"),
+    ("application/msgpack;q=0, application/json", "application/json"),
+    ("application/json, application/msgpack;q=0.5", "application/json"),
+    ("application/msgpack, application/json;q=0.5", "application/msgpack"),
+    ("*/*", "application/json"),
+])
+async def test_msgpack_negotiation(api, auth, accept, media_type):
+    response = await api.get("/api/progress", headers={**auth, "Accept": accept})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith(media_type)
+
+
+async def test_bulk_completes_each_scheduled_workout_once(api, app_db, auth):
+    calendar = await schedule_user(api, app_db, auth)
+    workout = next(entry for entry in calendar if not entry['is_rest_day'])
+
+    def completion(client_id):
+        return {
+            "client_id": client_id,
+            "workout_plan_id": workout['workout_plan_id'],
+            "duration_minutes": 20,
+            "completed_at": "2025-01-06T08:00:00Z",
+            "schedule_id": workout['id'],
+        }
+
+    response = await api.post("/api/workouts/complete/bulk", headers=auth, json={
+        "completions": [completion("first"), completion("second")],
+    })
+    result = response.json()
+    assert result['accepted'] == ["first"]
+    assert result['rejected'] == [{"client_id": "second", "detail": "Scheduled workout already completed"}]
+    assert result['xp_earned'] == 50
+
+    # A later upload for the same entry is not counted either
+    response = await api.post("/api/workouts/complete/bulk", headers=auth, json={"completions": [completion("third")]})
+    assert response.json()['accepted'] == []
+    assert (await api.get("/api/progress", headers=auth)).json()['total_xp'] == 50
+
+
+async def test_completion_round_trips_are_counted(api, app_db, auth):
+    user = (await api.get("/api/auth/me", headers=auth)).json()
+    plans = make_plans(user['id'], 1)
+    await app_db.ai_workout_plans.insert_many(plans)
+
+    server.round_trips.clear()
+    response = await api.post("/api/workouts/complete", headers=auth, json={"workout_plan_id": plans[0]['id'], "duration_minutes": 20})
+    assert response.status_code == 200
+    assert {
+        "ChangeLogRepository.insert_many",
+        "WorkoutEventRepository.insert_many",
+        "RollupRepository.increment",
+        f"{type(server.session_store).__name__}.insert",
+    } <= set(server.round_trips)
+
+
+@pytest.mark.parametrize("accept, normalized", [
+    ("application/vnd.samastu.normalized+json", True),
+    ("application/vnd.samastu.normalized+json;q=0, application/json", False),
+    ("application/vnd.samastu.normalized+json;q=0.5, application/json", True),
+    ("*/*", False),
+])
+async def test_normalized_negotiation(api, app_db, auth, accept, normalized):
+    await schedule_user(api, app_db, auth)
+    response = await api.get("/api/schedule/calendar", headers={**auth, "Accept": accept})
+    assert response.status_code == 200
+    assert isinstance(response.json(), dict) == normalized
+
+
+async def test_sync_reports_only_logged_versions(api, auth, monkeypatch):
+    await api.put("/api/user/profile", headers=auth, json={"goal": "strength"})
+    version = (await api.get("/api/sync", headers=auth)).json()['version']
+    insert_many = server.change_log_repo.insert_many
+    seen = []
+
+    async def sync_then_insert(entries):
+        # A sync landing between the version bump and the change log write
+        seen.append((await api.get("/api/sync", headers=auth, params={"since": version})).json())
+        await insert_many(entries)
+
+    monkeypatch.setattr(server.change_log_repo, "insert_many", sync_then_insert)
+    await api.put("/api/user/profile", headers=auth, json={"name": "Renamed"})
+    assert seen == [{"version": version, "full_resync": False, "changes": []}]
+
+    sync = (await api.get("/api/sync", headers=auth, params={"since": version})).json()
+    assert sync['version'] == version + 1
+    assert sync['changes'][0]['data'] == {"name": "Renamed"}
+
+
+async def test_sync_lists_every_weigh_in(api, auth):
+    await api.put("/api/user/profile", headers=auth, json={"goal": "strength"})
+    version = (await api.get("/api/sync", headers=auth)).json()['version']
+
+    await api.post("/api/progress/weight", headers=auth, json={"weight": 80.5, "ts": "2025-03-01T08:00:00Z"})
+    await api.post("/api/progress/weight", headers=auth, json={"weight": 80.1, "ts": "2025-03-02T08:00:00Z"})
+    await api.put("/api/user/profile", headers=auth, json={"weight": 79.8})
+
+    sync = (await api.get("/api/sync", headers=auth, params={"since": version})).json()
+    weights = [change for change in sync['changes'] if change['kind'] == "weight"]
+    assert [change['data']['weight'] for change in weights] == [80.5, 80.1, 79.8]
+    assert len({change['id'] for change in weights}) == 3
+
+
+async def test_bulk_retry_reports_duplicates(api, app_db, auth):
+    calendar = await schedule_user(api, app_db, auth)
+    workouts = [entry for entry in calendar if not entry['is_rest_day']][:2]
+    upload = {"completions": [
+        {
+            "client_id": f"c{i}",
+            "workout_plan_id": workout['workout_plan_id'],
+            "duration_minutes": 20,
+            "completed_at": f"2025-01-0{6 + i}T08:00:00Z",
+            "schedule_id": workout['id'],
+        }
+        for i, workout in enumerate(workouts)
+    ]}
+
+    first = (await api.post("/api/workouts/complete/bulk", headers=auth, json=upload)).json()
+    assert first['accepted'] == ["c0", "c1"]
+    retry = (await api.post("/api/workouts/complete/bulk", headers=auth, json=upload)).json()
+    assert retry['accepted'] == []
+    assert sorted(retry['duplicates']) == ["c0", "c1"]
+    assert retry['rejected'] == []
+    assert retry['new_total_xp'] == first['new_total_xp']
+
+
+async def seed_plan(api, app_db, auth):
+    """Insert one AI plan for the user; returns (user id, plan)"""
+    user = (await api.get("/api/auth/me", headers=auth)).json()
+    plan = make_plans(user['id'], 1)[0]
+    await app_db.ai_workout_plans.insert_one(dict(plan))
+    return user['id'], plan
+
+
+def daily_completions(plan, days, end=None):
+    """Bulk completions of `plan`, one per day for `days` days ending at `end` (default today)"""
+    end = end or datetime.now(timezone.utc).date()
+    return {"completions": [
+        {
+            "client_id": str(uuid.uuid4()),
+            "workout_plan_id": plan['id'],
+            "duration_minutes": 20,
+            "completed_at": f"{end - timedelta(days=days - 1 - i)}T08:00:00Z",
+        }
+        for i in range(days)
+    ]}
+
+
+async def test_single_completions_unlock_achievements(api, app_db, auth):
+    _, plan = await seed_plan(api, app_db, auth)
+    unlocked = []
+    for _ in range(5):
+        response = await api.post("/api/workouts/complete", headers=auth, json={"workout_plan_id": plan['id'], "duration_minutes": 20})
+        unlocked.append(response.json()['new_achievements'])
+    assert unlocked == [[], [], [], [], ["first_5"]]
+
+
+async def test_bulk_completions_unlock_achievements(api, app_db, auth):
+    _, plan = await seed_plan(api, app_db, auth)
+    result = (await api.post("/api/workouts/complete/bulk", headers=auth, json=daily_completions(plan, 7))).json()
+    assert result['new_streak'] == 7
+    assert result['new_achievements'] == ["first_5", "streak_7"]
+
+    achievements = (await api.get("/api/achievements", headers=auth)).json()
+    assert achievements['total_workouts'] == 7
+    assert {a['id'] for a in achievements['achievements'] if a['unlocked']} == {"first_5", "streak_7"}
+
+
+async def test_undo_rebuilds_progress_from_snapshots(api, app_db, auth, monkeypatch):
+    monkeypatch.setattr(server, "PROGRESS_SNAPSHOT_EVERY", 2)
+    user_id, plan = await seed_plan(api, app_db, auth)
+    for _ in range(5):
+        await api.post("/api/workouts/complete", headers=auth, json={"workout_plan_id": plan['id'], "duration_minutes": 20})
+    assert [s['seq'] for s in await app_db.progress_snapshots.find({}).sort("seq", 1).to_list(None)] == [2, 4]
+    sessions = {e['seq']: e['data']['session_id'] for e in await server.event_repo.after(user_id)}
+
+    lookups = []
+    latest = server.snapshot_repo.latest
+
+    async def spy(user_id, before_seq=None):
+        lookups.append(before_seq)
+        return await latest(user_id, before_seq)
+
+    monkeypatch.setattr(server.snapshot_repo, "latest", spy)
+
+    # Undoing seq 3 reaches back past the latest snapshot (4): rebuild from the one at 2
+    response = await api.post(f"/api/workouts/sessions/{sessions[3]}/undo", headers=auth)
+    assert response.json()['new_total_xp'] == 200
+    assert lookups == [None, 3]
+
+    # Undoing seq 1 reaches back past every snapshot: replay the whole log
+    lookups.clear()
+    response = await api.post(f"/api/workouts/sessions/{sessions[1]}/undo", headers=auth)
+    assert response.json()['new_total_xp'] == 150
+    assert lookups == [None, 1]
+
+    replayed, _ = await server.rebuild_progress(user_id, use_snapshots=False)
+    progress = (await api.get("/api/progress", headers=auth)).json()
+    assert progress['total_xp'] == replayed['total_xp'] == 150
+    assert progress['total_workouts'] == replayed['total_workouts'] == 3
+
+
+async def register(api, name):
+    response = await api.post("/api/auth/register", json={
+        "email": f"{name.lower()}-{uuid.uuid4().hex[:8]}@samastu.com",
+        "password": "secret123",
+        "name": name,
+    })
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def test_leaderboard_around_me(api, app_db, auth):
+    _, plan = await seed_plan(api, app_db, auth)
+    others = [await register(api, name) for name in ("Ana", "Budi", "Citra")]
+    for count, headers in enumerate([auth, *others], start=1):
+        for _ in range(count):
+            await api.post("/api/workouts/complete", headers=headers, json={"workout_plan_id": plan['id'], "duration_minutes": 20})
+
+    board = (await api.get("/api/leaderboard", headers=auth)).json()
+    assert [(e['name'], e['xp']) for e in board['entries']] == [("Citra", 200), ("Budi", 150), ("Ana", 100), ("Test User", 50)]
+    assert board['me'] == {"rank": 4, "xp": 50}
+
+    board = (await api.get("/api/leaderboard", headers=auth, params={"around": "me", "limit": 2})).json()
+    assert [(e['rank'], e['is_me']) for e in board['entries']] == [(3, False), (4, True)]
+    assert (await api.get("/api/leaderboard", headers=auth, params={"window": "month"})).status_code == 400
+
+
+async def test_stats_history_lists_empty_buckets(api, app_db, auth):
+    _, plan = await seed_plan(api, app_db, auth)
+    # Mon 2025-03-03 and Tue 2025-03-04, then Mon 2025-03-17
+    upload = daily_completions(plan, 2, end=date(2025, 3, 4))
+    upload['completions'] += daily_completions(plan, 1, end=date(2025, 3, 17))['completions']
+    await api.post("/api/workouts/complete/bulk", headers=auth, json=upload)
+
+    params = {"bucket": "week", "from": "2025-03-05", "to": "2025-03-20"}
+    history = (await api.get("/api/stats/history", headers=auth, params=params)).json()
+    assert history['from'] == "2025-03-03"
+    assert [(b['start'], b['workouts'], b['xp']) for b in history['buckets']] == [
+        ("2025-03-03", 2, 100),
+        ("2025-03-10", 0, 0),
+        ("2025-03-17", 1, 50),
+    ]
+
+    params = {"bucket": "month", "from": "2025-02-01", "to": "2025-03-31"}
+    history = (await api.get("/api/stats/history", headers=auth, params=params)).json()
+    assert [(b['start'], b['workouts'], b['minutes']) for b in history['buckets']] == [("2025-02-01", 0, 0), ("2025-03-01", 3, 60)]
+
+    params = {"bucket": "week", "from": "2025-03-20", "to": "2025-03-01"}
+    assert (await api.get("/api/stats/history", headers=auth, params=params)).status_code == 400
+
+
+async def test_reconcile_and_expire_streaks(api, app_db, auth):
+    user_id, plan = await seed_plan(api, app_db, auth)
+    await api.post("/api/workouts/complete/bulk", headers=auth, json=daily_completions(plan, 3))
+    assert (await app_db.progress.find_one({"user_id": user_id}))['streak'] == 3
+
+    await app_db.progress.update_one({"user_id": user_id}, {"$set": {"streak": 7}})
+    assert await server.reconcile_streaks([user_id]) == [{"user_id": user_id, "stored": 7, "expected": 3}]
+    await server.reconcile_streaks([user_id], fix=True)
+    assert await server.reconcile_streaks([user_id]) == []
+
+    today = datetime.now(timezone.utc).date()
+    assert await server.expire_streaks([user_id], today=today) == 0
+    assert await server.expire_streaks([user_id], today=today + timedelta(days=2)) == 1
+    assert (await app_db.progress.find_one({"user_id": user_id}))['streak'] == 0
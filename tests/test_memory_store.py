@@ -0,0 +1,128 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from pymongo import CursorType, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from memory_store import MemoryClient
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def db():
+    return MemoryClient(tz_aware=True)["test"]
+
+
+async def test_in_matches_values_and_array_elements(db):
+    await db.items.insert_many([
+        {"id": "a", "tags": ["x", "y"]},
+        {"id": "b", "tags": ["z"]},
+        {"id": "c"},
+    ])
+    await db.items.create_index("id", unique=True)
+
+    found = await db.items.find({"id": {"$in": ["a", "c", "missing"]}}, {"_id": 0, "id": 1}).to_list(None)
+    assert found == [{"id": "a"}, {"id": "c"}]
+    found = await db.items.find({"tags": {"$in": ["y", "z"]}}, {"_id": 0, "id": 1}).to_list(None)
+    assert [doc['id'] for doc in found] == ["a", "b"]
+
+
+async def test_inc_creates_and_adds(db):
+    await db.counters.insert_one({"id": "a", "count": 1})
+    await db.counters.update_one({"id": "a"}, {"$inc": {"count": 2, "nested.total": 5}})
+    doc = await db.counters.find_one({"id": "a"}, {"_id": 0})
+    assert doc == {"id": "a", "count": 3, "nested": {"total": 5}}
+
+
+async def test_upsert_applies_set_on_insert_only_on_insert(db):
+    update = {"$setOnInsert": {"created": 1}, "$set": {"seen": True}, "$inc": {"hits": 1}}
+    result = await db.users.update_one({"id": "a"}, update, upsert=True)
+    assert result.upserted_id is not None
+    await db.users.update_one({"id": "a"}, {**update, "$setOnInsert": {"created": 2}}, upsert=True)
+
+    doc = await db.users.find_one({"id": "a"}, {"_id": 0})
+    assert doc == {"id": "a", "created": 1, "seen": True, "hits": 2}
+
+
+async def test_group_with_sort_and_limit(db):
+    await db.sessions.insert_many([
+        {"user_id": "a", "xp": 10},
+        {"user_id": "b", "xp": 30},
+        {"user_id": "a", "xp": 25},
+        {"user_id": "c", "xp": 5},
+    ])
+    top = await db.sessions.aggregate([
+        {"$match": {"xp": {"$gte": 10}}},
+        {"$group": {"_id": "$user_id", "xp": {"$sum": "$xp"}, "count": {"$sum": 1}}},
+        {"$sort": {"xp": -1}},
+        {"$limit": 1},
+    ]).to_list(None)
+    assert top == [{"_id": "a", "xp": 35, "count": 2}]
+
+
+async def test_find_sort_skip_limit(db):
+    await db.items.insert_many([{"n": n} for n in (3, 1, 4, 1, 5)])
+    docs = await db.items.find({}, {"_id": 0}).sort([("n", -1)]).skip(1).limit(2).to_list(None)
+    assert docs == [{"n": 4}, {"n": 3}]
+
+
+async def test_bulk_upserts_and_duplicate_errors(db):
+    await db.rollups.create_index([("user_id", 1), ("day", 1)], unique=True)
+    result = await db.rollups.bulk_write([
+        UpdateOne({"user_id": "a", "day": 1}, {"$inc": {"xp": 10}}, upsert=True),
+        UpdateOne({"user_id": "a", "day": 1}, {"$inc": {"xp": 5}}, upsert=True),
+        UpdateOne({"user_id": "a", "day": 2}, {"$inc": {"xp": 7}}, upsert=True),
+    ], ordered=False)
+    assert sorted(result.upserted_ids) == [0, 2]
+    assert result.modified_count == 1
+    docs = await db.rollups.find({}, {"_id": 0}).sort("day", 1).to_list(None)
+    assert docs == [{"user_id": "a", "day": 1, "xp": 15}, {"user_id": "a", "day": 2, "xp": 7}]
+
+    with pytest.raises(BulkWriteError) as error:
+        await db.rollups.insert_many([{"user_id": "b", "day": 1}, {"user_id": "a", "day": 2}], ordered=False)
+    assert [e['index'] for e in error.value.details['writeErrors']] == [1]
+    with pytest.raises(DuplicateKeyError):
+        await db.rollups.insert_one({"user_id": "b", "day": 1})
+
+
+async def test_datetimes_are_stored_as_bson(db):
+    stamp = datetime(2025, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc)
+    await db.items.insert_one({"ts": stamp})
+    doc = await db.items.find_one({"ts": {"$type": "date"}})
+    assert doc['ts'] == stamp.replace(microsecond=123000)
+
+
+async def test_tailable_cursor_follows_inserts(db):
+    await db.create_collection("events", capped=True, size=1024 * 1024)
+    await db.events.insert_one({"n": 0})
+    cursor = db.events.find({"n": {"$gt": 0}}, cursor_type=CursorType.TAILABLE_AWAIT)
+
+    async def insert_later():
+        await asyncio.sleep(0.01)
+        await db.events.insert_many([{"n": 1}, {"n": 2}])
+
+    task = asyncio.create_task(insert_later())
+    received = [(await cursor.__anext__())['n'], (await cursor.__anext__())['n']]
+    await task
+    assert received == [1, 2]
+
+    # Without new documents iteration ends after the await timeout, but the
+    # cursor stays alive and resumes after the last document it returned
+    cursor.max_await_time_ms(10)
+    assert [doc async for doc in cursor] == []
+    await db.events.insert_one({"n": 3})
+    assert [doc['n'] async for doc in cursor] == [3]
+
+
+async def test_tailable_cursor_requires_capped_collection(db):
+    with pytest.raises(OperationFailure):
+        db.plain.find({}, cursor_type=CursorType.TAILABLE)
+
+
+async def test_capped_collection_evicts_oldest(db):
+    await db.create_collection("events", capped=True, size=1024 * 1024, max=2)
+    for n in range(4):
+        await db.events.insert_one({"n": n})
+    assert [doc['n'] for doc in await db.events.find({}).to_list(None)] == [2, 3]
@@ -0,0 +1,152 @@
+"""Unit tests for server.py's pure functions"""
+
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pytest
+
+import server
+
+
+def change(kind, op, id=None, data=None):
+    return {"kind": kind, "op": op, "id": id, "data": data}
+
+
+def test_collapse_merges_patches_of_one_entity():
+    changes = server.collapse_changes([
+        change("progress", "patch", data={"total_xp": 50, "level": 1}),
+        change("schedule", "patch", "s1", {"is_completed": True}),
+        change("progress", "patch", data={"total_xp": 100}),
+    ])
+    assert changes == [
+        change("progress", "patch", data={"total_xp": 100, "level": 1}),
+        change("schedule", "patch", "s1", {"is_completed": True}),
+    ]
+
+
+def test_collapse_keeps_patches_of_different_entities():
+    changes = server.collapse_changes([
+        change("schedule", "patch", "s1", {"is_completed": True}),
+        change("schedule", "patch", "s2", {"is_completed": True}),
+    ])
+    assert [c['id'] for c in changes] == ["s1", "s2"]
+
+
+def test_collapse_replace_supersedes_earlier_changes_of_its_kind():
+    changes = server.collapse_changes([
+        change("schedule", "patch", "s1", {"is_completed": True}),
+        change("progress", "patch", data={"streak": 2}),
+        change("schedule", "replace"),
+        change("schedule", "patch", "s2", {"is_completed": True}),
+    ])
+    assert changes == [
+        change("progress", "patch", data={"streak": 2}),
+        change("schedule", "replace"),
+    ]
+
+
+def test_collapse_delete_after_insert_keeps_the_delete():
+    changes = server.collapse_changes([
+        change("session", "insert", "w1", {"xp_earned": 50}),
+        change("session", "insert", "w2", {"xp_earned": 30}),
+        change("session", "delete", "w1"),
+    ])
+    assert changes == [
+        change("session", "insert", "w2", {"xp_earned": 30}),
+        change("session", "delete", "w1"),
+    ]
+
+
+def test_collapse_keeps_inserts_without_an_id():
+    changes = server.collapse_changes([
+        change("weight", "insert", data={"weight": 80.5}),
+        change("weight", "insert", data={"weight": 80.1}),
+    ])
+    assert [c['data']['weight'] for c in changes] == [80.5, 80.1]
+
+
+def test_unlock_achievements_checks_thresholds_per_counter():
+    assert server.unlock_achievements([], {"total_workouts": 4}) == []
+    assert server.unlock_achievements([], {"total_workouts": 10}) == ["first_5", "first_10"]
+    assert server.unlock_achievements([], {"total_workouts": 10, "streak": 7}) == ["first_5", "first_10", "streak_7"]
+
+
+def test_unlock_achievements_keeps_earned_ones():
+    # Achievements are never revoked, and not listed twice
+    assert server.unlock_achievements(["first_5", "streak_7"], {"total_workouts": 5, "streak": 0}) == ["first_5", "streak_7"]
+    assert server.unlock_achievements(["first_5"], {"total_xp": 10_000}) == ["first_5"]
+
+
+def completion(day, xp=50, minutes=20):
+    return {"type": "completion", "data": {"session_id": str(day), "date": day, "xp_earned": xp, "duration_minutes": minutes}}
+
+
+def test_apply_event_folds_completions():
+    state = server.new_progress_state()
+    for day in (date(2025, 1, 6), date(2025, 1, 7), date(2025, 1, 7)):
+        state = server.apply_event(state, completion(day, xp=200))
+    assert state['total_xp'] == 600
+    assert state['level'] == 2
+    assert state['streak'] == 2
+    assert state['total_workouts'] == 3
+    assert state['last_workout_date'] == datetime(2025, 1, 7, tzinfo=timezone.utc)
+
+
+def test_apply_event_late_upload_keeps_last_workout_date():
+    state = server.apply_event(server.new_progress_state(), completion(date(2025, 1, 10)))
+    state = server.apply_event(state, completion(date(2025, 1, 8)))
+    assert state['streak'] == 1
+    assert state['last_workout_date'] == datetime(2025, 1, 10, tzinfo=timezone.utc)
+
+
+def test_apply_event_ignores_other_events():
+    state = server.new_progress_state()
+    assert server.apply_event(state, {"type": "schedule_change", "data": {"op": "reset", "count": 3}}) is state
+
+
+@pytest.mark.anyio
+async def test_local_leaderboard_ranks_and_ranges():
+    board = server.LocalLeaderboardBackend()
+    await board.rebuild("all", {"a": 100, "b": 300, "c": 200, "zero": 0})
+    assert await board.rank("all", "b") == (0, 300)
+    assert await board.rank("all", "a") == (2, 100)
+    assert await board.rank("all", "zero") is None
+    assert await board.range("all", 1, 5) == [("c", 200), ("a", 100)]
+
+    await board.incr("all", "a", 250)
+    await board.set("all", "d", 300)
+    # Ties rank by user id
+    assert await board.range("all", 0, 4) == [("a", 350), ("b", 300), ("d", 300), ("c", 200)]
+
+    await board.set("all", "b", 0)
+    assert await board.rank("all", "b") is None
+    assert await board.rank("all", "c") == (2, 200)
+
+
+def test_bucket_starts():
+    day = date(2025, 3, 13)  # Thursday
+    assert server.bucket_start(day, "day") == day
+    assert server.bucket_start(day, "week") == date(2025, 3, 10)
+    assert server.bucket_start(day, "month") == date(2025, 3, 1)
+    assert server.next_bucket_start(date(2025, 3, 10), "week") == date(2025, 3, 17)
+    assert server.next_bucket_start(date(2025, 1, 1), "month") == date(2025, 2, 1)
+    assert server.next_bucket_start(date(2025, 12, 1), "month") == date(2026, 1, 1)
+
+
+def test_rollup_increments_per_day_and_week():
+    sessions = [
+        {"date": datetime(2025, 3, 10, 8, tzinfo=timezone.utc), "duration_minutes": 20, "xp_earned": 50},
+        {"date": datetime(2025, 3, 12, 8, tzinfo=timezone.utc), "duration_minutes": 30, "xp_earned": 70},
+    ]
+    increments = server.rollup_increments(sessions, sign=-1)
+    assert increments[("day", "2025-03-10")] == {"workouts": -1, "minutes": -20, "xp": -50}
+    assert increments[("week", "2025-03-10")] == {"workouts": -2, "minutes": -50, "xp": -120}
+    assert len(increments) == 3
+
+
+def test_compute_streaks_counts_the_run_ending_at_the_last_day():
+    # User 0: days 5, 6, 6, 8, 9, 10 (gap at 7); user 1: 1, 2 (lapsed); user 2: 9
+    user_codes = np.array([0, 1, 0, 0, 2, 0, 1, 0, 0])
+    days = np.array([10, 2, 5, 6, 9, 8, 1, 9, 6])
+    users, streaks = server.compute_streaks(user_codes, days, today=10)
+    assert dict(zip(users.tolist(), streaks.tolist())) == {0: 3, 1: 0, 2: 1}
@@ -0,0 +1,61 @@
+"""Both session storage layouts against the same contract"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(params=sorted(server.SESSION_STORES))
+async def store(request, app_db, monkeypatch):
+    store = server.SESSION_STORES[request.param]()
+    await store.ensure_indexes()
+    monkeypatch.setattr(server, "session_store", store)
+    return store
+
+
+def session(client_id, month, xp=50, user_id="u1"):
+    return {
+        **server.WorkoutSession(
+            user_id=user_id,
+            workout_plan_id="p1",
+            date=datetime(2025, month, 10, tzinfo=timezone.utc),
+            xp_earned=xp,
+            duration_minutes=20,
+            status="completed",
+        ).model_dump(),
+        "client_id": client_id,
+    }
+
+
+async def test_client_id_is_unique_per_user_across_months(store):
+    assert await store.insert([session("a", 1), session("b", 1)]) == set()
+    assert await store.insert([session("a", 2), session("c", 2), session("c", 3)]) == {0, 2}
+    assert await store.insert([session("a", 1, user_id="u2")]) == set()
+
+    assert await store.uploaded("u1", ["a", "c", "d"]) == {"a", "c"}
+    assert (await store.totals(["u1"]))["u1"] == {"total_workouts": 3, "total_minutes": 60}
+    assert await store.xp_since(datetime(2025, 1, 1, tzinfo=timezone.utc)) == {"u1": 150, "u2": 50}
+
+
+async def test_deleting_sessions_frees_their_client_ids(store):
+    first = session("a", 1)
+    await store.insert([first, session("b", 1)])
+    await store.delete("u1", await store.find("u1", first['id']))
+    assert await store.uploaded("u1", ["a", "b"]) == {"b"}
+    assert await store.insert([session("a", 2)]) == set()
+
+    await store.delete_users(["u1"])
+    assert await store.uploaded("u1", ["a", "b"]) == set()
+    assert await store.insert([session("b", 3)]) == set()
+
+
+async def test_migrated_sessions_keep_their_client_ids(store):
+    source = next(cls() for name, cls in server.SESSION_STORES.items() if not isinstance(store, cls))
+    await source.ensure_indexes()
+    await source.insert([session("a", 1), session("b", 2)])
+    assert await server.migrate_sessions(source, store, ["u1"]) == 2
+    assert await store.insert([session("a", 3), session("b", 1)]) == {0, 1}